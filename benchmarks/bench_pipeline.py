@@ -0,0 +1,477 @@
+'''
+End-to-end benchmarks of the acquisition -> plot -> export path, run against the
+simulated instrument (helpers.simulator, POSIX only) with the matplotlib Agg backend
+
+    python -m benchmarks.bench_pipeline --out results.json
+    python -m benchmarks.bench_pipeline --out new.json --compare results.json
+
+Every stage drives the real functions of the application (serial_commands, the device
+worker and drain_samples, render_line, export_data) on a KeithleyApp-like namespace
+with the same dictionaries as main.py, so no Tk window is needed.
+'''
+import argparse, datetime, json, os, platform, resource, subprocess, sys, tempfile, time, tracemalloc
+from types import SimpleNamespace
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+from helpers import serial_commands as sc
+from helpers import plot_commands as pc
+from helpers.export_commands import StreamRecorder
+from helpers.exporter import FORMATS
+from helpers.viewer import RunLoader
+from helpers.instrumentation import monitor
+from helpers.simulator import SimulatedKeithley
+
+HISTORY_SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+EXPORT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+class _Variable:
+    '''Stand-in for the Tk variables of KeithleyApp (get/set only)'''
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class _Widget:
+    '''Stand-in for the CTk widgets that are only configured by the helpers'''
+
+    def configure(self, **kwargs):
+        pass
+
+
+class _Root:
+    '''Stand-in for the CTk root: the benchmark calls the periodic tasks itself'''
+
+    def after(self, ms, func=None, *args):
+        pass
+
+    def _get_appearance_mode(self):
+        return 'light'
+
+
+def make_app(history_limit: int = 0, acq_mode: str = 'Single', burst_size: int = 100,
+             export_directory: str | None = None) -> SimpleNamespace:
+    '''
+    Build an object with the attributes of KeithleyApp used by the helpers
+
+    Args:
+        history_limit (int): History limit (0 = unlimited)
+        acq_mode (str): 'Single' or 'Burst'
+        burst_size (int): Readings per burst
+        export_directory (str): Export directory
+
+    Returns:
+        SimpleNamespace: Application state with a figure of 800x500 px
+    '''
+    app = SimpleNamespace(
+        root=_Root(),
+        device={'com_ports': [], 'selected_device': ''},
+        data={'export_directory': export_directory, 'export_name': None, 'sample_name': '', 'sample_info': '',
+              'first_time': None, 'wall_offset': None, 'series': {}, 'running': False, 'last_data': None, 'last_time': None,
+              'nplc': 0.01, 'filter_spec': ''},
+        text={'smp_name': _Variable('Benchmark'), 'smp_info': _Variable('Simulated instrument'),
+              'export_name': _Variable('benchmark')},
+        plot={'background': None, 'toolbar': None, 'last_drain': None, 'dirty': set(), 'last_frame': 0.0,
+              'theme': None, 'overlays': []},
+        workers={},
+        int_rate=_Variable(0.01),
+        acq_mode=_Variable(acq_mode),
+        burst_size=_Variable(burst_size),
+        auto_nplc=_Variable('Off'),
+        auto_target=_Variable(100.0),
+        timestamp_mode=_Variable('Host'),
+        max_fps=_Variable(pc.MAX_FPS),
+        filter_spec=_Variable(''),
+        history_limit=_Variable(history_limit),
+        stats_window=_Variable(60.0),
+        stats_window_unit=_Variable('Seconds'),
+        stats_str=_Variable('N/A'),
+        data_format=_Variable('ASCII'),
+        record_to_file=_Variable(False),
+        fsync_interval=_Variable(5.0),
+        export_format=_Variable('.dat'),
+        export_status=_Variable(''),
+        export_progress=_Variable(0.0),
+        export_cancel_btn=_Widget(),
+        exporter=None,
+        last_data_str=_Variable('N/A'),
+        export_performance=_Variable(False),
+    )
+    app.fig, app.line, app.ax = pc.initialize_plot(app)
+    app.fig.set_size_inches(8, 5)
+    app.fig.set_dpi(100)
+    pc.enable_blitting(app)
+    pc.enable_zoom_decimation(app)
+    return app
+
+def close_app(app: SimpleNamespace):
+    '''Stop the device workers and close the figure of a benchmark application'''
+    for worker in app.workers.values():
+        worker.shutdown()
+    for worker in app.workers.values():
+        worker._thread.join(timeout=2.0)
+    matplotlib.pyplot.close(app.fig)
+
+def summarize(values_s) -> dict:
+    '''
+    Percentiles of a list of durations
+
+    Args:
+        values_s (array_like): Durations (s)
+
+    Returns:
+        dict: Count, mean, p50, p90, p99 and max in milliseconds
+    '''
+    values = np.asarray(values_s, dtype=np.float64) * 1e3
+    if len(values) == 0:
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'count': len(values), 'mean_ms': float(values.mean()), 'p50_ms': float(p50),
+            'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+def bench_serial(port: str, samples: int) -> dict:
+    '''
+    Round trip of query/send and of query_values in every transfer format
+
+    Args:
+        port (str): Port of the simulated instrument
+        samples (int): Queries per measurement
+
+    Returns:
+        dict: Samples/s and latency percentiles by case
+    '''
+    results = {}
+    sc.initialize_instrument(port, 0.01, 'ASCII')
+
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        sc.send(port, 'NPLC 0.01')
+        latencies.append(time.perf_counter() - start)
+    results['send'] = summarize(latencies)
+
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        sc.query(port, 'READ?')
+        latencies.append(time.perf_counter() - start)
+    results['query'] = {'samples_per_s': samples / sum(latencies), 'latency': summarize(latencies)}
+
+    for data_format in sc.DATA_FORMATS:
+        sc.set_data_format(port, data_format)
+        latencies = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            sc.query_values(port, 'READ?')
+            latencies.append(time.perf_counter() - start)
+        results[f'query_values_{data_format}'] = {'samples_per_s': samples / sum(latencies),
+                                                  'latency': summarize(latencies)}
+
+        sc.configure_burst(port, 1000)
+        start = time.perf_counter()
+        bursts = max(1, samples // 1000)
+        for _ in range(bursts):
+            sc.read_burst(port, 1000, 0.01)
+        elapsed = time.perf_counter() - start
+        sc.configure_single(port)
+        results[f'burst_{data_format}'] = {'samples_per_s': bursts * 1000 / elapsed,
+                                           'per_burst_ms': elapsed / bursts * 1e3}
+    sc.close_all_connections()
+    return results
+
+def bench_update_data(samples: int) -> dict:
+    '''
+    Throughput of update_data (SampleStore.extend) for single readings and bursts
+
+    Args:
+        samples (int): Samples appended per case
+
+    Returns:
+        dict: Samples/s by block size and store mode
+    '''
+    results = {}
+    for ring in (False, True):
+        for block in (1, 100, 1000):
+            series = {'samples': pc.SampleStore(100_000, ring=True) if ring else pc.SampleStore()}
+            times = np.arange(block, dtype=np.float64)
+            readings = np.ones(block)
+            blocks = max(1, samples // block)
+            start = time.perf_counter()
+            for _ in range(blocks):
+                pc.update_data(series, readings, times)
+            elapsed = time.perf_counter() - start
+            results[f'{"ring" if ring else "growable"}_block_{block}'] = {'samples_per_s': blocks * block / elapsed}
+    return results
+
+def fill_series(app: SimpleNamespace, port: str, points: int, rng: np.random.Generator) -> dict:
+    '''Add a series to the benchmark application with `points` samples (1 kHz, values in [0, 1e-9))'''
+    pc.add_series(app, port)
+    series = app.data['series'][port]
+    chunk = 1_000_000
+    for first in range(0, points, chunk):
+        n = min(chunk, points - first)
+        pc.update_data(series, rng.random(n) * 1e-9, (first + np.arange(n)) * 1e-3)
+    return series
+
+def bench_plot(sizes, frames: int) -> list[dict]:
+    '''
+    Frame time of the plot versus history length: full redraw (limits change) and
+    incremental frames (one new block of 100 samples blitted over the background)
+
+    Args:
+        sizes (iterable): History lengths
+        frames (int): Incremental frames measured per length
+
+    Returns:
+        list: One result per history length
+    '''
+    results = []
+    rng = np.random.default_rng(0)
+    for points in sizes:
+        app = make_app()
+        tracemalloc.start()
+        series = fill_series(app, 'BENCH', points, rng)
+        start = time.perf_counter()
+        series['pyramid'].update()
+        build = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        pc.render_line(app)   # primer dibujado: ajusta los ejes y redibuja la figura
+        first_frame = time.perf_counter() - start
+
+        full, incremental = [], []
+        for _ in range(max(1, frames // 10)):
+            start = time.perf_counter()
+            app.fig.canvas.draw()
+            full.append(time.perf_counter() - start)
+
+        t_next = series['samples'].last()[0]
+        for _ in range(frames):
+            times = t_next + (1 + np.arange(100)) * 1e-3
+            t_next = times[-1]
+            pc.update_data(series, rng.random(100) * 1e-9, times)
+            start = time.perf_counter()
+            pc.render_line(app)
+            incremental.append(time.perf_counter() - start)
+
+        results.append({'points': points, 'pyramid_build_s': build, 'first_frame_ms': first_frame * 1e3,
+                        'full_redraw': summarize(full), 'incremental_frame': summarize(incremental),
+                        'line_points': len(series['line'].get_xdata()), 'peak_memory_mb': peak / 2**20})
+        close_app(app)
+    return results
+
+def bench_acquisition(port: str, duration: float, acq_mode: str) -> dict:
+    '''
+    Acquisition through the device worker with the Tk-side drain (update_data, label and
+    render_line) called every DRAIN_INTERVAL_MS, as in the application
+
+    Args:
+        port (str): Port of the simulated instrument
+        duration (float): Seconds to acquire
+        acq_mode (str): 'Single' or 'Burst'
+
+    Returns:
+        dict: Samples/s, drain times and worker stalls
+    '''
+    app = make_app(acq_mode=acq_mode, burst_size=1000)
+    pc.add_series(app, port)
+    worker = app.workers[port]
+    worker.submit(sc.initialize_instrument, port, 0.01, 'SREAL')
+    pc.start_acquisition(app)
+
+    drains = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        time.sleep(pc.DRAIN_INTERVAL_MS / 1e3)
+        t0 = time.perf_counter()
+        pc.drain_samples(app)
+        drains.append(time.perf_counter() - t0)
+    pc.stop_plot(app)
+    while worker.acquiring:
+        time.sleep(0.01)
+    pc.drain_samples(app)
+
+    samples = app.data['series'][port]['samples'].total
+    result = {'samples': samples, 'samples_per_s': samples / duration, 'drain': summarize(drains),
+              'worker_stalls': worker.stalls, 'stages': monitor.snapshot()['stages']}
+    close_app(app)
+    sc.close_all_connections()
+    return result
+
+def _export(app: SimpleNamespace):
+    '''Run export_data and wait for its background exporter'''
+    from helpers.gui_commands import export_data, poll_export
+
+    export_data(app)
+    if app.exporter is not None:
+        app.exporter.done.wait()
+        poll_export(app)
+
+def bench_export(sizes, directory: str) -> list[dict]:
+    '''
+    Time and peak memory of export_data in every format and of the streaming recorder,
+    and time to open every exported file in the offline viewer
+
+    Args:
+        sizes (iterable): Number of exported samples
+        directory (str): Temporary export directory
+
+    Returns:
+        list: One result per size ('.dat' at the top level, every format in 'formats')
+    '''
+    results = []
+    rng = np.random.default_rng(0)
+    for points in sizes:
+        app = make_app(export_directory=directory)
+        series = fill_series(app, 'BENCH', points, rng)
+
+        formats = {}
+        for export_format in FORMATS:
+            app.export_format.set(export_format)
+            path = os.path.join(directory, 'benchmark' + export_format)
+            start = time.perf_counter()
+            _export(app)
+            elapsed = time.perf_counter() - start
+
+            tracemalloc.start()
+            _export(app)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            formats[export_format] = {'export_s': elapsed, 'rows_per_s': points / elapsed,
+                                      'file_mb': os.path.getsize(path) / 2**20, 'peak_memory_mb': peak / 2**20}
+            # Visor: primera apertura (conversión y caché de los ficheros de texto) y reapertura
+            for key in ('open_s', 'reopen_s'):
+                loader = RunLoader(path)
+                start = time.perf_counter()
+                loader.start()
+                loader.done.wait()
+                formats[export_format][key] = time.perf_counter() - start
+        elapsed, size, peak = (formats['.dat']['export_s'], formats['.dat']['file_mb'] * 2**20,
+                               formats['.dat']['peak_memory_mb'] * 2**20)
+
+        recorder = StreamRecorder(os.path.join(directory, 'record.dat'), '', 'Relative time (s)\tCurrent (A)')
+        times, currents = series['samples'].time, series['samples'].current
+        start = time.perf_counter()
+        for first in range(0, points, 1000):
+            recorder.write(times[first:first + 1000], currents[first:first + 1000])
+        recorder.close()
+        recorded = time.perf_counter() - start
+
+        results.append({'points': points, 'export_s': elapsed, 'export_rows_per_s': points / elapsed,
+                        'file_mb': size / 2**20, 'export_peak_memory_mb': peak / 2**20,
+                        'record_s': recorded, 'record_rows_per_s': points / recorded, 'formats': formats})
+        close_app(app)
+    return results
+
+def bench_startup(repeats: int = 5) -> dict:
+    '''
+    Import time of main.py in a fresh interpreter (the part of the startup before the
+    window is created) and whether matplotlib was already imported at that point
+
+    Args:
+        repeats (int): Number of interpreters started
+
+    Returns:
+        dict: Import time summary and matplotlib flag
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ('import time, sys; start = time.perf_counter(); import main; '
+              'print(time.perf_counter() - start, "matplotlib" in sys.modules)')
+    durations, loaded = [], False
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                cwd=root, check=True).stdout.split()
+        durations.append(float(output[0]))
+        loaded = loaded or output[1] == 'True'
+    return {'import_main': summarize(durations), 'matplotlib_at_import': loaded}
+
+def metadata() -> dict:
+    '''Versions, platform and commit of the run'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(), 'processor': platform.processor()}
+
+def flatten(results, prefix: str = '') -> dict:
+    '''Flatten nested results into {"stage.case.metric": value}; lists are keyed by their "points"'''
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, f'{prefix}{key}.'))
+    elif isinstance(results, list):
+        for item in results:
+            flat.update(flatten(item, f'{prefix}{item.get("points", "")}.'))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix[:-1]] = results
+    return flat
+
+def compare(current: dict, baseline: dict):
+    '''
+    Print every metric of two runs side by side with their ratio
+
+    Args:
+        current (dict): Results of this run
+        baseline (dict): Results of a previous run
+    '''
+    new, old = flatten({k: v for k, v in current.items() if k != 'meta'}), \
+               flatten({k: v for k, v in baseline.items() if k != 'meta'})
+    print(f'{"metric":<60} {"baseline":>12} {"current":>12} {"ratio":>8}')
+    for key in sorted(new.keys() & old.keys()):
+        ratio = new[key] / old[key] if old[key] else float('nan')
+        print(f'{key:<60} {old[key]:>12.4g} {new[key]:>12.4g} {ratio:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_pipeline',
+                                     description='Benchmark the acquisition -> plot -> export path')
+    parser.add_argument('--out', default='benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', metavar='JSON', help='Print the ratios against a previous results file')
+    parser.add_argument('--samples', type=int, default=2000, help='Queries per serial measurement')
+    parser.add_argument('--duration', type=float, default=3.0, help='Seconds of acquisition per mode')
+    parser.add_argument('--frames', type=int, default=100, help='Incremental frames per history length')
+    parser.add_argument('--max-history', type=int, default=HISTORY_SIZES[-1], help='Largest history length')
+    parser.add_argument('--max-export', type=int, default=EXPORT_SIZES[-1], help='Largest export size')
+    parser.add_argument('--latency', action='store_true',
+                        help='Emulate the NPLC integration time (default: measure the software overhead only)')
+    args = parser.parse_args()
+
+    results = {'meta': metadata()}
+    print('startup...', file=sys.stderr)
+    results['startup'] = bench_startup()
+    with SimulatedKeithley(latency=args.latency, overhead=0.0, seed=0) as instrument:
+        print('serial...', file=sys.stderr)
+        results['serial'] = bench_serial(instrument.port, args.samples)
+        print('acquisition...', file=sys.stderr)
+        results['acquisition'] = {mode.lower(): bench_acquisition(instrument.port, args.duration, mode)
+                                  for mode in ('Single', 'Burst')}
+    print('update_data...', file=sys.stderr)
+    results['update_data'] = bench_update_data(1_000_000)
+    print('plot...', file=sys.stderr)
+    results['plot'] = bench_plot([n for n in HISTORY_SIZES if n <= args.max_history], args.frames)
+    print('export...', file=sys.stderr)
+    with tempfile.TemporaryDirectory() as directory:
+        results['export'] = bench_export([n for n in EXPORT_SIZES if n <= args.max_export], directory)
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10   # KiB en Linux
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.out}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,260 @@
+'''
+Headless acquisition: stream the readings of one instrument to a .dat file without
+the Tk window or matplotlib
+
+    python -m helpers.acquire COM3 --nplc 0.1 --duration 60 --out run.dat
+    python -m helpers.acquire COM3 --recipe sweep.json --out run.dat
+
+The file has the same comments, header and columns as the GUI export, and the
+summary line (samples/s) can be compared with the rate the GUI prints on STOP.
+'''
+import argparse, asyncio, signal, time
+from threading import Event
+
+import numpy as np
+
+from .serial_commands import (initialize_instrument, query_values, configure_burst, configure_single,
+                              read_burst, close_connection, close_all_connections, list_ports,
+                              start_trace, stop_trace, DATA_FORMATS, MAX_BURST_POINTS)
+from .export_commands import StreamRecorder, format_metadata, DATA_COLUMNS, CLOCK_COLUMNS
+from .sequencer import load_recipe, send_block, describe_block
+from .instrumentation import monitor
+from .clock import InstrumentClock
+
+
+def describe_port(serial_com: str) -> str:
+    '''
+    Description of a port as listed by the GUI (the port itself if it is not listed)
+
+    Args:
+        serial_com (str): Serial port of the device
+
+    Returns:
+        str: Port description
+    '''
+    for port in list_ports():
+        if port.device == serial_com:
+            return str(port)
+    return serial_com
+
+def write_block(recorder: StreamRecorder, host_times: np.ndarray, values: np.ndarray, first_time: float,
+                clock: InstrumentClock | None = None):
+    '''
+    Write a block with host timestamps or, with a clock, with the instrument timestamps
+    mapped onto the host clock plus the host and instrument time columns (as the GUI
+    does in the "Instrument" timestamp mode)
+
+    Args:
+        recorder (StreamRecorder): Output file
+        host_times (np.ndarray): Host time.perf_counter() of every reading
+        values (np.ndarray): Structured array of readings (query_values)
+        first_time (float): Origin of the relative times (time.perf_counter)
+        clock (InstrumentClock): Instrument clock mapping (None = host timestamps)
+    '''
+    readings = values['reading']
+    if clock is None:
+        recorder.write(host_times - first_time, readings)
+        return
+    instrument_times = values['timestamp'].astype(np.float64)
+    clock.add(instrument_times[-1], host_times[-1])
+    monitor.gauge('clock_drift_ppm', clock.drift_ppm)
+    recorder.write(clock.to_host(instrument_times) - first_time, readings, host_times - first_time, instrument_times)
+
+def acquire(serial_com: str, recorder: StreamRecorder, duration: float = 0.0, burst_size: int = 0,
+            nplc: float = 1.0, stop: Event | None = None, first_time: float | None = None,
+            clock: InstrumentClock | None = None) -> int:
+    '''
+    Read the instrument in a loop and write every block to the recorder. Single readings
+    are stamped with the midpoint of their READ? request, burst readings are spread
+    evenly over the burst
+
+    Args:
+        serial_com (str): Serial port of the device (already initialized)
+        recorder (StreamRecorder): Output file
+        duration (float): Seconds to acquire (0 = until stopped)
+        burst_size (int): Readings per trace buffer burst (0 = one READ? per reading)
+        nplc (float): Integration rate, used to size the burst timeouts
+        stop (Event): Set to end the acquisition early
+        first_time (float): Origin of the relative times (time.perf_counter, now by default)
+        clock (InstrumentClock): Stamp the readings with the instrument clock (None = host clock)
+
+    Returns:
+        int: Number of samples written
+    '''
+    stop = stop or Event()
+    samples = 0
+    if burst_size:
+        configure_burst(serial_com, burst_size)
+    started = time.perf_counter()
+    first_time = started if first_time is None else first_time
+    deadline = started + duration if duration > 0 else float('inf')
+    try:
+        while not stop.is_set() and time.perf_counter() < deadline:
+            if burst_size:
+                start, end, values = read_burst(serial_com, burst_size, nplc)
+                host_times = np.linspace(start, end, len(values) + 1)[1:]
+            else:
+                request_ns = time.perf_counter_ns()
+                values = query_values(serial_com, 'READ?')
+                response_ns = time.perf_counter_ns()
+                host_times = np.full(len(values), (request_ns + response_ns) / 2e9)  # punto medio de la petición
+            write_block(recorder, host_times, values, first_time, clock)
+            samples += len(values)
+            monitor.count('samples', len(values))
+    finally:
+        if burst_size:
+            configure_single(serial_com)
+    return samples
+
+def run_recipe(serial_com: str, blocks: list[dict], recorder: StreamRecorder, burst_size: int = 0,
+               nplc: float = 1.0, stop: Event | None = None, clock: InstrumentClock | None = None) -> int:
+    '''
+    Run the blocks of a recipe (helpers.sequencer): send the batched commands of
+    each block, wait its dwell and acquire its segment into the same file, with the
+    times of the whole recipe on one axis and a '#' line at the start of every segment
+
+    Args:
+        serial_com (str): Serial port of the device
+        blocks (list): Blocks of compile_recipe()
+        recorder (StreamRecorder): Output file
+        burst_size (int): Readings per burst of the segments without mode (0 = single)
+        nplc (float): Integration rate until a block sets it
+        stop (Event): Set to end the recipe early
+        clock (InstrumentClock): Stamp the readings with the instrument clock (None = host clock)
+
+    Returns:
+        int: Number of samples written
+    '''
+    stop = stop or Event()
+    samples = 0
+    first_time = time.perf_counter()
+    for block in blocks:
+        if stop.is_set():
+            break
+        send_block(serial_com, block)
+        nplc = block['nplc'] or nplc
+        if stop.wait(block['dwell']) or not block['acquire']:
+            continue
+        segment_burst = burst_size
+        if block['mode'] is not None:
+            segment_burst = (block['burst_size'] or burst_size or 100) if block['mode'] == 'Burst' else 0
+        recorder.comment(f't={time.perf_counter() - first_time:.6f} s Recipe: {describe_block(block)}')
+        print(describe_block(block))
+        samples += acquire(serial_com, recorder, block['acquire'], segment_burst, nplc, stop, first_time, clock)
+    return samples
+
+async def acquire_pipelined(serial_com: str, recorder: StreamRecorder, duration: float = 0.0,
+                            depth: int = 2, data_format: str = 'ASCII', stop: Event | None = None,
+                            clock: InstrumentClock | None = None) -> int:
+    '''
+    Same as acquire() in single mode, keeping `depth` READ? queries in flight
+    with the asyncio client
+
+    Args:
+        serial_com (str): Serial port of the device (already initialized)
+        recorder (StreamRecorder): Output file
+        duration (float): Seconds to acquire (0 = until stopped)
+        depth (int): Queries queued in the device at any time
+        data_format (str): Transfer format configured in the device
+        stop (Event): Set to end the acquisition early
+        clock (InstrumentClock): Stamp the readings with the instrument clock (None = arrival
+            time of the response, as several requests are in flight there is no request midpoint)
+
+    Returns:
+        int: Number of samples written
+    '''
+    from .async_serial import AsyncSCPIClient
+
+    stop = stop or Event()
+    samples = 0
+    close_connection(serial_com)   # el puerto pasa al cliente asyncio
+    client = await AsyncSCPIClient.open(serial_com)
+    try:
+        await client.set_data_format(data_format)
+        first_time = time.perf_counter()
+        deadline = first_time + duration if duration > 0 else float('inf')
+        async for arrived, values in client.stream('READ?', depth):
+            write_block(recorder, np.full(len(values), arrived), values, first_time, clock)
+            samples += len(values)
+            monitor.count('samples', len(values))
+            if stop.is_set() or arrived >= deadline:
+                break
+    finally:
+        await client.close()
+    return samples
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m helpers.acquire',
+                                     description='Acquire from a Keithley picoammeter without the GUI')
+    parser.add_argument('port', help='Serial port of the device')
+    parser.add_argument('--out', required=True, help='Output .dat file (written as <out>.part until the end)')
+    parser.add_argument('--nplc', type=float, default=1.0, help='Integration rate (NPLC)')
+    parser.add_argument('--duration', type=float, default=0.0, help='Seconds to acquire (0 = until Ctrl+C)')
+    parser.add_argument('--format', choices=list(DATA_FORMATS), default='ASCII', help='Transfer format')
+    parser.add_argument('--burst', type=int, default=0, metavar='N',
+                        help=f'Read bursts of N readings through the trace buffer (1 to {MAX_BURST_POINTS})')
+    parser.add_argument('--timestamps', choices=['host', 'instrument'], default='host',
+                        help='host: midpoint of every READ? request (arrival of the response with --pipeline); '
+                             'instrument: reading timestamps of the device mapped onto the host clock, '
+                             'plus the host and instrument time columns')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='DEPTH',
+                        help='Keep DEPTH READ? queries in flight (asyncio client, single mode only)')
+    parser.add_argument('--recipe', metavar='FILE',
+                        help='Run the measurement recipe in FILE (JSON, see helpers.sequencer) instead of --duration')
+    parser.add_argument('--fsync-interval', type=float, default=5.0, help='Seconds between fsync calls')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Record the serial traffic to FILE (JSON lines, replayable with helpers.simulator)')
+    parser.add_argument('--perf', metavar='FILE', help='Write the per-stage timing statistics to FILE (JSON)')
+    parser.add_argument('--sample-name', default='', help='Sample name written in the header')
+    parser.add_argument('--sample-info', default='', help='Sample information written in the header')
+    args = parser.parse_args(argv)
+    if not 0 <= args.burst <= MAX_BURST_POINTS:
+        parser.error(f'--burst must be between 1 and {MAX_BURST_POINTS} (trace buffer size)')
+    if args.burst and args.pipeline:
+        parser.error('--burst and --pipeline cannot be combined')
+    if args.recipe and args.pipeline:
+        parser.error('--recipe and --pipeline cannot be combined')
+    blocks = []
+    if args.recipe:
+        try:
+            name, blocks = load_recipe(args.recipe)
+        except (OSError, ValueError) as e:
+            parser.error(f'invalid recipe {args.recipe}: {e}')
+        print(f'Recipe {name}:' + ''.join(f'\n  {describe_block(block)}' for block in blocks))
+
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    if args.trace:
+        start_trace(args.trace)
+    if not (blocks and blocks[0]['init']):   # una receta con "init" inicializa el instrumento ella misma
+        initialize_instrument(args.port, args.nplc, args.format)
+    clock = InstrumentClock() if args.timestamps == 'instrument' else None
+    columns = [DATA_COLUMNS + CLOCK_COLUMNS] if clock is not None else None
+    comments, header = format_metadata(args.sample_name, args.sample_info, [describe_port(args.port)], [args.port],
+                                       columns)
+    recorder = StreamRecorder(args.out, comments, header, args.fsync_interval)
+
+    start = time.perf_counter()
+    try:
+        if args.recipe:
+            run_recipe(args.port, blocks, recorder, args.burst, args.nplc, stop, clock)
+        elif args.pipeline:
+            asyncio.run(acquire_pipelined(args.port, recorder, args.duration, args.pipeline, args.format, stop, clock))
+        else:
+            acquire(args.port, recorder, args.duration, args.burst, args.nplc, stop, clock=clock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.perf_counter() - start
+        recorder.close()
+        close_all_connections()
+        stop_trace()
+        if args.perf:
+            monitor.write(args.perf)
+
+    print(f'{recorder.rows} samples in {elapsed:.2f} s: {recorder.rows / elapsed:.1f} samples/s -> {args.out}')
+
+
+if __name__ == '__main__':
+    main()
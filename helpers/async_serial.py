@@ -0,0 +1,284 @@
+import asyncio
+import os, sys, time
+from collections import deque
+from threading import Thread
+
+import numpy as np
+import serial
+
+from .serial_commands import (SERIAL_SETTINGS, WRITE_TERMINATOR, READ_TERMINATOR, DEFAULT_ELEMENTS,
+                              DATA_FORMATS, reading_dtype, parse_ascii_values)
+
+
+async def open_serial_connection(serial_com: str, **settings) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    '''
+    Open a serial port as an asyncio stream pair
+
+    On POSIX the port file descriptor is registered in the event loop as a read pipe and
+    a (duplicated) write pipe, so no thread is involved; any tty works, including the
+    slave side of a pty (os.openpty) used as a stand-in for the instrument. On Windows
+    a reader thread feeds the stream and writes go through the default executor.
+
+    Args:
+        serial_com (str): Serial port of the device (or pty path)
+        **settings: pyserial settings overriding SERIAL_SETTINGS
+
+    Returns:
+        reader (asyncio.StreamReader): Stream of bytes received from the device
+        writer (asyncio.StreamWriter): Stream to write commands to the device
+    '''
+    loop = asyncio.get_running_loop()
+    ser = serial.Serial(serial_com, **{**SERIAL_SETTINGS, **settings})
+    ser.reset_input_buffer()
+    reader = asyncio.StreamReader(limit=1 << 22)
+    protocol = asyncio.StreamReaderProtocol(reader)
+
+    if sys.platform == 'win32':
+        return reader, _ThreadedSerialWriter(ser, reader, protocol, loop)
+
+    read_file = os.fdopen(ser.fileno(), 'rb', buffering=0, closefd=False)
+    write_file = os.fdopen(os.dup(ser.fileno()), 'wb', buffering=0)
+    read_transport, _ = await loop.connect_read_pipe(lambda: protocol, read_file)
+    write_transport, write_protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, write_file)
+    writer = asyncio.StreamWriter(write_transport, write_protocol, reader, loop)
+
+    def close_port():
+        read_transport.close()
+        write_transport.close()   # cierra el descriptor duplicado
+        ser.close()
+    writer.close_port = close_port
+    return reader, writer
+
+
+class _ThreadedSerialWriter:
+    '''
+    Minimal StreamWriter replacement for platforms without pipe support for serial ports
+    '''
+
+    def __init__(self, ser: serial.Serial, reader: asyncio.StreamReader,
+                 protocol: asyncio.StreamReaderProtocol, loop: asyncio.AbstractEventLoop):
+        self._ser = ser
+        self._loop = loop
+        self._pending = bytearray()
+        ser.timeout = 0.05
+        self._thread = Thread(target=self._read_loop, args=(reader,), daemon=True)
+        self._thread.start()
+
+    def _read_loop(self, reader: asyncio.StreamReader):
+        while self._ser.is_open:
+            try:
+                data = self._ser.read(max(1, self._ser.in_waiting))
+            except serial.SerialException:
+                break
+            if data:
+                self._loop.call_soon_threadsafe(reader.feed_data, data)
+        self._loop.call_soon_threadsafe(reader.feed_eof)
+
+    def write(self, data: bytes):
+        self._pending += data
+
+    async def drain(self):
+        data, self._pending = bytes(self._pending), bytearray()
+        await self._loop.run_in_executor(None, self._ser.write, data)
+
+    def close(self):
+        self._ser.close()
+
+    def close_port(self):
+        self._ser.close()
+
+    async def wait_closed(self):
+        pass
+
+
+class AsyncSCPIClient:
+    '''
+    Awaitable SCPI client with command pipelining
+
+    Every query is written as soon as it is issued and a future is queued for its
+    response; a single reader task resolves the futures in order. Several queries can
+    therefore be in flight at once (e.g. the next READ? is already queued while the
+    host processes the previous reading), instead of strictly alternating
+    write -> wait -> read as the synchronous query() does.
+
+    Args:
+        reader (asyncio.StreamReader): Stream of bytes received from the device
+        writer (asyncio.StreamWriter): Stream to write commands to the device
+    '''
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.data_format = 'ASCII'
+        self.elements = DEFAULT_ELEMENTS
+        self._pending: deque = deque()   # (future, tamaño del bloque binario o None)
+        self._has_pending = asyncio.Event()
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def open(cls, serial_com: str, **settings) -> 'AsyncSCPIClient':
+        '''
+        Open a port and return a client on it
+
+        Args:
+            serial_com (str): Serial port of the device (or pty path)
+            **settings: pyserial settings overriding SERIAL_SETTINGS
+
+        Returns:
+            AsyncSCPIClient: Connected client
+        '''
+        return cls(*await open_serial_connection(serial_com, **settings))
+
+    async def close(self):
+        '''Cancel the pending queries and close the port'''
+        self._reader_task.cancel()
+        for future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self.writer.close_port()
+
+    def _write(self, command: str):
+        self.writer.write(str.encode(f'{command}{WRITE_TERMINATOR}'))
+
+    def submit(self, command: str, block_size: int | None = None) -> asyncio.Future:
+        '''
+        Write a query without waiting and return the future of its response
+
+        Args:
+            command (str): Query to be sent to the device
+            block_size (int): Expected size of a binary block response (None for a text line)
+
+        Returns:
+            asyncio.Future: Resolves to (time.perf_counter() at arrival, raw response bytes)
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, block_size))
+        self._has_pending.set()
+        self._write(command)
+        return future
+
+    async def send(self, command: str):
+        '''
+        Send a command to the device without expecting a response
+
+        Args:
+            command (str): Command to be sent to the device
+        '''
+        self._write(command)
+        await self.writer.drain()
+
+    async def query(self, command: str) -> str:
+        '''
+        Send a query and return its response line
+
+        Args:
+            command (str): Query to be sent to the device
+
+        Returns:
+            str: Decoded response without the line terminator
+        '''
+        future = self.submit(command)
+        await self.writer.drain()
+        _, raw = await future
+        return raw.decode('utf-8').rstrip('\r\n')
+
+    async def set_data_format(self, data_format: str = 'ASCII', elements: tuple[str, ...] = DEFAULT_ELEMENTS):
+        '''
+        Configure the transfer format and the elements of every reading
+
+        Args:
+            data_format (str): 'ASCII', 'SREAL' or 'DREAL'
+            elements (tuple): FORM:ELEM elements ('READ', 'TIME', 'STAT')
+        '''
+        data_format = data_format.upper()
+        await self.send(f'FORMat:DATA {DATA_FORMATS[data_format][0]}')
+        await self.send('FORMat:BORDer SWAPped')
+        await self.send(f'FORMat:ELEMents {",".join(elements)}')
+        self.data_format, self.elements = data_format, tuple(elements)
+
+    def _submit_values(self, command: str, count: int) -> asyncio.Future:
+        if self.data_format == 'ASCII':
+            return self.submit(command)
+        return self.submit(command, count * reading_dtype(self.data_format, self.elements).itemsize)
+
+    def parse_values(self, raw: bytes) -> np.ndarray:
+        '''
+        Parse a response with readings according to the configured format
+
+        Args:
+            raw (bytes): Raw response
+
+        Returns:
+            np.ndarray: Structured array with fields 'reading', 'timestamp' and/or 'status'
+        '''
+        if self.data_format == 'ASCII':
+            return parse_ascii_values(raw.decode('utf-8'), self.elements)
+        return np.frombuffer(raw, dtype=reading_dtype(self.data_format, self.elements))
+
+    async def query_values(self, command: str, count: int = 1) -> tuple[float, np.ndarray]:
+        '''
+        Send a query that returns readings and parse them
+
+        Args:
+            command (str): Query (e.g. 'READ?')
+            count (int): Expected number of readings (sizes "#0" binary blocks)
+
+        Returns:
+            timestamp (float): time.perf_counter() (s) when the response arrived
+            values (np.ndarray): Structured array of readings
+        '''
+        future = self._submit_values(command, count)
+        await self.writer.drain()
+        arrived, raw = await future
+        return arrived, self.parse_values(raw)
+
+    async def stream(self, command: str = 'READ?', depth: int = 2, count: int = 1):
+        '''
+        Repeat a query keeping `depth` requests in flight
+
+        Args:
+            command (str): Query to repeat
+            depth (int): Number of queries queued in the device at any time
+            count (int): Readings per response
+
+        Yields:
+            timestamp (float): time.perf_counter() (s) when the response arrived
+            values (np.ndarray): Structured array of readings
+        '''
+        futures = deque(self._submit_values(command, count) for _ in range(max(1, depth)))
+        await self.writer.drain()
+        try:
+            while True:
+                arrived, raw = await futures.popleft()
+                futures.append(self._submit_values(command, count))
+                await self.writer.drain()
+                yield arrived, self.parse_values(raw)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def _read_responses(self):
+        reader = self.reader
+        while True:
+            if not self._pending:
+                self._has_pending.clear()
+                await self._has_pending.wait()
+            future, block_size = self._pending[0]
+            try:
+                if block_size is None:
+                    raw = await reader.readuntil(READ_TERMINATOR)
+                else:
+                    header = await reader.readexactly(2)
+                    digits = int(header[1:2])
+                    if digits:
+                        block_size = int(await reader.readexactly(digits))
+                    raw = await reader.readexactly(block_size)
+                    await reader.readuntil(READ_TERMINATOR)
+            except (asyncio.IncompleteReadError, ValueError) as e:
+                self._pending.popleft()
+                if not future.done():
+                    future.set_exception(serial.SerialException(f'Invalid response: {e}'))
+                continue
+            self._pending.popleft()
+            if not future.done():
+                future.set_result((time.perf_counter(), raw))
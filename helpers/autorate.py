@@ -0,0 +1,134 @@
+import numpy as np
+
+from .serial_commands import MAX_BURST_POINTS
+
+NPLC_LIMITS = (0.01, 10.0)   # rango de NPLC usado por el modo automático (el 6485 admite 0.01 - 50/60)
+
+
+class AutoRate:
+    '''
+    Adjust the integration rate (NPLC) of one instrument at run time to reach a target
+    sample rate or noise level
+
+    Every `interval` seconds (and at least `min_readings` readings) the achieved rate (readings per second of host time) and
+    the noise of the stream are measured. The noise is estimated from the differences
+    between consecutive readings (std(diff) / sqrt(2)), so a slow drift of the signal
+    does not count as noise. Then:
+
+    - 'Rate': each reading takes about NPLC / line frequency plus a fixed overhead
+      (conversion and transfer), estimated from the achieved rate; the NPLC that
+      gives the target rate is set.
+    - 'Noise': white noise falls as 1 / sqrt(NPLC); NPLC moves halfway (geometric
+      mean) to the value that gives the target noise, at most a factor 10 per step,
+      since the noise estimate of a short window is uncertain.
+
+    Changes smaller than `tolerance` are ignored, so the rate does not oscillate. In
+    burst mode the burst size follows the expected rate, so a burst takes about
+    `burst_time` seconds.
+
+    Args:
+        mode (str): 'Rate' (target in readings/s) or 'Noise' (target in A)
+        target (float): Target sample rate or noise
+        nplc (float): Integration rate set in the instrument
+        line_frequency (float): Power line frequency in Hz
+        interval (float): Seconds of acquisition between evaluations
+        min_readings (int): Readings needed for an evaluation
+        tolerance (float): Minimum relative change of NPLC
+        burst_time (float): Target duration of a burst (s)
+        limits (tuple): Minimum and maximum NPLC
+    '''
+
+    def __init__(self, mode: str, target: float, nplc: float = 1.0, line_frequency: float = 50.0,
+                 interval: float = 2.0, min_readings: int = 50, tolerance: float = 0.15, burst_time: float = 0.25,
+                 limits: tuple[float, float] = NPLC_LIMITS):
+        if mode not in ('Rate', 'Noise'):
+            raise ValueError(f'unknown auto mode "{mode}"')
+        if not target > 0:
+            raise ValueError('the target must be positive')
+        self.mode = mode
+        self.target = target
+        self.nplc = nplc
+        self.line_frequency = line_frequency
+        self.interval = interval
+        self.min_readings = min_readings
+        self.tolerance = tolerance
+        self.burst_time = burst_time
+        self.limits = limits
+        self.overhead = None   # tiempo por lectura aparte de la integración (s)
+        self._reset_window()
+
+    def _reset_window(self):
+        self._start = None
+        self._count = 0
+        self._sum_sq_diff = 0.0
+        self._diffs = 0
+        self._last = None
+
+    @property
+    def expected_rate(self) -> float:
+        '''Readings per second expected at the current NPLC (nan before the first evaluation)'''
+        if self.overhead is None:
+            return float('nan')
+        return 1 / (self.nplc / self.line_frequency + self.overhead)
+
+    def burst_size(self, current: int) -> int:
+        '''
+        Readings per burst that take about `burst_time` at the expected rate
+
+        Args:
+            current (int): Burst size in use (kept before the first evaluation)
+
+        Returns:
+            int: Burst size
+        '''
+        if self.overhead is None:
+            return current
+        return int(max(1, min(round(self.expected_rate * self.burst_time), MAX_BURST_POINTS)))
+
+    def update(self, host_times: np.ndarray, readings: np.ndarray) -> str | None:
+        '''
+        Add a block of readings and, once per interval, choose a new NPLC
+
+        Args:
+            host_times (np.ndarray): Host times of the readings (s, time.perf_counter)
+            readings (np.ndarray): Currents (A)
+
+        Returns:
+            str: Description of the change if NPLC changed (self.nplc holds the new value), else None
+        '''
+        readings = np.asarray(readings, dtype=np.float64)
+        if len(readings) == 0:
+            return None
+        if self._start is None:
+            self._start = host_times[0]
+            self._count = -1   # la primera lectura solo marca el inicio de la ventana
+        self._count += len(readings)
+        chained = readings if self._last is None else np.concatenate([[self._last], readings])
+        if len(chained) > 1:
+            diffs = np.diff(chained)
+            self._sum_sq_diff += float(np.dot(diffs, diffs))
+            self._diffs += len(diffs)
+        self._last = readings[-1]
+
+        elapsed = host_times[-1] - self._start
+        if elapsed < self.interval or self._count < max(self.min_readings, 1) or self._diffs == 0:
+            return None
+        rate = self._count / elapsed
+        noise = (self._sum_sq_diff / self._diffs / 2) ** 0.5
+        self._reset_window()
+
+        self.overhead = max(1 / rate - self.nplc / self.line_frequency, 0.0)
+        if self.mode == 'Rate':
+            integration = 1 / self.target - self.overhead
+            proposed = integration * self.line_frequency if integration > 0 else self.limits[0]
+        else:
+            factor = noise / self.target if noise > 0 else 0.1   # raíz de (noise / target)^2
+            proposed = self.nplc * min(max(factor, 0.1), 10.0)
+        proposed = float(f'{min(max(proposed, self.limits[0]), self.limits[1]):.2g}')
+
+        if abs(proposed - self.nplc) <= self.tolerance * self.nplc:
+            return None
+        event = (f'NPLC {self.nplc:g} -> {proposed:g} (rate {rate:.1f}/s, noise {noise:.3e} A, '
+                 f'target {self.target:g} {"readings/s" if self.mode == "Rate" else "A"})')
+        self.nplc = proposed
+        return event
@@ -0,0 +1,89 @@
+from collections import deque
+
+import numpy as np
+
+
+class InstrumentClock:
+    '''
+    Map the instrument reading timestamps (FORM:ELEM TIME) onto the host perf_counter clock
+
+    Every acquired block gives a pair (instrument timestamp, host time of the request).
+    Pairs are averaged in buckets of `interval` instrument seconds, which absorbs the
+    jitter of the host side, and a least squares line host = offset + rate * instrument
+    over the last `window` buckets corrects the drift between both oscillators. The
+    instrument timer restarts on *RST (and wraps on the 6485), so a timestamp that
+    goes backwards drops the fit.
+
+    Args:
+        window (int): Buckets used in the fit
+        interval (float): Instrument seconds per bucket
+    '''
+
+    def __init__(self, window: int = 256, interval: float = 0.5):
+        self.window = window
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        '''Drop the pairs and the fit'''
+        self._buckets: deque = deque(maxlen=self.window)   # pares promedio (instrumento, host)
+        self._sum_x = self._sum_y = 0.0
+        self._count = 0
+        self._bucket_start = None
+        self._last_x = None
+        self.offset = None   # tiempo del host (s) para el instante 0 del instrumento
+        self.rate = 1.0      # segundos del host por segundo del instrumento
+
+    @property
+    def drift_ppm(self) -> float:
+        '''Drift of the instrument clock against the host clock in parts per million'''
+        return (self.rate - 1.0) * 1e6
+
+    def add(self, instrument_time: float, host_time: float):
+        '''
+        Add a pair and update the fit when a bucket is complete
+
+        Args:
+            instrument_time (float): Instrument timestamp of a reading (s)
+            host_time (float): Host time of the same reading (s, time.perf_counter)
+        '''
+        if self._last_x is not None and instrument_time < self._last_x:
+            self.reset()   # el temporizador del instrumento se ha reiniciado
+        self._last_x = instrument_time
+        if self.offset is None:
+            self.offset = host_time - instrument_time
+            self._bucket_start = instrument_time
+
+        self._sum_x += instrument_time
+        self._sum_y += host_time
+        self._count += 1
+        if instrument_time - self._bucket_start < self.interval:
+            return
+        self._buckets.append((self._sum_x / self._count, self._sum_y / self._count))
+        self._sum_x = self._sum_y = 0.0
+        self._count = 0
+        self._bucket_start = instrument_time
+
+        buckets = np.array(self._buckets)
+        x, y = buckets[:, 0], buckets[:, 1]
+        x_mean, y_mean = x.mean(), y.mean()
+        x_var = np.sum((x - x_mean) ** 2)
+        # Con pocos promedios solo se estima el desfase
+        if len(buckets) >= 4 and x_var > 0:
+            self.rate = float(np.sum((x - x_mean) * (y - y_mean)) / x_var)
+        self.offset = float(y_mean - self.rate * x_mean)
+
+    def to_host(self, instrument_times) -> np.ndarray:
+        '''
+        Convert instrument timestamps to host times
+
+        Args:
+            instrument_times (array_like): Instrument timestamps (s)
+
+        Returns:
+            np.ndarray: Host times (s, time.perf_counter); nan before the first pair
+        '''
+        instrument_times = np.asarray(instrument_times, dtype=np.float64)
+        if self.offset is None:
+            return np.full(instrument_times.shape, np.nan)
+        return self.offset + self.rate * instrument_times
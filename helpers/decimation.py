@@ -0,0 +1,199 @@
+import numpy as np
+
+from .sample_store import SampleStore, TieredStore
+
+
+def minmax_blocks(time: np.ndarray, current: np.ndarray, block: int) -> tuple[np.ndarray, ...]:
+    '''
+    Reduce complete blocks of `block` samples to their minimum and maximum
+
+    Args:
+        time (np.ndarray): Times, length multiple of `block`
+        current (np.ndarray): Currents, same length as `time`
+        block (int): Samples per block
+
+    Returns:
+        t_min, y_min, t_max, y_max (np.ndarray): Time and value of the minimum and maximum of each block
+    '''
+    rows = np.arange(len(time) // block)
+    y = current.reshape(-1, block)
+    t = time.reshape(-1, block)
+    nan = np.isnan(y)
+    if nan.any():   # los huecos (NaN) no cuentan como extremos
+        i_min = np.argmin(np.where(nan, np.inf, y), axis=1)
+        i_max = np.argmax(np.where(nan, -np.inf, y), axis=1)
+    else:
+        i_min = np.argmin(y, axis=1)
+        i_max = np.argmax(y, axis=1)
+    return t[rows, i_min], y[rows, i_min], t[rows, i_max], y[rows, i_max]
+
+def interleave_envelope(t_min, y_min, t_max, y_max) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Merge the minimum and maximum of each block into one polyline, keeping the time order inside each block
+
+    Args:
+        t_min, y_min, t_max, y_max (np.ndarray): Envelope of each block
+
+    Returns:
+        x (np.ndarray): Times, two per block
+        y (np.ndarray): Values, two per block
+    '''
+    min_first = t_min <= t_max
+    x = np.empty(2 * len(t_min))
+    y = np.empty(2 * len(t_min))
+    x[0::2] = np.where(min_first, t_min, t_max)
+    x[1::2] = np.where(min_first, t_max, t_min)
+    y[0::2] = np.where(min_first, y_min, y_max)
+    y[1::2] = np.where(min_first, y_max, y_min)
+    return x, y
+
+def minmax_decimate(time: np.ndarray, current: np.ndarray, columns: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Decimate a series to the min/max envelope of `columns` groups of samples (about
+    2 * columns points), so that spikes are never hidden
+
+    Args:
+        time (np.ndarray): Times
+        current (np.ndarray): Currents
+        columns (int): Number of output columns (usually the axes width in pixels)
+
+    Returns:
+        x (np.ndarray): Decimated times
+        y (np.ndarray): Decimated currents
+    '''
+    columns = max(1, int(columns))
+    if len(time) <= 2 * columns:
+        return time, current
+    block = -(-len(time) // columns)
+    complete = len(time) // block * block
+    x, y = interleave_envelope(*minmax_blocks(time[:complete], current[:complete], block))
+    if complete < len(time):
+        x_tail, y_tail = interleave_envelope(*minmax_blocks(time[complete:], current[complete:], len(time) - complete))
+        x, y = np.concatenate((x, x_tail)), np.concatenate((y, y_tail))
+    return x, y
+
+
+class MinMaxPyramid:
+    '''
+    Multi-level min/max envelope of a SampleStore, updated incrementally as samples arrive
+
+    Level k holds the minimum and maximum of every block of factor**(k+1) raw samples,
+    built from the complete blocks of level k-1. A query picks the finest level that
+    gives at most one block per pixel column of the visible range, so drawing costs
+    about 2x the pixel width in points whatever the length of the run.
+
+    Args:
+        samples (SampleStore): Raw samples
+        factor (int): Reduction factor between consecutive levels
+    '''
+
+    def __init__(self, samples: SampleStore, factor: int = 8):
+        self.samples = samples
+        self.factor = factor
+        self.levels: list[tuple[SampleStore, SampleStore]] = []   # (mínimos, máximos) por nivel
+        self._seen = 0   # muestras del almacén vistas en la última actualización
+
+    def block_size(self, level: int) -> int:
+        '''Raw samples per block at a level'''
+        return self.factor ** (level + 1)
+
+    def clear(self):
+        '''Drop every level (after the sample store was cleared or replaced)'''
+        self.levels = []
+
+    def _new_level(self, level: int) -> tuple[SampleStore, SampleStore]:
+        samples = self.samples
+        if samples.ring:
+            capacity = samples.capacity // self.block_size(level) + 2
+            return SampleStore(capacity, ring=True), SampleStore(capacity, ring=True)
+        if isinstance(samples, TieredStore):   # los niveles de una medida larga también van a disco
+            chunk_size = max(samples.chunk_size // self.block_size(level), 4096)
+            return (TieredStore(chunk_size, samples.directory),
+                    TieredStore(chunk_size, samples.directory))
+        return SampleStore(256), SampleStore(256)
+
+    def update(self):
+        '''
+        Reduce the complete blocks of samples that arrived since the last update into every level
+        '''
+        samples = self.samples
+        if samples.total < self._seen:
+            self.clear()   # el almacén se ha vaciado
+        self._seen = samples.total
+
+        level = 0
+        while True:
+            if level == len(self.levels):
+                source_total = samples.total if level == 0 else self.levels[level - 1][0].total
+                if source_total < 2 * self.factor:
+                    return
+                self.levels.append(self._new_level(level))
+            mins, maxs = self.levels[level]
+
+            if level == 0:
+                first, total = samples.first_index, samples.total
+            else:
+                first, total = self.levels[level - 1][0].first_index, self.levels[level - 1][0].total
+
+            # Bloques completos pendientes (los perdidos por el anillo se saltan)
+            start = max(mins.total * self.factor, -(-first // self.factor) * self.factor)
+            stop = total // self.factor * self.factor
+            if stop > start:
+                gap = start // self.factor - mins.total
+                if gap > 0:   # bloques perdidos por el anillo antes de reducirlos
+                    mins.extend(np.full(gap, np.nan), np.full(gap, np.nan))
+                    maxs.extend(np.full(gap, np.nan), np.full(gap, np.nan))
+                if level == 0:
+                    t_min, y_min, t_max, y_max = minmax_blocks(*samples.read(start, stop), self.factor)
+                else:
+                    lower_mins, lower_maxs = self.levels[level - 1]
+                    t_lo, y_lo = lower_mins.read(start, stop)
+                    t_hi, y_hi = lower_maxs.read(start, stop)
+                    t_min, y_min, _, _ = minmax_blocks(t_lo, y_lo, self.factor)
+                    _, _, t_max, y_max = minmax_blocks(t_hi, y_hi, self.factor)
+                mins.extend(t_min, y_min)
+                maxs.extend(t_max, y_max)
+            level += 1
+
+    def query(self, x_start: float, x_stop: float, columns: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return the points to draw for a visible time range
+
+        Args:
+            x_start (float): First visible time
+            x_stop (float): Last visible time
+            columns (int): Width of the axes in pixels
+
+        Returns:
+            x (np.ndarray): Times to draw
+            y (np.ndarray): Currents to draw
+        '''
+        samples = self.samples
+        columns = max(1, int(columns))
+        # Un punto extra a cada lado para que la línea llegue a los bordes (índices absolutos)
+        i0 = max(samples.search(x_start) - 1, samples.first_index)
+        i1 = min(samples.search(x_stop, side='right') + 1, samples.total)
+        count = i1 - i0
+        if count <= 2 * columns:
+            return samples.read(i0, i1)
+
+        level = 0
+        while level + 1 < len(self.levels) and count / self.block_size(level) > columns:
+            level += 1
+        if level >= len(self.levels) or count / self.block_size(level) > 4 * columns:
+            return minmax_decimate(*samples.read(i0, i1), columns)
+
+        block = self.block_size(level)
+        mins, maxs = self.levels[level]
+        b0 = max(i0 // block, mins.first_index)
+        b1 = min(i1 // block, mins.total)
+        t_min, y_min = mins.read(b0, b1)
+        t_max, y_max = maxs.read(b0, b1)
+        x, y = interleave_envelope(t_min, y_min, t_max, y_max)
+
+        # Muestras al final que aún no forman un bloque completo
+        tail_start = max(b1 * block, i0)
+        if i1 > tail_start:
+            x_tail, y_tail = minmax_decimate(*samples.read(tail_start, i1), max(1, (i1 - tail_start) // block))
+            x, y = np.concatenate((x, x_tail)), np.concatenate((y, y_tail))
+        return x, y
@@ -0,0 +1,115 @@
+from collections import deque
+from threading import Thread, Event, Lock
+import traceback
+
+from serial.tools.list_ports_common import ListPortInfo
+
+from .serial_commands import list_ports
+
+
+class PortDiscovery:
+    '''
+    Background service that keeps the list of serial ports and detects plug/unplug events
+
+    The ports are enumerated in its own thread every `interval` seconds (or at once
+    after rescan()), so a slow driver never blocks the Tk thread. The last list is
+    cached with its USB metadata (ListPortInfo: description, VID/PID, serial number)
+    and every change is pushed as an event into a deque that the Tk thread drains
+    with pop_events(), as the device workers do with their samples. A port whose
+    hardware id changes (another device on the same COM name) is reported as removed
+    and added.
+
+    Args:
+        interval (float): Seconds between enumerations
+        name (str): Thread name
+    '''
+
+    def __init__(self, interval: float = 2.0, name: str = 'port-discovery'):
+        self.interval = interval
+        self.events: deque = deque()          # ('added' | 'removed', ListPortInfo) pendientes
+        self.scanned = Event()                # primera enumeración completada
+        self._ports: dict[str, ListPortInfo] = {}
+        self._lock = Lock()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+
+    @property
+    def ports(self) -> list[ListPortInfo]:
+        '''Cached ports, in the order of the last enumeration'''
+        with self._lock:
+            return list(self._ports.values())
+
+    def get(self, device: str) -> ListPortInfo | None:
+        '''
+        Cached metadata of a port
+
+        Args:
+            device (str): Port name (e.g. COM3 or /dev/ttyUSB0)
+
+        Returns:
+            ListPortInfo: Port information, None if it is not connected
+        '''
+        with self._lock:
+            return self._ports.get(device)
+
+    def __contains__(self, device: str) -> bool:
+        with self._lock:
+            return device in self._ports
+
+    def start(self):
+        '''Start the discovery thread'''
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the discovery thread after the current enumeration'''
+        self._stop.set()
+        self._wake.set()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def rescan(self):
+        '''Enumerate the ports now instead of waiting for the interval (does not block)'''
+        self._wake.set()
+
+    def scan(self) -> list[tuple[str, ListPortInfo]]:
+        '''
+        Enumerate the ports, update the cache and queue the changes
+
+        Returns:
+            list: New events ('added' | 'removed', ListPortInfo)
+        '''
+        ports = {port.device: port for port in list_ports()}
+        with self._lock:
+            previous = self._ports
+            self._ports = ports
+        events = [('removed', port) for device, port in previous.items()
+                  if device not in ports or ports[device].hwid != port.hwid]
+        events += [('added', port) for device, port in ports.items()
+                   if device not in previous or previous[device].hwid != port.hwid]
+        self.events.extend(events)
+        self.scanned.set()
+        return events
+
+    def pop_events(self) -> list[tuple[str, ListPortInfo]]:
+        '''
+        Take the pending plug/unplug events (Tk thread)
+
+        Returns:
+            list: Events ('added' | 'removed', ListPortInfo) in order
+        '''
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception:
+                traceback.print_exc()   # un fallo del controlador no detiene el servicio
+                self.scanned.set()
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,377 @@
+import numpy as np
+import os, time
+
+from threading import Lock
+
+from .statistics import format_series_statistics
+from .sample_store import SampleStore
+
+# Columnas de los ficheros .dat (con marcas de tiempo del instrumento se añaden las dos últimas)
+DATA_COLUMNS = ['Relative time (s)', 'Current (A)']
+CLOCK_COLUMNS = ['Host time (s)', 'Instrument time (s)']
+EXPORT_CHUNK = 1 << 16  # filas leídas de los almacenes y escritas de una vez al exportar
+
+
+def missing_export_fields(app: 'KeithleyApp') -> list[str]:
+    '''
+    Check the fields needed to name and describe an export file
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the export information
+
+    Returns:
+        list: Names of the fields that are not filled in
+    '''
+    text: dict = app.text
+    data: dict = app.data
+
+    requirements = [text['smp_name'].get() not in ('', None),
+                    text['smp_info'].get() not in ('', None),
+                    text['export_name'].get() not in ('', None),
+                    data['export_directory'] not in ('', None),
+    ]
+    requirement_info = ['Sample name', 'Sample information',
+                        'Export name', 'Export directory'
+    ]
+
+    return [requirement_info[i] for i, requirement in enumerate(requirements) if not requirement]
+
+def export_path(app: 'KeithleyApp', extension: str = '.dat', suffix: str = '') -> str:
+    '''
+    Build the export file path from the selected directory and export name
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the export information
+        extension (str): File extension
+        suffix (str): Text appended to the export name (e.g. the port of one instrument)
+
+    Returns:
+        str: Path of the export file
+    '''
+    return os.path.join(app.data['export_directory'], app.text['export_name'].get() + suffix + extension)
+
+def port_suffix(port: str) -> str:
+    '''
+    File name suffix identifying an instrument by its port (e.g. '_COM3', '_ttyUSB0')
+
+    Args:
+        port (str): Serial port of the instrument
+
+    Returns:
+        str: Suffix for export_path
+    '''
+    return '_' + os.path.basename(port.rstrip('/\\'))
+
+def export_metadata(app: 'KeithleyApp', ports: list[str] | None = None, filtered: bool = True) -> tuple[str, str]:
+    '''
+    Store the sample information in the data and build the header of the .dat files
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and device information
+        ports (list): Ports of the exported instruments (all the selected ones by default).
+            With more than one, every column is tagged with its port
+        filtered (bool): The data went through the filter pipeline (False for the raw records)
+
+    Returns:
+        comments (str): Sample name, sample information and device information lines
+        header (str): Column header line
+    '''
+    data: dict = app.data
+    text: dict = app.text
+
+    data['sample_name'] = text['smp_name'].get()
+    data['sample_info'] = text['smp_info'].get()
+    data['export_name'] = text['export_name'].get()
+
+    if ports is None:
+        ports = list(data['series'])
+
+    columns = [DATA_COLUMNS + CLOCK_COLUMNS if device in data['series'] and data['series'][device]['samples'].instrument_clock
+               else DATA_COLUMNS for device in ports]
+    statistics = format_series_statistics(data['series'], ports)
+    filters = data['filter_spec'] if filtered else ''
+    events = []   # cambios de configuración durante la medida (NPLC automático)
+    for device in ports:
+        prefix = f'[{device}] ' if len(ports) > 1 else ''
+        for relative_time, event in data['series'].get(device, {}).get('events', []):
+            events.append(f'{prefix}t={relative_time:.6f} s: {event}')
+    return format_metadata(data['sample_name'], data['sample_info'], device_descriptions(app, ports), ports,
+                           columns, statistics, filters, events)
+
+def device_descriptions(app: 'KeithleyApp', ports: list[str]) -> list[str]:
+    '''
+    Description of every instrument from the listed ports (the port name if it is not listed)
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the device information
+        ports (list): Ports of the instruments
+
+    Returns:
+        list: One description per port
+    '''
+    descriptions = []
+    for device in ports:
+        description = device
+        for port in app.device['com_ports']:
+            if port.device == device:
+                description = str(port)
+                break
+        descriptions.append(description)
+    return descriptions
+
+def export_info(app: 'KeithleyApp', comments: str, header: str, ports: list[str] | None = None) -> dict:
+    '''
+    Metadata of the binary export formats (.npy/.npz), after export_metadata
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and device information
+        comments (str): Comment block returned by export_metadata
+        header (str): Column header returned by export_metadata
+        ports (list): Ports of the exported instruments (all the selected ones by default)
+
+    Returns:
+        dict: Sample name and information, devices, ports, columns and the comment lines
+    '''
+    data: dict = app.data
+    if ports is None:
+        ports = list(data['series'])
+    return {'sample_name': data['sample_name'],
+            'sample_info': data['sample_info'],
+            'devices': device_descriptions(app, ports),
+            'ports': ports,
+            'columns': header.split('\t'),
+            'comments': [line for line in comments.splitlines() if line]}
+
+def format_metadata(sample_name: str, sample_info: str, device_descriptions: list[str],
+                    ports: list[str], columns: list[list[str]] | None = None,
+                    statistics: list[str] | None = None, filters: str = '',
+                    events: list[str] | None = None) -> tuple[str, str]:
+    '''
+    Build the comment block and column header of the .dat files
+
+    Args:
+        sample_name (str): Sample name
+        sample_info (str): Sample information
+        device_descriptions (list): Description of every instrument
+        ports (list): Ports of the exported instruments
+        columns (list): Column names of every instrument (DATA_COLUMNS by default)
+        statistics (list): Statistics lines, written after the device information
+        filters (str): Filter pipeline applied to the data (empty = raw readings)
+        events (list): Configuration changes during the run (e.g. automatic NPLC)
+
+    Returns:
+        comments (str): Sample name, sample information and device information lines
+        header (str): Column header line
+    '''
+    sample_name = ['Sample name:',
+                   sample_name
+    ]
+    sample_info = ['Sample information:',
+                   sample_info
+    ]
+    device_info = ['Device information:',
+                   '; '.join(device_descriptions),
+    ]
+    statistics = [f'Statistics {line}' for line in statistics or []]
+    if filters:
+        statistics.insert(0, f'Filters: {filters}')
+    statistics += [f'Event {line}' for line in events or []]
+    comments = '\n'.join([' '.join(sample_name), ' '.join(sample_info), ' '.join(device_info), *statistics, '\n'])
+    if columns is None:
+        columns = [DATA_COLUMNS] * len(ports)
+    if len(ports) > 1:
+        header = '\t'.join(f'{name} [{device}]' for device, names in zip(ports, columns) for name in names)
+    else:
+        header = '\t'.join(columns[0])
+
+    return comments, header
+
+class StreamRecorder:
+    '''
+    Append samples to a .dat file while the acquisition runs
+
+    Rows are buffered and written in chunks; the file is fsynced at most every
+    `fsync_interval` seconds, so a crash loses at most that much data. The file is
+    written as `<path>.part` and renamed to `<path>` by close(), so the final export
+    does not rewrite the data.
+
+    Args:
+        path (str): Final path of the .dat file
+        comments (str): Comment block written before the header (same as export_data)
+        header (str): Column header line
+        fsync_interval (float): Seconds between fsync calls
+        chunk_size (int): Rows buffered before they are written
+    '''
+
+    def __init__(self, path: str, comments: str, header: str,
+                 fsync_interval: float = 5.0, chunk_size: int = 1000):
+        self.path = path
+        self.part_path = path + '.part'
+        self.fsync_interval = fsync_interval
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._pending: list[float] = []
+        self._columns = 2
+        self._lock = Lock()
+        self._file = open(self.part_path, 'w', buffering=1 << 20)
+        self._file.write(comments + header + '\n')
+        self._last_sync = time.monotonic()
+
+    def write(self, times, currents, *extra_columns):
+        '''
+        Queue a block of samples for writing
+
+        Args:
+            times (array_like): Relative times (s)
+            currents (array_like): Currents (A)
+            *extra_columns (array_like): Further columns (host and instrument time)
+        '''
+        columns = (times, currents) + extra_columns
+        rows = np.column_stack(columns).ravel().tolist()
+        with self._lock:
+            if self._file is None:
+                return
+            if self._columns != len(columns):
+                self._write_pending()
+                self._columns = len(columns)
+            self._pending.extend(rows)
+            if len(self._pending) >= self._columns * self.chunk_size:
+                self._write_pending()
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def comment(self, text: str):
+        '''
+        Write a '#' comment line after the rows queued so far (e.g. a configuration change)
+
+        Args:
+            text (str): Comment text (one line)
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._write_pending()
+                self._file.write(f'# {text}\n')
+
+    def sync(self):
+        '''Write the pending rows and fsync the file'''
+        with self._lock:
+            if self._file is not None:
+                self._write_pending()
+                self._sync()
+
+    def close(self) -> str:
+        '''
+        Write the pending rows, close the file and rename it to its final name
+
+        Returns:
+            str: Final path of the file
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._write_pending()
+                self._sync()
+                self._file.close()
+                self._file = None
+                os.replace(self.part_path, self.path)
+        return self.path
+
+    def _write_pending(self):
+        if self._pending:
+            # Mismo formato que np.savetxt(fmt='%s'): repr más corto de cada valor
+            rows = len(self._pending) // self._columns
+            self._file.write(('\t'.join(['%s'] * self._columns) + '\n') * rows % tuple(self._pending))
+            self.rows += rows
+            self._pending = []
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+
+def start_recording(app: 'KeithleyApp') -> bool:
+    '''
+    Open the record files if "Record to file" is enabled and no recording is open,
+    writing the samples already acquired first. Samples that went through a filter are
+    not raw, so they are left out and a '#' line marks where the raw stream starts.
+    Each instrument is recorded to its own file; with several instruments the port is
+    appended to the export name
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and export information
+
+    Returns:
+        bool: False if the recording was requested but could not be started
+    '''
+    from tkinter import messagebox  # Tk solo se importa desde la GUI (helpers.acquire no lo necesita)
+
+    series_dict: dict = app.data['series']
+
+    if not app.record_to_file.get() or any(series['recorder'] is not None for series in series_dict.values()):
+        return True
+
+    missing = missing_export_fields(app)
+    if missing:
+        messagebox.showerror('Error', f'Please fill in the following fields to record to file:\n\t{"\n\t".join(missing)}')
+        return False
+
+    try:
+        fsync_interval = max(0.1, float(app.fsync_interval.get()))
+    except Exception: # Error getting fsync interval
+        fsync_interval = 5.0
+        app.fsync_interval.set(fsync_interval)
+
+    recorders = {}
+    for device, series in series_dict.items():
+        comments, header = export_metadata(app, [device], filtered=False)   # registro sin filtrar
+        suffix = port_suffix(device) if len(series_dict) > 1 else ''
+        try:
+            recorders[device] = StreamRecorder(export_path(app, suffix=suffix), comments, header, fsync_interval)
+        except OSError as e:
+            for recorder in recorders.values():
+                recorder.close()
+            messagebox.showerror('Error', f'Error opening the record file: {e}')
+            return False
+
+    for device, recorder in recorders.items():
+        samples: SampleStore = series_dict[device]['samples']
+        if series_dict[device]['filtered'] and len(samples):
+            # El registro es sin filtrar: las muestras filtradas ya adquiridas no se pueden recuperar
+            relative_time = time.perf_counter() - app.data['first_time']
+            recorder.comment(f't={relative_time:.6f} s Raw stream starts here: '
+                             f'the {len(samples)} earlier samples were filtered and are not recorded')
+        else:
+            for start in range(samples.first_index, samples.total, EXPORT_CHUNK):
+                recorder.write(*samples.read_columns(start, start + EXPORT_CHUNK))
+        series_dict[device]['recorder'] = recorder
+    return True
+
+def recording(app: 'KeithleyApp') -> bool:
+    '''
+    Check whether any instrument is being recorded to file
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data
+
+    Returns:
+        bool: True if a record file is open
+    '''
+    return any(series['recorder'] is not None for series in app.data['series'].values())
+
+def stop_recording(app: 'KeithleyApp') -> list[str]:
+    '''
+    Finalize the record files, if any
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data
+
+    Returns:
+        list: Paths of the finalized files (empty if nothing was being recorded)
+    '''
+    paths = []
+    for series in app.data['series'].values():
+        recorder: StreamRecorder = series['recorder']
+        if recorder is not None:
+            series['recorder'] = None
+            paths.append(recorder.close())
+    return paths
@@ -0,0 +1,207 @@
+from threading import Thread, Event
+import gzip, json, os, traceback, zipfile
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from .sample_store import SampleStore
+from .export_commands import EXPORT_CHUNK
+
+# Formatos de exportación: extensión -> descripción
+FORMATS = {
+    '.dat': 'Tab separated text',
+    '.csv.gz': 'Compressed CSV',
+    '.npy': 'NumPy array (+ .json metadata)',
+    '.npz': 'NumPy archive with metadata',
+}
+
+
+def snapshot(samples: SampleStore) -> tuple[SampleStore, int, int]:
+    '''
+    Freeze the samples to export while the acquisition keeps appending (Tk thread)
+
+    Growable and tiered stores never overwrite stored samples, so only their current
+    window is recorded. A ring buffer drops its oldest samples, so its retained
+    window (at most the history limit) is copied.
+
+    Args:
+        samples (SampleStore): Sample store of one instrument
+
+    Returns:
+        store (SampleStore): Store to read from
+        first (int): Absolute index of the first exported sample
+        rows (int): Number of exported samples
+    '''
+    if samples.ring:
+        copy = SampleStore(max(len(samples), 1), instrument_clock=samples.instrument_clock)
+        copy.extend(*samples.columns())
+        return copy, 0, len(copy)
+    return samples, samples.first_index, len(samples)
+
+def iter_blocks(snapshots: list[tuple[SampleStore, int, int]], chunk_size: int = EXPORT_CHUNK):
+    '''
+    Columns of several instruments side by side, a chunk of rows at a time, padded
+    with nan to the length of the longest one
+
+    Args:
+        snapshots (list): Results of snapshot(), in column order
+        chunk_size (int): Rows per block
+
+    Yields:
+        np.ndarray: Block of shape (rows, columns), float64
+    '''
+    rows = max((count for _, _, count in snapshots), default=0)
+    widths = [len(store.read_columns(first, first)) for store, first, _ in snapshots]
+    for start in range(0, rows, chunk_size):
+        stop = min(start + chunk_size, rows)
+        block = np.full((stop - start, sum(widths)), np.nan)
+        column = 0
+        for (store, first, count), width in zip(snapshots, widths):
+            values = store.read_columns(first + start, first + min(stop, count))
+            for i, value in enumerate(values):
+                block[:len(value), column + i] = value
+            column += width
+        yield block
+
+def format_rows(block: np.ndarray, delimiter: str = '\t') -> str:
+    '''
+    Text of a block of rows, with the shortest representation of every value (same
+    output as np.savetxt(fmt='%s'), but one % operation per block instead of one
+    per value)
+
+    Args:
+        block (np.ndarray): Block of shape (rows, columns)
+        delimiter (str): Column separator
+
+    Returns:
+        str: One line per row
+    '''
+    rows, columns = block.shape
+    return (delimiter.join(['%s'] * columns) + '\n') * rows % tuple(block.ravel().tolist())
+
+
+class Exporter:
+    '''
+    Background export of the acquired data, so the GUI and the acquisition keep running
+
+    The samples are read in chunks from the snapshots and written to `<path>.part`,
+    which is renamed to `path` when complete; a cancelled or failed export removes
+    it. The Tk thread polls `progress`, `done` and `error`.
+
+    Formats:
+        .dat: comment block, header and tab separated rows (same as before)
+        .csv.gz: gzip CSV; the comment block is written as '# ' lines
+        .npy: float64 matrix (rows x columns) and a `.json` file with the metadata
+        .npz: 'data' (same matrix), 'columns' and 'metadata' (JSON text)
+
+    Args:
+        path (str): Final path of the file, with the extension of the format
+        export_format (str): Key of FORMATS
+        snapshots (list): Results of snapshot(), in column order
+        comments (str): Comment block (export_metadata)
+        header (str): Tab separated column names (export_metadata)
+        metadata (dict): Sample and device information for the binary formats
+        chunk_size (int): Rows per chunk
+        name (str): Thread name
+    '''
+
+    def __init__(self, path: str, export_format: str, snapshots: list[tuple[SampleStore, int, int]],
+                 comments: str, header: str, metadata: dict, chunk_size: int = EXPORT_CHUNK,
+                 name: str = 'exporter'):
+        if export_format not in FORMATS:
+            raise ValueError(f'unknown export format "{export_format}"')
+        self.path = path
+        self.part_path = path + '.part'
+        self.export_format = export_format
+        self.snapshots = snapshots
+        self.comments = comments
+        self.header = header
+        self.metadata = metadata
+        self.chunk_size = chunk_size
+        self.rows = max((count for _, _, count in snapshots), default=0)
+        self.written = 0              # filas escritas (progreso)
+        self.error: Exception | None = None
+        self.done = Event()           # terminada (completa, cancelada o con error)
+        self._cancel = Event()
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+
+    @property
+    def progress(self) -> float:
+        '''Fraction of the rows written (0 to 1)'''
+        return self.written / self.rows if self.rows else 1.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def start(self):
+        '''Start the export thread'''
+        self._thread.start()
+
+    def cancel(self):
+        '''Stop the export after the current chunk and remove the partial file'''
+        self._cancel.set()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _blocks(self):
+        for block in iter_blocks(self.snapshots, self.chunk_size):
+            if self._cancel.is_set():
+                return
+            yield block
+            self.written += len(block)
+
+    def _run(self):
+        try:
+            writer = {'.dat': self._write_text, '.csv.gz': self._write_csv,
+                      '.npy': self._write_npy, '.npz': self._write_npz}[self.export_format]
+            writer()
+            if self._cancel.is_set():
+                os.remove(self.part_path)
+            else:
+                os.replace(self.part_path, self.path)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+        finally:
+            self.done.set()
+
+    def _write_text(self):
+        with open(self.part_path, 'w', buffering=1 << 20) as file:
+            file.write(self.comments + self.header + '\n')
+            for block in self._blocks():
+                file.write(format_rows(block))
+
+    def _write_csv(self):
+        with gzip.open(self.part_path, 'wt', compresslevel=6) as file:
+            file.write(''.join(f'# {line}\n' for line in self.comments.splitlines() if line))
+            file.write(self.header.replace('\t', ',') + '\n')
+            for block in self._blocks():
+                file.write(format_rows(block, ','))
+
+    def _write_array(self, file):
+        '''Write the .npy header of the whole matrix and then its rows chunk by chunk'''
+        columns = len(self.header.split('\t'))
+        npy_format.write_array_header_1_0(file, {'descr': npy_format.dtype_to_descr(np.dtype(np.float64)),
+                                                 'fortran_order': False, 'shape': (self.rows, columns)})
+        for block in self._blocks():
+            file.write(block.tobytes())
+
+    def _write_npy(self):
+        with open(self.part_path, 'wb') as file:
+            self._write_array(file)
+        with open(os.path.splitext(self.path)[0] + '.json', 'w') as file:
+            json.dump(self.metadata, file, indent=2)
+
+    def _write_npz(self):
+        # Sin compresión, como np.savez: los datos se escriben por bloques dentro del archivo
+        with zipfile.ZipFile(self.part_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with archive.open('data.npy', 'w', force_zip64=True) as file:
+                self._write_array(file)
+            with archive.open('columns.npy', 'w') as file:
+                np.save(file, np.array(self.header.split('\t')))
+            with archive.open('metadata.npy', 'w') as file:
+                np.save(file, np.array(json.dumps(self.metadata)))
@@ -0,0 +1,223 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class BlockFilter:
+    '''
+    Stage of the filter pipeline, applied to blocks of samples as they are acquired
+
+    A block is a tuple of columns of the same length: relative time, current and,
+    with instrument timestamps, host and instrument time. Stages keep the samples
+    they need from the previous block, so the output does not depend on how the
+    readings were split into blocks.
+    '''
+
+    def reset(self):
+        '''Forget the samples carried from previous blocks'''
+
+    def process(self, columns: tuple[np.ndarray, ...]) -> tuple[np.ndarray, ...]:
+        '''
+        Filter a block
+
+        Args:
+            columns (tuple): Time, current and the optional clock columns of the block
+
+        Returns:
+            tuple: Filtered columns (may be shorter, or empty)
+        '''
+        raise NotImplementedError
+
+
+class _WindowFilter(BlockFilter):
+    '''Causal filter over the last `points` readings (fewer at the start of the run)'''
+
+    def __init__(self, points: int = 5):
+        if int(points) < 1:
+            raise ValueError('the window needs at least 1 point')
+        self.points = int(points)
+        self.reset()
+
+    def reset(self):
+        self._tail = None   # últimas points - 1 lecturas del bloque anterior
+
+    def _windows(self, values: np.ndarray) -> tuple[np.ndarray, bool]:
+        '''
+        Window of `points` readings ending at every reading of the block
+
+        Returns:
+            windows (np.ndarray): One row per reading
+            partial (bool): True if the first windows are padded with NaN (use the nan* reductions)
+        '''
+        partial = self._tail is None
+        if partial:
+            self._tail = np.full(self.points - 1, np.nan)
+        padded = np.concatenate([self._tail, values])
+        self._tail = padded[len(padded) - (self.points - 1):]
+        return sliding_window_view(padded, self.points), partial
+
+
+class MovingAverage(_WindowFilter):
+    '''
+    Mean of the last `points` readings
+
+    Args:
+        points (int): Window length
+    '''
+
+    def process(self, columns):
+        times, values, *clock = columns
+        if len(values) == 0:
+            return columns
+        windows, partial = self._windows(values)
+        return (times, (np.nanmean if partial else np.mean)(windows, axis=1), *clock)
+
+
+class MedianFilter(_WindowFilter):
+    '''
+    Median of the last `points` readings (removes isolated spikes without smoothing steps)
+
+    Args:
+        points (int): Window length
+    '''
+
+    def process(self, columns):
+        times, values, *clock = columns
+        if len(values) == 0:
+            return columns
+        windows, partial = self._windows(values)
+        return (times, (np.nanmedian if partial else np.median)(windows, axis=1), *clock)
+
+
+class OutlierRejection(_WindowFilter):
+    '''
+    Drop the readings farther than `threshold` robust standard deviations (1.4826 * MAD)
+    from the median of the last `points` readings
+
+    Args:
+        threshold (float): Rejection threshold in standard deviations
+        points (int): Window length
+    '''
+
+    def __init__(self, threshold: float = 5.0, points: int = 25):
+        if float(threshold) <= 0:
+            raise ValueError('the threshold must be positive')
+        self.threshold = float(threshold)
+        super().__init__(points)
+
+    def process(self, columns):
+        values = columns[1]
+        if len(values) == 0:
+            return columns
+        windows, partial = self._windows(values)
+        median_of = np.nanmedian if partial else np.median
+        median = median_of(windows, axis=1)
+        mad = median_of(np.abs(windows - median[:, None]), axis=1)
+        # Con MAD nula (señal constante) no hay escala para decidir: se conserva la lectura
+        keep = (mad == 0) | (np.abs(values - median) <= self.threshold * 1.4826 * mad)
+        if keep.all():
+            return columns
+        return tuple(column[keep] for column in columns)
+
+
+class BoxcarDecimation(BlockFilter):
+    '''
+    Replace every `factor` readings by their mean (all the columns are averaged, so
+    the time of an output sample is the mean time of its group)
+
+    Args:
+        factor (int): Readings per output sample
+    '''
+
+    def __init__(self, factor: int = 10):
+        if int(factor) < 1:
+            raise ValueError('the decimation factor must be at least 1')
+        self.factor = int(factor)
+        self.reset()
+
+    def reset(self):
+        self._carry = None   # lecturas de un grupo incompleto
+
+    def process(self, columns):
+        if self._carry is not None:
+            columns = tuple(np.concatenate([carry, column]) for carry, column in zip(self._carry, columns))
+        complete = len(columns[1]) // self.factor * self.factor
+        self._carry = tuple(column[complete:] for column in columns)
+        return tuple(np.asarray(column[:complete], dtype=np.float64).reshape(-1, self.factor).mean(axis=1)
+                     for column in columns)
+
+
+# Etapas disponibles en la especificación del pipeline: nombre -> clase (parámetros en orden)
+FILTERS = {
+    'average': MovingAverage,
+    'median': MedianFilter,
+    'outlier': OutlierRejection,
+    'boxcar': BoxcarDecimation,
+}
+
+
+class FilterPipeline:
+    '''
+    Chain of filter stages applied in order to every acquired block
+
+    Args:
+        stages (list): BlockFilter objects
+        spec (str): Text the stages were parsed from (written in the export header)
+    '''
+
+    def __init__(self, stages: list[BlockFilter], spec: str = ''):
+        self.stages = stages
+        self.spec = spec
+
+    def __bool__(self) -> bool:
+        return bool(self.stages)
+
+    def reset(self):
+        '''Forget the samples carried by every stage'''
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, columns: tuple[np.ndarray, ...]) -> tuple[np.ndarray, ...]:
+        '''
+        Run a block through every stage
+
+        Args:
+            columns (tuple): Time, current and the optional clock columns of the block
+
+        Returns:
+            tuple: Filtered columns (empty while a decimating stage fills a group)
+        '''
+        for stage in self.stages:
+            columns = stage.process(columns)
+            if len(columns[1]) == 0:
+                break
+        return columns
+
+
+def parse_filters(spec: str) -> FilterPipeline:
+    '''
+    Build a pipeline from a text such as "outlier:5, median:5, boxcar:10": stages
+    separated by commas, each a name of FILTERS followed by its parameters after ':'
+
+    Args:
+        spec (str): Pipeline specification (empty = no filtering)
+
+    Returns:
+        FilterPipeline: Stages in order
+
+    Raises:
+        ValueError: Unknown stage or invalid parameter
+    '''
+    stages = []
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        name, *params = [part.strip() for part in item.split(':')]
+        if name.lower() not in FILTERS:
+            raise ValueError(f'unknown filter "{name}" (available: {", ".join(FILTERS)})')
+        try:
+            values = [float(param) for param in params]
+        except ValueError:
+            raise ValueError(f'invalid parameters in "{item}"') from None
+        try:
+            stages.append(FILTERS[name.lower()](*values))
+        except TypeError:
+            raise ValueError(f'too many parameters in "{item}"') from None
+    return FilterPipeline(stages, ', '.join(item.strip() for item in spec.split(',') if item.strip()))
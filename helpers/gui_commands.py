@@ -1,12 +1,25 @@
-from .serial_commands import initialize_device
+from .serial_commands import initialize_device, close_all_connections, scan_ports
 from tkinter import filedialog, messagebox
 import numpy as np
 from tkinter import *
 from customtkinter import *
-import serial
-import matplotlib.pyplot as plt
+import serial, os, time
 
-from .plot_commands import stop_plot
+from .plot_commands import start_acquisition, stop_plot, add_series, remove_series, add_overlay
+from .sample_store import SampleStore
+from .export_commands import (missing_export_fields, export_metadata, export_path, export_info,
+                              recording, stop_recording)
+from .exporter import Exporter, snapshot
+from .viewer import RunLoader, OPEN_FILETYPES
+from .sequencer import load_recipe, send_block, describe_block
+from .instrumentation import monitor
+from .discovery import PortDiscovery
+
+PERFORMANCE_INTERVAL_MS = 1000  # periodo de refresco del panel de rendimiento
+PORTS_POLL_MS = 200             # periodo de aplicación de los eventos de conexión de puertos
+EXPORT_POLL_MS = 100            # periodo de refresco del progreso de la exportación
+OPEN_POLL_MS = 100              # periodo de refresco de la carga de ficheros guardados
+RECIPE_POLL_MS = 20             # resolución de los tiempos de espera y adquisición de las recetas
 
 def update_borders_color(root: CTk, frames: list[CTkFrame]):
     '''
@@ -26,25 +39,64 @@ def update_borders_color(root: CTk, frames: list[CTkFrame]):
 
 def select_device(app: 'KeithleyApp', option: str):
     '''
-    Selection of the device from the combobox and update the label with the selected device
+    Selection of the device from the combobox and update the label with the selected devices.
+    With "Multiple instruments" enabled the device is added to the selection, otherwise
+    it replaces it
 
     Args: 
-        device (dict): Dictionary containing the device information and combobox widget
-        selected_device_label (Label): Label widget to display the selected device
+        app (KeithleyApp): KeithleyApp object containing the device information
+        option (str): Selected option of the combobox
     '''
 
     device: dict = app.device
     selected_device_label: Label = app.device_selection_lbl
 
-    devices = [device for device in device['com_ports']]
+    devices = app.discovery.ports   # puertos en caché, sin volver a enumerarlos
 
     for instrument in devices:
         if f'{instrument}' == option:
+            if app.data['running']:
+                messagebox.showerror('Error', 'Stop the acquisition before changing the devices.')
+                return
+            if not app.multi_device.get():
+                for port in list(app.data['series']):
+                    if port != instrument.device:
+                        remove_series(app, port)
             device['selected_device'] = instrument.device
+            add_series(app, instrument.device)
             initialize_device(app)
-            selected_device_label.configure(text=f"{device['selected_device']} selected")
+            selected_device_label.configure(text=f"{', '.join(app.data['series'])} selected")
             # break
 
+def update_ports(app: 'KeithleyApp', reschedule: bool = True):
+    '''
+    Apply the plug/unplug events of the port discovery to the combobox and to the
+    label of the selected devices. Runs in the Tk thread and reschedules itself with root.after
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the device information and root window
+        reschedule (bool): Schedule the next update
+    '''
+    discovery: PortDiscovery = app.discovery
+    events = discovery.pop_events()
+    # Sin puertos la primera enumeración no produce eventos, pero debe sustituir a 'Scanning ports...'
+    first_scan = discovery.scanned.is_set() and not app.device['ports_listed']
+    if events or first_scan:
+        for event, port in events:
+            print(f'Port {event}: {port}' + (f' ({port.hwid})' if port.hwid != 'n/a' else ''))
+        app.device['ports_listed'] = discovery.scanned.is_set()
+        scan_ports(app.device, discovery.ports)
+
+        selected = list(app.data['series'])
+        disconnected = [device for device in selected if device not in discovery]
+        text = f"{', '.join(selected)} selected" if selected else 'No device selected'
+        if disconnected:
+            text += f" ({', '.join(disconnected)} disconnected)"
+        app.device_selection_lbl.configure(text=text)
+
+    if reschedule:
+        app.root.after(PORTS_POLL_MS, update_ports, app)
+
 def get_folder_path(app: 'KeithleyApp'):
     '''
     Open a file dialog to select the export directory and update the label with the selected path
@@ -63,78 +115,367 @@ def get_folder_path(app: 'KeithleyApp'):
 
 def export_data(app: 'KeithleyApp'):
     '''
-    Export the data to a file in the selected directory
+    Export the data to a file in the selected directory, in the selected format. If
+    the run is being recorded to file, the record files are finalized instead of
+    rewriting the data. With several instruments every one gets its (time, current)
+    columns, padded with nan to the length of the longest series.
+
+    The samples acquired so far are written by an Exporter thread (the acquisition
+    continues); poll_export shows its progress
     
     Args:
         app (KeithleyApp): KeithleyApp object containing the data to be exported
     '''
     data: dict = app.data
-    text: dict = app.text
-    export_name_entry: Entry = app.export_name_entry
-    device: dict = app.device
-    
-    requirements = [text['smp_name'].get() not in ('', None),
-                    text['smp_info'].get() not in ('', None),
-                    text['export_name'].get() not in ('', None),
-                    data['export_directory'] not in ('', None),
-    ]
-    requirement_info = ['Sample name', 'Sample information',
-                        'Export name', 'Export directory'
-    ]
-
-    fulfilled_list = [requirement_info[i] for i, requirement in enumerate(requirements) if not requirement]
-
-    if not all(requirements):
+    series_dict: dict = data['series']
+
+    fulfilled_list = missing_export_fields(app)
+
+    if fulfilled_list:
         messagebox.showerror('Error', f'Please fill in the following fields:\n\t{"\n\t".join(fulfilled_list)}')
+    elif recording(app):
+        if data['running']:
+            part_paths = []
+            for series in series_dict.values():
+                if series['recorder'] is not None:
+                    series['recorder'].sync()
+                    part_paths.append(series['recorder'].part_path)
+            messagebox.showinfo('Export', f'Data is being recorded to {", ".join(part_paths)}.\nStop the acquisition and export again to finalize the file.')
+        else:
+            print(stop_recording(app))
+            export_performance(app)
+    elif app.exporter is not None:
+        messagebox.showinfo('Export', 'An export is already running.')
     else:
-        data['sample_name'] = text['smp_name'].get()
-        data['sample_info'] = text['smp_info'].get()
-        data['export_name'] = text['export_name'].get()
-        rules = [len(data['current_data']) > 0,
-                len(data['time_data']) > 0]
+        stores: list[SampleStore] = [series['samples'] for series in series_dict.values()]
+        rules = [any(len(samples) > 0 for samples in stores)]
         if all(rules):
-            final_data = np.hstack((np.array(data['time_data']).reshape(-1, 1),np.array(data['current_data']).reshape(-1, 1)))
-            sample_name = ['Sample name:',
-                        data['sample_name']
-            ]
-            sample_info = ['Sample information:',
-                        data['sample_info']
-            ]
-
-            for device in device['com_ports']:
-                print(device)
-                if device.device == app.device['selected_device']:
-                    print(device)
-                    break
-
-            device_info = ['Device information:',
-                        device['com_device'],
-            ]
-            final_comments = '\n'.join([' '.join(sample_name), ' '.join(sample_info), ' '.join(device_info),'\n'])
-            final_header = 'Relative time (s)\tCurrent (A)'
-            filename_export = os.path.join(app.data['export_directory'], (export_name_entry.get() + '.dat'))
+            final_comments, final_header = export_metadata(app)
+            filename_export = export_path(app, app.export_format.get())
             print(filename_export)
-            np.savetxt(filename_export,final_data, delimiter='\t', fmt='%s', header= final_header, comments= final_comments)
+            app.exporter = Exporter(filename_export, app.export_format.get(),
+                                    [snapshot(samples) for samples in stores],
+                                    final_comments, final_header, export_info(app, final_comments, final_header))
+            app.exporter.start()
+            app.export_cancel_btn.configure(state='normal')
+            poll_export(app)
         else:
             messagebox.showerror('Error', 'No data to export. Please start the acquisition first.')
             return
 
+def poll_export(app: 'KeithleyApp'):
+    '''
+    Show the progress of the running export and report its end.
+    Runs in the Tk thread and reschedules itself with root.after until the export ends
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the exporter and its widgets
+    '''
+    exporter: Exporter = app.exporter
+    app.export_progress.set(exporter.progress)
+    name = os.path.basename(exporter.path)
+    if not exporter.done.is_set():
+        app.export_status.set(f'Exporting {name}: {exporter.written}/{exporter.rows} rows')
+        app.root.after(EXPORT_POLL_MS, poll_export, app)
+        return
+
+    app.exporter = None
+    app.export_cancel_btn.configure(state='disabled')
+    if exporter.error is not None:
+        app.export_status.set(f'Export of {name} failed')
+        messagebox.showerror('Error', f'Error exporting the data: {exporter.error}')
+    elif exporter.cancelled:
+        app.export_status.set(f'Export of {name} cancelled')
+    else:
+        app.export_status.set(f'Exported {exporter.rows} rows to {name}')
+        export_performance(app)
+
+def cancel_export(app: 'KeithleyApp'):
+    '''
+    Cancel the running export, if any (its partial file is removed)
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the exporter
+    '''
+    if app.exporter is not None:
+        app.exporter.cancel()
+
+def open_data(app: 'KeithleyApp'):
+    '''
+    Open previously exported files and overlay them on the plot. Every file is
+    loaded by a RunLoader thread (the acquisition continues); poll_open adds its
+    lines when it is ready
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot and the loaders
+    '''
+    if app.fig is None:
+        return
+    paths = filedialog.askopenfilenames(title='Open data', filetypes=OPEN_FILETYPES,
+                                        initialdir=app.data['export_directory'] or None)
+    polling = bool(app.loaders)
+    for path in paths:
+        loader = RunLoader(path, name=f'loader-{os.path.basename(path)}')
+        loader.start()
+        app.loaders.append(loader)
+    if app.loaders and not polling:
+        poll_open(app)
+
+def poll_open(app: 'KeithleyApp'):
+    '''
+    Show the progress of the files being opened and plot the ones that are loaded.
+    Runs in the Tk thread and reschedules itself with root.after while files are loading
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the loaders
+    '''
+    messages = []
+    for loader in list(app.loaders):
+        name = os.path.basename(loader.path)
+        if not loader.done.is_set():
+            messages.append(f'Loading {name}: {loader.progress:.0%}')
+            continue
+        app.loaders.remove(loader)
+        for warning in loader.warnings:
+            print(warning)
+        if loader.error is not None:
+            messages.append(f'Opening {name} failed')
+            messagebox.showerror('Error', f'Error opening {name}: {loader.error}')
+        elif loader.result is not None:
+            run: dict = loader.result
+            lines = add_overlay(app, run)
+            source = ' (cached)' if run['source'] == 'cache' else ''
+            messages.append(f'Opened {name}{source}: {len(run["data"])} rows, {lines} lines')
+            if run['metadata'].get('sample_name'):
+                print(f'{name}: {run["metadata"]["sample_name"]} - {run["metadata"].get("sample_info", "")}')
+    app.open_status.set('\n'.join(messages))
+    if app.loaders:
+        app.root.after(OPEN_POLL_MS, poll_open, app)
+
+def cancel_open(app: 'KeithleyApp'):
+    '''
+    Cancel the files being opened (their partial caches are removed)
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the loaders
+    '''
+    for loader in app.loaders:
+        loader.cancel()
+
+def run_recipe(app: 'KeithleyApp'):
+    '''
+    Load a recipe file and run its blocks on every selected instrument (see
+    helpers.sequencer): the commands of each block are sent as one batch per
+    instrument, then the block waits and acquires. Consecutive acquisition
+    segments in the same mode and without dwell keep the acquisition running, so
+    there is no dead time between them; every segment start is stored as an event
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the devices and the recipe state
+    '''
+    if app.recipe is not None:
+        messagebox.showinfo('Recipe', 'A recipe is already running.')
+        return
+    if not app.data['series']:
+        messagebox.showerror('Error', 'No device selected.')
+        return
+    path = filedialog.askopenfilename(title='Run recipe', filetypes=[('Recipe', '*.json'), ('All files', '*.*')])
+    if not path:
+        return
+    try:
+        name, blocks = load_recipe(path)
+    except (OSError, ValueError) as e:
+        messagebox.showerror('Error', f'Invalid recipe {os.path.basename(path)}: {e}')
+        return
+
+    print(f'Recipe {name}:' + ''.join(f'\n  {describe_block(block)}' for block in blocks))
+    app.recipe = {
+        'name': name,
+        'blocks': blocks,
+        'index': -1,            # bloque en curso
+        'phase': 'next',        # next, stopping, commands, dwell, acquire
+        'pending': 0,           # instrumentos que aún no han confirmado el bloque (*OPC?)
+        'deadline': 0.0,        # fin de la espera o de la adquisición (time.monotonic)
+        'acquiring': None,      # (modo, ráfaga) de la adquisición en marcha iniciada por la receta
+    }
+    poll_recipe(app)
+
+def _recipe_event(app: 'KeithleyApp', text: str):
+    '''Store a recipe step in the events of every series (export header and record file)'''
+    data: dict = app.data
+    if data['first_time'] is None:
+        return
+    relative_time = time.perf_counter() - data['first_time']
+    for series in data['series'].values():
+        series['events'].append((relative_time, text))
+        if series['recorder'] is not None:
+            series['recorder'].comment(f't={relative_time:.6f} s {text}')
+
+def _send_recipe_block(app: 'KeithleyApp', block: dict):
+    '''Submit the commands of a block to every device worker; the last confirmation starts the dwell'''
+    recipe: dict = app.recipe
+    recipe['phase'] = 'commands'
+    recipe['pending'] = len(app.data['series'])
+
+    def sent(block: dict):
+        if app.recipe is not recipe:
+            return   # receta detenida mientras tanto
+        recipe['pending'] -= 1
+        if recipe['pending'] > 0:
+            return
+        if block['nplc'] is not None:
+            app.data['nplc'] = block['nplc']
+            app.int_rate.set(block['nplc'])
+            for series in app.data['series'].values():
+                if series['auto'] is not None:
+                    series['auto'].nplc = block['nplc']
+        if block['format'] is not None:
+            app.data_format.set(block['format'])
+        recipe['phase'] = 'dwell'
+        recipe['deadline'] = time.monotonic() + block['dwell']
+
+    def failed(error: Exception, device: str):
+        if app.recipe is recipe:
+            stop_recipe(app)
+            messagebox.showerror('Error', f'Recipe {recipe["name"]} stopped: error on {device}: {error}')
+
+    for device, worker in app.workers.items():
+        worker.submit(send_block, device, block, callback=sent,
+                      error_callback=lambda error, device=device: failed(error, device))
+
+def poll_recipe(app: 'KeithleyApp'):
+    '''
+    Advance the running recipe: start the next block when the current one ends,
+    the dwell and acquisition timers, and the acquisition changes.
+    Runs in the Tk thread and reschedules itself with root.after until the recipe ends
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the recipe state
+    '''
+    recipe: dict = app.recipe
+    if recipe is None:
+        return
+    data: dict = app.data
+    now = time.monotonic()
+
+    if recipe['phase'] == 'next':
+        recipe['index'] += 1
+        if recipe['index'] == len(recipe['blocks']):
+            stop_recipe(app)
+            app.recipe_status.set(f'Recipe {recipe["name"]} finished')
+            return
+        block = recipe['blocks'][recipe['index']]
+        app.recipe_status.set(f'{recipe["name"]} [{recipe["index"] + 1}/{len(recipe["blocks"])}] '
+                              f'{describe_block(block)}')
+        segment = (block['mode'] or app.acq_mode.get(), block['burst_size'] or app.burst_size.get())
+        # Un segmento seguido, sin espera y en el mismo modo, continúa la adquisición en marcha
+        continues = data['running'] and block['acquire'] and not block['dwell'] and segment == recipe['acquiring']
+        if not continues and (data['running'] or any(worker.acquiring for worker in app.workers.values())):
+            stop_plot(app)
+            recipe['acquiring'] = None
+            recipe['phase'] = 'stopping'
+        else:
+            _send_recipe_block(app, block)
+    elif recipe['phase'] == 'stopping':
+        # La nueva configuración se envía cuando los hilos han terminado la última lectura
+        if not any(worker.acquiring for worker in app.workers.values()):
+            _send_recipe_block(app, recipe['blocks'][recipe['index']])
+    elif recipe['phase'] == 'dwell' and now >= recipe['deadline']:
+        block = recipe['blocks'][recipe['index']]
+        if not block['acquire']:
+            recipe['phase'] = 'next'
+        else:
+            if not data['running']:
+                if block['mode']:
+                    app.acq_mode.set(block['mode'])
+                if block['burst_size']:
+                    app.burst_size.set(block['burst_size'])
+                start_acquisition(app)
+                if not data['running']:   # error ya mostrado por start_acquisition
+                    stop_recipe(app)
+                    return
+                recipe['acquiring'] = (app.acq_mode.get(), app.burst_size.get())
+            _recipe_event(app, f'Recipe {recipe["name"]}: {describe_block(block)}')
+            recipe['phase'] = 'acquire'
+            recipe['deadline'] = time.monotonic() + block['acquire']
+    elif recipe['phase'] == 'acquire' and now >= recipe['deadline']:
+        recipe['phase'] = 'next'
+
+    app.root.after(RECIPE_POLL_MS, poll_recipe, app)
+
+def stop_recipe(app: 'KeithleyApp'):
+    '''
+    Stop the running recipe, if any, and the acquisition it started
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the recipe state
+    '''
+    recipe: dict = app.recipe
+    if recipe is None:
+        return
+    app.recipe = None
+    if recipe['acquiring'] is not None or app.data['running']:
+        stop_plot(app)
+    app.recipe_status.set(f'Recipe {recipe["name"]} stopped at block {recipe["index"] + 1}')
+
+def export_performance(app: 'KeithleyApp'):
+    '''
+    Write the performance statistics next to the data file (<export name>.perf.json)
+    if "Export statistics with data" is enabled
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the export information
+    '''
+    if app.export_performance.get():
+        monitor.write(export_path(app, '.perf.json'))
+
+def toggle_performance(app: 'KeithleyApp'):
+    '''
+    Show or hide the contents of the Performance frame
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the performance widgets
+    '''
+    content: CTkFrame = app.performance_content
+
+    if content.winfo_ismapped():
+        content.grid_remove()
+        app.performance_btn.configure(text='Performance ▸')
+    else:
+        content.grid()
+        app.performance_btn.configure(text='Performance ▾')
+        update_performance(app, reschedule=False)
+
+def update_performance(app: 'KeithleyApp', reschedule: bool = True):
+    '''
+    Refresh the statistics of the Performance frame while it is visible.
+    Runs in the Tk thread and reschedules itself with root.after
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the performance widgets
+        reschedule (bool): Schedule the next refresh
+    '''
+    if app.performance_content.winfo_ismapped():
+        app.performance_str.set(monitor.format())
+    if reschedule:
+        app.root.after(PERFORMANCE_INTERVAL_MS, update_performance, app)
+
 def close_app(app: 'KeithleyApp'):
     '''
     Close the application and stop the acquisition if running
 
     Args:
-        data (dict): Dictionary containing the data to be plotted
-        device (dict): Dictionary containing the device information
-        root (Tk): Tkinter root window
+        app (KeithleyApp): KeithleyApp object containing the data, devices and root window
     '''
     its_running: bool = app.data['running']
-    device: str = app.device['selected_device']
     root: Tk = app.root
 
     if its_running:
-        stop_plot(app.data)
-        serial.Serial(device).close()
-    
-    plt.close('all')
+        stop_plot(app)
+    stop_recording(app)
+    close_all_connections()
+
+    if app.fig is not None:
+        import matplotlib.pyplot as plt
+        plt.close('all')
     root.destroy()
\ No newline at end of file
@@ -0,0 +1,190 @@
+from collections import deque
+from threading import Lock
+import json, time
+
+import numpy as np
+
+STAGES = ('serial', 'parse', 'acquire', 'update_data', 'render', 'drain', 'tk_lag')
+
+
+class _Timer:
+    '''Context manager that records the time spent in its block into a stage'''
+
+    __slots__ = ('monitor', 'stage', 'start')
+
+    def __init__(self, monitor: 'PerfMonitor', stage: str):
+        self.monitor = monitor
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.monitor.record(self.stage, time.perf_counter() - self.start)
+
+
+class PerfMonitor:
+    '''
+    Rolling timings of the stages of the acquisition path
+
+    Every stage keeps the durations of its last `window` executions in a deque
+    (append is atomic, so the device worker and the Tk thread record without
+    locking each other); percentiles are computed only when a snapshot is taken.
+    Counters accumulate since the last reset and events (e.g. acquired samples)
+    are kept with their time to compute rates.
+
+    Args:
+        window (int): Executions kept per stage
+        rate_window (float): Seconds used to compute rates
+    '''
+
+    def __init__(self, window: int = 2048, rate_window: float = 5.0):
+        self.window = window
+        self.rate_window = rate_window
+        self.enabled = True
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        '''Drop every timing, counter and gauge'''
+        with self._lock:
+            self.stages: dict[str, deque] = {stage: deque(maxlen=self.window) for stage in STAGES}
+            self.counters: dict[str, int] = {}
+            self.gauges: dict[str, float] = {}
+            self.events: dict[str, deque] = {}
+            self.started = time.perf_counter()
+
+    def time(self, stage: str) -> _Timer:
+        '''
+        Time a block: `with monitor.time('render'): ...`
+
+        Args:
+            stage (str): Stage name
+
+        Returns:
+            _Timer: Context manager
+        '''
+        return _Timer(self, stage)
+
+    def record(self, stage: str, seconds: float):
+        '''
+        Record one execution of a stage
+
+        Args:
+            stage (str): Stage name
+            seconds (float): Duration (s)
+        '''
+        if self.enabled:
+            durations = self.stages.get(stage)
+            if durations is None:
+                with self._lock:
+                    durations = self.stages.setdefault(stage, deque(maxlen=self.window))
+            durations.append(seconds)
+
+    def count(self, name: str, n: int = 1):
+        '''
+        Add to a counter and record the event for rate()
+
+        Args:
+            name (str): Counter name
+            n (int): Increment
+        '''
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+                self.events.setdefault(name, deque(maxlen=self.window)).append((time.perf_counter(), n))
+
+    def gauge(self, name: str, value: float):
+        '''
+        Set the current value of a gauge (e.g. queue depth)
+
+        Args:
+            name (str): Gauge name
+            value (float): Value
+        '''
+        self.gauges[name] = value
+
+    def rate(self, name: str) -> float:
+        '''
+        Events per second of a counter over the last `rate_window` seconds
+
+        Args:
+            name (str): Counter name
+
+        Returns:
+            float: Rate (1/s)
+        '''
+        now = time.perf_counter()
+        with self._lock:
+            events = list(self.events.get(name, ()))
+        recent = [(t, n) for t, n in events if now - t <= self.rate_window]
+        if not recent:
+            return 0.0
+        if len(events) == self.window and recent[0] == events[0]:
+            span = now - events[0][0]   # la ventana de eventos es más corta que rate_window
+        else:
+            span = min(self.rate_window, now - self.started)
+        return sum(n for _, n in recent) / span if span > 0 else 0.0
+
+    def percentiles(self, stage: str, q=(50, 99)) -> list[float]:
+        '''
+        Percentiles of the recorded durations of a stage
+
+        Args:
+            stage (str): Stage name
+            q (tuple): Percentiles
+
+        Returns:
+            list: Durations in milliseconds (nan if the stage was not executed)
+        '''
+        durations = np.fromiter(tuple(self.stages.get(stage, ())), dtype=np.float64)
+        if len(durations) == 0:
+            return [float('nan')] * len(q)
+        return (np.percentile(durations, q) * 1e3).tolist()
+
+    def snapshot(self) -> dict:
+        '''
+        Current statistics
+
+        Returns:
+            dict: Rates, counters, gauges and p50/p99/count of every stage
+        '''
+        stages = {}
+        for stage in list(self.stages):
+            p50, p99 = self.percentiles(stage)
+            stages[stage] = {'p50_ms': p50, 'p99_ms': p99, 'count': len(self.stages[stage])}
+        return {'sample_rate': self.rate('samples'), 'counters': dict(self.counters),
+                'gauges': dict(self.gauges), 'stages': stages}
+
+    def format(self) -> str:
+        '''
+        Statistics as fixed-width text for the Performance panel
+
+        Returns:
+            str: Multi-line summary
+        '''
+        snapshot = self.snapshot()
+        counters, gauges = snapshot['counters'], snapshot['gauges']
+        lines = [f'Sample rate:    {snapshot["sample_rate"]:10.1f} samples/s',
+                 f'Dropped frames: {counters.get("dropped_frames", 0):10d}',
+                 f'Queue depth:    {int(gauges.get("queue_depth", 0)):10d} blocks ({int(gauges.get("stalls", 0))} stalls)',
+                 f'{"Stage":<12}{"p50 (ms)":>10}{"p99 (ms)":>10}']
+        for stage, values in snapshot['stages'].items():
+            if values['count']:
+                lines.append(f'{stage:<12}{values["p50_ms"]:10.3f}{values["p99_ms"]:10.3f}')
+        return '\n'.join(lines)
+
+    def write(self, path: str):
+        '''
+        Write the statistics as JSON (e.g. next to an exported data file)
+
+        Args:
+            path (str): Output file
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+# Monitor compartido por la capa serie, el hilo del dispositivo y la GUI
+monitor = PerfMonitor()
@@ -0,0 +1,168 @@
+from collections import deque
+from threading import Thread, Event, Condition, Lock
+import queue, traceback
+
+
+class DeviceWorker:
+    '''
+    Worker thread that owns all the serial traffic of one device
+
+    The Tk thread never touches the port: device commands are submitted to a command
+    queue and executed here in order, between acquisitions. Acquired blocks are pushed
+    into a deque (append/popleft are atomic, so producer and consumer never lock each
+    other) that the Tk thread drains in batches with root.after. Command results and
+    errors come back the same way, as callbacks run by the Tk thread.
+
+    Args:
+        max_pending (int): Maximum number of undrained blocks before the producer waits
+        name (str): Thread name
+    '''
+
+    def __init__(self, max_pending: int = 10000, name: str = 'device-worker'):
+        self.max_pending = max_pending
+        self.samples: deque = deque()     # bloques (timestamps, readings) pendientes de dibujar
+        self.results: deque = deque()     # callbacks a ejecutar en el hilo de Tk
+        self.commands: queue.Queue = queue.Queue()
+        self.stalls = 0                   # veces que el productor esperó al consumidor
+        self._acquire = None
+        self._acquire_error = None
+        self._teardown = None
+        self._stop_acquisition = Event()
+        self._stop_lock = Lock()
+        self._generation = 0              # arranques pedidos desde el hilo de Tk
+        self._stopped_generation = 0      # último arranque afectado por una parada
+        self._drained = Condition()       # el consumidor ha vaciado la cola de bloques
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def acquiring(self) -> bool:
+        return self._acquire is not None
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def submit(self, func, *args, callback=None, error_callback=None):
+        '''
+        Queue a device command to run in the worker thread
+
+        Args:
+            func (callable): Function to run with *args
+            callback (callable): Called in the Tk thread with the result
+            error_callback (callable): Called in the Tk thread with the exception
+        '''
+        self.commands.put((func, args, callback, error_callback))
+
+    def start_acquisition(self, acquire, setup=None, teardown=None, error_callback=None):
+        '''
+        Start producing blocks of samples
+
+        Args:
+            acquire (callable): Returns one block (timestamps, readings) per call, or None if
+                there is nothing to draw yet (e.g. a decimating filter has not completed a group)
+            setup (callable): Run once in the worker before the first block
+            teardown (callable): Run once in the worker after the last block
+            error_callback (callable): Called in the Tk thread if the acquisition fails
+        '''
+        self._generation += 1
+        generation = self._generation
+
+        def begin():
+            # La adquisición anterior termina aquí (con su teardown) aunque aún no se hubiera
+            # visto la parada, y el evento se limpia en el worker, no en el hilo de Tk
+            if self._acquire is not None:
+                self._end_acquisition()
+            with self._stop_lock:
+                if self._stopped_generation >= generation:
+                    return     # parada pedida después de este arranque: no llega a empezar
+                self._stop_acquisition.clear()
+            if setup is not None:
+                setup()
+            self._teardown = teardown
+            self._acquire = acquire
+            self._acquire_error = error_callback
+
+        self.submit(begin, error_callback=error_callback)
+
+    def stop_acquisition(self):
+        '''Stop producing blocks after the current one (also the starts still queued)'''
+        with self._stop_lock:
+            self._stopped_generation = self._generation
+            self._stop_acquisition.set()
+        with self._drained:
+            self._drained.notify_all()   # despertar al productor si espera al consumidor
+
+    def shutdown(self):
+        '''Stop the acquisition and let the thread finish the queued commands and exit'''
+        self.stop_acquisition()
+        self.commands.put(None)
+
+    def pop_samples(self) -> list:
+        '''Remove and return every pending block (called from the Tk thread)'''
+        samples = self.samples
+        blocks = [samples.popleft() for _ in range(len(samples))]
+        if blocks:
+            with self._drained:
+                self._drained.notify_all()
+        return blocks
+
+    def pop_results(self) -> list:
+        '''Remove and return every pending callback (called from the Tk thread)'''
+        results = self.results
+        return [results.popleft() for _ in range(len(results))]
+
+    def _run(self):
+        while True:
+            # Las órdenes tienen prioridad; sin adquisición se espera a la siguiente
+            try:
+                command = self.commands.get(timeout=0.1) if self._acquire is None else self.commands.get_nowait()
+            except queue.Empty:
+                command = False
+            if command is None:
+                break
+            if command:
+                self._execute(*command)
+
+            if self._acquire is not None:
+                if self._stop_acquisition.is_set():
+                    self._end_acquisition()
+                    continue
+                try:
+                    block = self._acquire()
+                except Exception as e:
+                    traceback.print_exc()
+                    self._end_acquisition()
+                    if self._acquire_error is not None:
+                        self.results.append(lambda e=e, callback=self._acquire_error: callback(e))
+                    continue
+                if len(self.samples) >= self.max_pending:
+                    self.stalls += 1
+                    with self._drained:
+                        self._drained.wait_for(lambda: len(self.samples) < self.max_pending
+                                               or self._stop_acquisition.is_set())
+                if block is not None:
+                    self.samples.append(block)
+
+        if self._acquire is not None:
+            self._end_acquisition()
+
+    def _execute(self, func, args, callback, error_callback):
+        try:
+            result = func(*args)
+        except Exception as e:
+            traceback.print_exc()
+            if error_callback is not None:
+                # 'e' deja de existir al salir del except: se fija como argumento por defecto
+                self.results.append(lambda e=e, callback=error_callback: callback(e))
+            return
+        if callback is not None:
+            self.results.append(lambda result=result, callback=callback: callback(result))
+
+    def _end_acquisition(self):
+        self._acquire = None
+        teardown, self._teardown = self._teardown, None
+        if teardown is not None:
+            try:
+                teardown()
+            except Exception:
+                traceback.print_exc()
@@ -1,20 +1,45 @@
 from tkinter import *
 from tkinter import messagebox
-import matplotlib.pyplot as plt
-import datetime, time
-
-from threading import Thread
-
-from .serial_commands import query
+from typing import TYPE_CHECKING
+import datetime, time, traceback
+
+import numpy as np
+
+from .serial_commands import query_values, configure_burst, configure_single, read_burst, send, MAX_BURST_POINTS
+from .sample_store import SampleStore, TieredStore
+from .decimation import MinMaxPyramid
+from .export_commands import start_recording
+from .pipeline import DeviceWorker
+from .instrumentation import monitor
+from .clock import InstrumentClock
+from .statistics import RunningStats, RollingStats, format_series_statistics
+from .filters import parse_filters, FilterPipeline
+from .autorate import AutoRate
+from .viewer import run_series
+
+if TYPE_CHECKING:   # pyplot se importa al crear el gráfico (initialize_plot); aquí solo para las anotaciones
+    import matplotlib.pyplot as plt
+
+DRAIN_INTERVAL_MS = 30  # periodo de vaciado de la cola de muestras en el hilo de Tk
+MAX_FPS = 30            # límite por defecto de dibujados por segundo
+SPILL_CHUNK = 1 << 19   # muestras por fichero del historial en disco (hasta el doble en memoria)
+RENDER_FLAGS = ('data', 'limits', 'theme', 'labels')  # partes del gráfico pendientes de dibujar
+OVERLAY_ALPHA = 0.6     # opacidad de las medidas abiertas de fichero, por debajo de las líneas en vivo
+
+# Colores de las líneas de cada instrumento según el tema
+LINE_COLORS = {
+    'dark': ["#FF5733", "#33C4FF", "#9CFF33", "#FF33D1", "#FFD133"],
+    'light': ["#007BFF", "#FF7F0E", "#2CA02C", "#D62728", "#9467BD"],
+}
 
 def update_plot_colors(app: 'KeythleyApp'):
     '''
-    Update the plot colors based on the selected theme
+    Update the plot colors based on the selected theme (the caller draws the figure)
     
     Args:
         app (KeithleyApp): KeithleyApp object containing the plot information
     '''
-    theme = app.root._get_appearance_mode()
+    theme = app.plot['theme'] or app.root._get_appearance_mode()
     fig: plt.Figure = app.fig
     ax: plt.Axes = app.ax
     line: plt.Line2D = app.line
@@ -22,11 +47,11 @@ def update_plot_colors(app: 'KeythleyApp'):
     if theme.lower() == 'dark':
         bg_color = "#2E2E2E"  # Fondo oscuro
         text_color = "#FFFFFF"  # Texto blanco
-        line_color = "#FF5733"  # Línea naranja
+        line_colors = LINE_COLORS['dark']   # Primera línea naranja
     else:
         bg_color = "#FFFFFF"  # Fondo claro
         text_color = "#000000"  # Texto negro
-        line_color = "#007BFF"  # Línea azul
+        line_colors = LINE_COLORS['light']  # Primera línea azul
 
     # Configurar colores del gráfico
     ax.set_facecolor(bg_color)
@@ -42,14 +67,21 @@ def update_plot_colors(app: 'KeythleyApp'):
     ax.yaxis.offsetText.set_color(text_color)
     ax.title.set_color(text_color)
 
-    # Actualizar la línea del gráfico (si existe)
+    # Actualizar la línea del gráfico (si existe) y las de los demás instrumentos
     if line:
-        line.set_color(line_color)
-
-    # Redibujar el gráfico
-    fig.canvas.draw_idle()
-
-def initialize_plot(app: 'KeithleyApp') -> tuple[plt.Figure, plt.Line2D, plt.Axes]:
+        line.set_color(line_colors[0])
+    for i, series in enumerate(app.data['series'].values()):
+        series['line'].set_color(line_colors[i % len(line_colors)])
+    # Las medidas superpuestas siguen la paleta después de los instrumentos
+    for i, overlay in enumerate(app.plot['overlays'], start=len(app.data['series'])):
+        overlay['line'].set_color(line_colors[i % len(line_colors)])
+    legend = ax.get_legend()
+    if legend is not None:
+        legend.get_frame().set_facecolor(bg_color)
+        for legend_text in legend.get_texts():
+            legend_text.set_color(text_color)
+
+def initialize_plot(app: 'KeithleyApp') -> tuple['plt.Figure', 'plt.Line2D', 'plt.Axes']:
     '''
     Initialize the plot with empty data and set the labels and title
     
@@ -61,147 +93,775 @@ def initialize_plot(app: 'KeithleyApp') -> tuple[plt.Figure, plt.Line2D, plt.Axe
         line (Line2D): Line object to update the data
         ax (Axes): Axes object to plot the data
     '''
-    
+    import matplotlib.pyplot as plt   # ~1 s de importación: se carga cuando la ventana ya es visible
+
     fig, ax = plt.subplots()
     fig: plt.Figure
     ax: plt.Axes
 
-    line, = ax.plot([],[])
+    line, = ax.plot([],[], animated=True)   # Se dibuja por blitting, fuera del redibujado completo
     ax.set_title(f'Real time data')
     ax.set_xlabel(f'Time (s)', fontweight='bold')
     ax.set_ylabel(f'Current (A)', fontweight='bold')
 
     return fig, line, ax
 
-def update_data(data: dict) -> tuple[plt.Line2D, plt.Axes, plt.Figure]:
+def enable_blitting(app: 'KeithleyApp'):
     '''
-    Update the data with the current time and current data
+    Connect the draw event of the embedded canvas so every full redraw caches the
+    background used by the incremental render path
 
     Args:
-        data (dict): Dictionary containing the data to be plotted
+        app (KeithleyApp): KeithleyApp object containing the plot information
+    '''
+    fig: plt.Figure = app.fig
+    ax: plt.Axes = app.ax
+    plot: dict = app.plot
 
-    returns:
-        x_data (list): List of time data
-        y_data (list): List of current data
-    ''' 
+    def on_draw(event=None):
+        plot['background'] = fig.canvas.copy_from_bbox(ax.bbox)
+        _blit_lines(app)
 
-    date_formatted = datetime.datetime.now()	
-    now_time = date_formatted.timestamp() # tiempo actual en segundos
+    fig.canvas.mpl_connect('draw_event', on_draw)
 
-    if len(data['time_data']) == 0:
-        data['first_time'] = now_time
-        relative_time = now_time - data['first_time']    #dato de tiempo relativo
-        data['time_data'].append(relative_time)
-    else:
-        relative_time = now_time - data['first_time']    #dato de tiempo relativo
-        data['time_data'].append(relative_time)
-    
-    x_data = data['time_data']
-    y_data = data['current_data']
+def _blit_lines(app: 'KeithleyApp'):
+    '''
+    Draw every series line over the current canvas content and blit the axes
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+    '''
+    ax: plt.Axes = app.ax
 
-    return x_data, y_data
+    for series in app.data['series'].values():
+        ax.draw_artist(series['line'])
+    app.fig.canvas.blit(ax.bbox)
 
-def start_acquisition(app: 'KeithleyApp'):
+def enable_zoom_decimation(app: 'KeithleyApp'):
     '''
-    Start the acquisition of data from the device and update the plot
-    this function runs in a separate thread to avoid blocking the GUI
-    and allows the user to stop the acquisition at any time
+    Re-decimate the lines for the new visible range whenever the x limits change (zoom, pan or autoscale)
 
     Args:
         app (KeithleyApp): KeithleyApp object containing the data and plot information
+    '''
+    ax: plt.Axes = app.ax
+
+    def on_xlim_changed(event_ax):
+        for series in [*app.data['series'].values(), *app.plot['overlays']]:
+            _set_line_data(app, series)
+
+    ax.callbacks.connect('xlim_changed', on_xlim_changed)
 
+def _set_line_data(app: 'KeithleyApp', series: dict):
+    '''
+    Hand the line of a series only the min/max envelope of the visible range at the axes pixel width
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot information
+        series (dict): Dictionary containing the samples, pyramid and line of one instrument (or overlay)
+    '''
+    ax: plt.Axes = app.ax
+    pyramid: MinMaxPyramid = series['pyramid']
+
+    pyramid.update()
+    x_start, x_stop = ax.get_xlim()
+    series['line'].set_data(*pyramid.query(x_start, x_stop, ax.bbox.width))
+
+def _user_view(plot: dict) -> bool:
+    '''
+    Check whether the user is zooming or panning with the toolbar, in which case the
+    limits are not refitted to the data
+
+    Args:
+        plot (dict): Dictionary containing the render state
+
+    Returns:
+        bool: True if a toolbar navigation mode is active
+    '''
+    toolbar = plot['toolbar']
+    return toolbar is not None and toolbar.mode != ''
+
+def _update_limits(ax: 'plt.Axes', series_list: list[dict], overlays: list[dict] = ()) -> bool:
+    '''
+    Check the new samples of every series against the axis limits and refit the
+    limits to the retained data if they no longer fit
+
+    Args:
+        ax (Axes): Axes object to plot the data
+        series_list (list): Series with samples
+        overlays (list): Runs opened from file, also kept inside the refitted limits
+
+    Returns:
+        bool: True if the axis limits changed (a full redraw is needed)
+    '''
+    x0, x1 = ax.get_xlim()
+    y0, y1 = ax.get_ylim()
+    fits = True
+    for series in series_list:
+        samples: SampleStore = series['samples']
+        x_new, y_new = samples.read(series['drawn'], samples.total)
+        if len(x_new) and (series['drawn'] == 0 or not (x0 <= x_new.min() and x_new.max() <= x1
+                                                        and y0 <= np.nanmin(y_new) and np.nanmax(y_new) <= y1)):
+            fits = False
+            break
+    if fits:
+        return False
+
+    # Solo se recorre todo el historial cuando hay que redibujar la figura completa
+    _fit_limits(ax, [series['samples'] for series in [*series_list, *overlays]])
+    return True
+
+def _fit_limits(ax: 'plt.Axes', stores: list[SampleStore]):
+    '''
+    Set the axis limits around the retained samples of several stores
+
+    Args:
+        ax (Axes): Axes object to plot the data
+        stores (list): Sample stores (empty ones are skipped)
+    '''
+    stores = [samples for samples in stores if len(samples)]
+    if not stores:
+        return
+    x_min = min(samples.first()[0] for samples in stores)
+    x_max = max(samples.last()[0] for samples in stores)
+    y_min = min(samples.current_range()[0] for samples in stores)
+    y_max = max(samples.current_range()[1] for samples in stores)
+
+    # Se reserva un 50 % más de eje para no redibujar con cada muestra
+    x_span = max(x_max - x_min, 1.0)
+    ax.set_xlim(x_min, x_min + 1.5 * x_span)
+    y_span = (y_max - y_min) or abs(y_max) * 0.1 or 1e-12
+    ax.set_ylim(y_min - 0.1 * y_span, y_max + 0.1 * y_span)
+
+def request_render(app: 'KeithleyApp', *flags: str):
+    '''
+    Mark parts of the plot as changed; render_frame draws all of them in the next frame
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot information
+        flags (str): Any of RENDER_FLAGS
+    '''
+    app.plot['dirty'].update(flags)
+
+def check_theme(app: 'KeithleyApp') -> bool:
+    '''
+    Request the theme colors only when the appearance mode has changed
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the root window and plot information
+
+    Returns:
+        bool: True if the appearance mode changed since the last check
+    '''
+    theme = app.root._get_appearance_mode()
+    if theme == app.plot['theme']:
+        return False
+    app.plot['theme'] = theme
+    request_render(app, 'theme')
+    return True
+
+def _frame_period(app: 'KeithleyApp') -> float:
+    '''
+    Minimum time between two frames from the FPS cap
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the settings
+
+    Returns:
+        float: Seconds (0 = no cap)
+    '''
+    try:
+        max_fps = float(app.max_fps.get())
+    except Exception: # Error getting the FPS cap
+        max_fps = MAX_FPS
+        app.max_fps.set(max_fps)
+    return 1 / max_fps if max_fps > 0 else 0.0
+
+def render_frame(app: 'KeithleyApp', force: bool = False) -> bool:
+    '''
+    Draw every pending change (new data, limits, theme, labels) with a single draw,
+    at most once per frame period. New data alone is blitted over the cached
+    background; any other change redraws the whole figure
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+        force (bool): Draw now even if the frame period has not elapsed
+
+    Returns:
+        bool: True if a frame was drawn
     '''
-    if app.device['selected_device'] == '':
-        messagebox.showerror('Error', 'No device selected')
-        return None, None, None
-    
-    data: dict = app.data
     fig: plt.Figure = app.fig
     ax: plt.Axes = app.ax
-    last_data: float = app.data['last_data']
-    last_time: float = app.data['last_time']
-    last_data_string: Label = app.last_data_str
-    
-    def acquisition():
-        data['running'] = True
-        while data['running']:
-            # Adquisición de datos
-            device = str(app.device['selected_device'])
-            if data['thread_available']:
-                data['thread_available'] = False
-                last_data = float(query(device, 'READ?', data['thread_available']))  # leer el valor de corriente
-                data['thread_available'] = True
-                data['current_data'].append(last_data)         # dato de corriente
-                data['last_data'] = last_data                   # store last data
-            data['last_time'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # store last time
+    plot: dict = app.plot
+
+    if fig is None or not plot['dirty']:
+        return False
+    now = time.perf_counter()
+    if not force and now - plot['last_frame'] < _frame_period(app):
+        return False   # se dibuja en el siguiente ciclo, con lo acumulado hasta entonces
+    dirty, plot['dirty'] = plot['dirty'], set()
+    plot['last_frame'] = now
+
+    if 'theme' in dirty:
+        update_plot_colors(app)
+    updated = [series for series in app.data['series'].values() if series['samples'].total > series['drawn']]
+    if updated:
+        if not _user_view(plot) and _update_limits(ax, updated, plot['overlays']):
+            dirty.add('limits')
+        for series in updated:
+            series['drawn'] = series['samples'].total
+            _set_line_data(app, series)
+    elif dirty == {'data'}:
+        return False
+
+    if dirty != {'data'} or plot['background'] is None:
+        fig.canvas.draw_idle()  # El evento draw vuelve a guardar el fondo y dibuja las líneas
+    else:
+        fig.canvas.restore_region(plot['background'])
+        _blit_lines(app)
+    return True
 
-            last_data_string.set(f'{last_data: .4e} A ({data["last_time"]})')
+def render_line(app: 'KeithleyApp'):
+    '''
+    Update the plotted lines in place with the decimated visible range and draw them
+    now. Only the lines are blitted over the cached background; the whole figure is
+    redrawn only when the axis limits change
 
-            x_data, y_data = update_data(data)
-            # print(f'Time: {x_data[-1]: 5.4f}, Current: {y_data[-1]: #.4g} A')
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+    '''
+    request_render(app, 'data')
+    render_frame(app, force=True)
 
-            # Actualizar gráfico
-            plot_title, x_label, y_label = ax.get_title(), ax.get_xlabel(), ax.get_ylabel()
-            ax.clear()
-            ax.set_title(f'{plot_title}')
-            ax.set_xlabel(f'{x_label}', fontweight='bold')
-            ax.set_ylabel(f'{y_label}', fontweight='bold')
+def new_sample_store(app: 'KeithleyApp') -> SampleStore:
+    '''
+    Create an empty sample store: a fixed-capacity ring buffer if a history limit is
+    configured, else a tiered store that spills the older samples to disk
 
-            update_plot_colors(app)
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the settings
 
-            ax.plot(x_data, y_data)
-            fig.canvas.draw_idle()  # Redraw the canvas
+    Returns:
+        SampleStore: Empty sample store
+    '''
+    try:
+        history_limit = int(app.history_limit.get())
+    except Exception: # Error getting history limit
+        history_limit = 0
+        app.history_limit.set(history_limit)
 
-            time.sleep(0.01)  # Sleep for 10 ms to avoid high CPU usage
+    instrument_clock = app.timestamp_mode.get() == 'Instrument'
+    if history_limit > 0:
+        return SampleStore(history_limit, ring=True, instrument_clock=instrument_clock)
+    return TieredStore(SPILL_CHUNK, instrument_clock=instrument_clock)
 
-    # Crear y arrancar el hilo
+def statistics_window(app: 'KeithleyApp') -> tuple[int, float]:
+    '''
+    Length of the rolling statistics window from the settings
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the settings
+
+    Returns:
+        samples (int): Window in samples (0 if given in seconds)
+        seconds (float): Window in seconds (0 if given in samples)
+    '''
     try:
-        acquisition_thread = Thread(target=acquisition)
-        acquisition_thread.daemon = True  # Permitir que el hilo se cierre al cerrar la aplicación
-        acquisition_thread.start()
+        window = max(0.0, float(app.stats_window.get()))
+    except Exception: # Error getting the statistics window
+        window = 60.0
+        app.stats_window.set(window)
+    if app.stats_window_unit.get() == 'Samples':
+        return int(window), 0.0
+    return 0, window
+
+def new_statistics(app: 'KeithleyApp') -> dict:
+    '''
+    Create the streaming statistics of a series: whole run and rolling window
 
-    except Exception as e:
-        messagebox.showerror('Error', f'Error starting acquisition thread: {e}')            
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the settings
 
-def plot_clear(app: 'KeithleyApp'):
+    Returns:
+        dict: 'run' (RunningStats) and 'window' (RollingStats)
+    '''
+    return {'run': RunningStats(), 'window': RollingStats(*statistics_window(app))}
+
+def reset_samples(app: 'KeithleyApp'):
     '''
-    Clear the plot data and redraw the canvas
+    Replace the sample store of every series with an empty one
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data
+    '''
+    for series in app.data['series'].values():
+        series['samples'] = new_sample_store(app)
+        series['pyramid'] = MinMaxPyramid(series['samples'])
+        series['drawn'] = 0
+        series['stats'] = new_statistics(app)
+        series['events'] = []
+        series['filtered'] = False
+        series['line'].set_data([], [])
+
+def add_series(app: 'KeithleyApp', port: str):
+    '''
+    Add an instrument: its device worker, sample store and line on the shared axes
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+        port (str): Serial port of the instrument
+    '''
+    series_dict: dict = app.data['series']
+    if port in series_dict:
+        return
+
+    if series_dict:
+        line, = app.ax.plot([], [], animated=True, label=port)
+    else:
+        line = app.line   # la primera serie usa la línea de initialize_plot
+        line.set_label(port)
+    samples = new_sample_store(app)
+    series_dict[port] = {
+        'samples': samples,
+        'pyramid': MinMaxPyramid(samples),
+        'line': line,
+        'drawn': 0,             # muestras (índice absoluto) ya dibujadas
+        'recorder': None,       # StreamRecorder del modo "Record to file"
+        'last_data': None,
+        'clock': InstrumentClock(),  # correspondencia reloj del instrumento -> perf_counter
+        'stats': new_statistics(app),  # estadísticas de toda la medida y de la ventana móvil
+        'filters': FilterPipeline([]),  # etapas de filtrado entre la adquisición y el gráfico
+        'auto': None,           # AutoRate si el NPLC se ajusta durante la adquisición
+        'burst_size': 100,      # lecturas por ráfaga (el modo automático la ajusta)
+        'events': [],           # (tiempo relativo, texto) de los cambios de configuración
+        'filtered': False,      # las muestras guardadas pasaron por algún filtro
+    }
+    app.workers[port] = DeviceWorker(name=f'device-worker-{port}')
+    _update_legend(app)
+
+def remove_series(app: 'KeithleyApp', port: str):
+    '''
+    Remove an instrument, stopping its device worker
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+        port (str): Serial port of the instrument
+    '''
+    series = app.data['series'].pop(port, None)
+    if series is None:
+        return
+    worker: DeviceWorker = app.workers.pop(port)
+    worker.shutdown()
+    if series['recorder'] is not None:
+        series['recorder'].close()
+    if series['line'] is app.line:
+        app.line.set_data([], [])
+    else:
+        series['line'].remove()
+    _update_legend(app)
+
+def add_overlay(app: 'KeithleyApp', run: dict) -> int:
+    '''
+    Plot a run opened from file over the live data: one static line per instrument
+    of the file, decimated with its own min/max pyramid like the live series
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot information
+        run (dict): Result of a RunLoader (name, columns and data)
+
+    Returns:
+        int: Number of lines added
+    '''
+    ax: plt.Axes = app.ax
+    plot: dict = app.plot
+
+    added = []
+    for port, time_column, current_column in run_series(run['columns']):
+        times, currents = run['data'][:, time_column], run['data'][:, current_column]
+        valid = np.isfinite(times)   # filas de relleno (nan) de los instrumentos más cortos
+        if not valid.all():
+            times, currents = times[valid], currents[valid]
+        if len(times) == 0:
+            continue
+        samples = SampleStore.from_arrays(times, currents)
+        line, = ax.plot([], [], linewidth=1, alpha=OVERLAY_ALPHA,
+                        label=run['name'] + (f' [{port}]' if port else ''))
+        added.append({'samples': samples, 'pyramid': MinMaxPyramid(samples), 'line': line, 'path': run['path']})
+    plot['overlays'].extend(added)
+
+    if added and not _user_view(plot):
+        live = [series['samples'] for series in app.data['series'].values()]
+        _fit_limits(ax, live + [overlay['samples'] for overlay in plot['overlays']])
+    for overlay in added:   # set_xlim ya las decima si los límites han cambiado
+        _set_line_data(app, overlay)
+    _update_legend(app)
+    request_render(app, 'limits')
+    return len(added)
+
+def clear_overlays(app: 'KeithleyApp'):
+    '''
+    Remove every run opened from file from the plot
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot information
+    '''
+    overlays: list = app.plot['overlays']
+    if not overlays:
+        return
+    for overlay in overlays:
+        overlay['line'].remove()
+    overlays.clear()
+    _update_legend(app)
+    request_render(app, 'limits')
+
+def _update_legend(app: 'KeithleyApp'):
+    '''
+    Show a legend with the port of every line when several instruments, or runs
+    opened from file, are plotted
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the plot information
+    '''
+    ax: plt.Axes = app.ax
+    overlays: list = app.plot['overlays']
+
+    if len(app.data['series']) > 1 or overlays:
+        handles = [series['line'] for series in app.data['series'].values()]
+        ax.legend(handles=handles + [overlay['line'] for overlay in overlays], loc='upper left')
+    elif ax.get_legend() is not None:
+        ax.get_legend().remove()
+    request_render(app, 'theme', 'labels')   # colores de la nueva línea y leyenda
+
+def relative_times(data: dict, timestamps) -> np.ndarray:
+    '''
+    Convert monotonic timestamps of a block to times relative to the start of the run,
+    shared by every instrument (runs in the device worker)
+
+    Args:
+        data (dict): Dictionary containing the data
+        timestamps (array_like): time.perf_counter() timestamps (s) of the readings
+
+    Returns:
+        np.ndarray: Relative times (s)
+    '''
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if data['first_time'] is None:
+        data['first_time'] = float(timestamps[0])
+    return timestamps - data['first_time']    #dato de tiempo relativo
+
+def update_data(series: dict, readings, relative_time, host_time=None, instrument_time=None):
+    '''
+    Store a block of readings in the sample store of a series (runs in the Tk thread)
+
+    Args:
+        series (dict): Dictionary containing the samples of one instrument
+        readings (array_like): Current readings (A)
+        relative_time (array_like): Times (s) relative to the start of the run
+        host_time (array_like): Host times of the requests relative to the start (instrument timestamps only)
+        instrument_time (array_like): Raw instrument timestamps (instrument timestamps only)
+    ''' 
+    samples: SampleStore = series['samples']
+    samples.extend(relative_time, readings, host_time, instrument_time)
+
+def start_acquisition(app: 'KeithleyApp'):
+    '''
+    Start the acquisition of data from every selected device. The readings are taken
+    by one device worker thread per instrument, timestamped on a shared monotonic
+    clock; drain_samples moves them into the plot from the Tk thread, so neither the
+    GUI nor the other instruments wait for a slow serial port.
+
+    Timestamps are the midpoint of the request (time.perf_counter_ns before the write
+    and after the response) or, in 'Instrument' mode, the reading timestamps of the
+    instrument mapped onto the host clock with drift correction (InstrumentClock)
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+
+    '''
+    if not app.data['series']:
+        messagebox.showerror('Error', 'No device selected')
+        return None, None, None
     
+    data: dict = app.data
+
+    if data['running']:
+        return
+
+    burst_mode = app.acq_mode.get() == 'Burst'
+    try:
+        burst_size = int(app.burst_size.get())
+    except Exception: # Error getting burst size
+        burst_size = 100
+    burst_size = max(1, min(burst_size, MAX_BURST_POINTS))   # capacidad del buffer de trazas
+    app.burst_size.set(burst_size)
+
+    instrument_clock = app.timestamp_mode.get() == 'Instrument'
+    for series in data['series'].values():
+        if series['samples'].instrument_clock != instrument_clock:
+            if len(series['samples']):
+                messagebox.showerror('Error', 'Clear the graph before changing the timestamp mode.')
+                return
+            series['samples'] = new_sample_store(app)
+            series['pyramid'] = MinMaxPyramid(series['samples'])
+            series['drawn'] = 0
+    # Etapas de filtrado: una instancia por instrumento, con su propio estado entre bloques
+    try:
+        pipelines = {device: parse_filters(app.filter_spec.get()) for device in data['series']}
+    except ValueError as e:
+        messagebox.showerror('Error', f'Invalid filter: {e}')
+        return
+    for device, series in data['series'].items():
+        series['filters'] = pipelines[device]
+        series['filtered'] |= bool(series['filters'])
+    data['filter_spec'] = next(iter(pipelines.values())).spec
+
+    # NPLC automático: un controlador por instrumento, partiendo del NPLC actual
+    auto_mode = app.auto_nplc.get()
+    if auto_mode != 'Off':
+        try:
+            target = float(app.auto_target.get())
+            autos = {device: AutoRate(auto_mode, target, data['nplc']) for device in data['series']}
+        except Exception:
+            messagebox.showerror('Error', 'The auto NPLC target must be a positive number '
+                                 '(readings/s in Rate mode, A in Noise mode).')
+            return
+    else:
+        autos = {device: None for device in data['series']}
+    for device, series in data['series'].items():
+        series['auto'] = autos[device]
+        series['burst_size'] = burst_size
+
+    # La ventana de estadísticas se puede cambiar entre adquisiciones sin borrar el gráfico
+    samples, seconds = statistics_window(app)
+    for series in data['series'].values():
+        series['stats']['window'].samples, series['stats']['window'].seconds = samples, seconds
+
+    if not start_recording(app):
+        return
+
+    if data['first_time'] is None:
+        data['first_time'] = time.perf_counter()  # origen de tiempos común a todos los instrumentos
+        data['wall_offset'] = time.time() - data['first_time']  # para mostrar la hora de las muestras
+    monitor.reset()   # estadísticas de rendimiento de esta adquisición
+
+    def on_error(error: Exception):
+        data['running'] = any(worker.acquiring for worker in app.workers.values())
+        messagebox.showerror('Error', f'Acquisition stopped: {error}')
+
+    for device, series in data['series'].items():
+        def read_block(device=device, series=series):
+            started = time.perf_counter()
+            auto: AutoRate = series['auto']
+            # Adquisición de datos
+            if burst_mode:
+                start, end, values = read_burst(device, series['burst_size'], auto.nplc if auto else data['nplc'])
+                host_times = np.linspace(start, end, len(values) + 1)[1:]  # lecturas equiespaciadas en la ráfaga
+            else:
+                request_ns = time.perf_counter_ns()
+                values = query_values(device, 'READ?')   # leer el valor de corriente
+                response_ns = time.perf_counter_ns()
+                host_times = np.full(len(values), (request_ns + response_ns) / 2e9)  # punto medio de la petición
+            readings = values['reading']
+            block = (relative_times(data, host_times), readings)
+
+            if instrument_clock and 'timestamp' in values.dtype.names:
+                clock: InstrumentClock = series['clock']
+                instrument_times = values['timestamp'].astype(np.float64)
+                clock.add(instrument_times[-1], host_times[-1])
+                monitor.gauge('clock_drift_ppm', clock.drift_ppm)
+                block = (relative_times(data, clock.to_host(instrument_times)), readings,
+                         block[0], instrument_times)
+
+            # El registro guarda las lecturas sin filtrar; el gráfico y la memoria, las filtradas
+            if series['recorder'] is not None:
+                series['recorder'].write(*block)
+            monitor.count('samples', len(readings))
+            if auto is not None:
+                adjust_rate(app, device, series, host_times, readings, burst_mode)
+            filters: FilterPipeline = series['filters']
+            if filters:
+                block = filters.process(block)
+            monitor.record('acquire', time.perf_counter() - started)
+            return block if len(block[1]) else None   # un diezmado puede no completar ningún grupo
+
+        def setup(device=device, series=series):
+            if burst_mode:
+                configure_burst(device, series['burst_size'])
+
+        def teardown(device=device, series=series):
+            if burst_mode:
+                configure_single(device)
+            if series['recorder'] is not None:
+                series['recorder'].sync()
+
+        app.workers[device].start_acquisition(read_block, setup, teardown, on_error)
+    data['running'] = True
+
+def adjust_rate(app: 'KeithleyApp', device: str, series: dict, host_times: np.ndarray, readings: np.ndarray,
+                burst_mode: bool = False):
+    '''
+    Feed a block to the AutoRate controller of a series and apply its changes: the
+    new NPLC (and, in burst mode, the new burst size) is sent to the instrument, and
+    the change is stored in the series events, written to the record file as a '#'
+    line and shown in the NPLC entry. Runs in the device worker thread
+
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data
+        device (str): Serial port of the instrument
+        series (dict): Series of the instrument
+        host_times (np.ndarray): Host times of the readings (s)
+        readings (np.ndarray): Currents (A)
+        burst_mode (bool): The instrument takes bursts of series['burst_size'] readings
+    '''
+    auto: AutoRate = series['auto']
+    event = auto.update(host_times, readings)
+    if event is None:
+        return
+    send(device, f'NPLC {auto.nplc}')
+    if burst_mode:
+        burst_size = auto.burst_size(series['burst_size'])
+        if burst_size != series['burst_size']:
+            configure_burst(device, burst_size)
+            event += f', burst {series["burst_size"]} -> {burst_size}'
+            series['burst_size'] = burst_size
+
+    relative_time = float(host_times[-1] - app.data['first_time'])
+    series['events'].append((relative_time, event))
+    if series['recorder'] is not None:
+        series['recorder'].comment(f't={relative_time:.6f} s {event}')
+    print(f'{device}: {event}')
+
+    def show_rate(nplc=auto.nplc):
+        app.data['nplc'] = nplc
+        app.int_rate.set(nplc)
+    app.workers[device].results.append(show_rate)
+
+def drain_samples(app: 'KeithleyApp'):
+    '''
+    Move the blocks acquired by the device workers into the sample stores, run the
+    pending command callbacks and refresh the label and the plot once per batch.
+    Runs in the Tk thread and reschedules itself with root.after
+
     Args:
         app (KeithleyApp): KeithleyApp object containing the data and plot information
     '''
     data: dict = app.data
-    fig: plt.Figure = app.fig
-    ax: plt.Axes = app.ax
+    plot: dict = app.plot
     last_data_string: Label = app.last_data_str
 
-    data['time_data'] = []
-    data['current_data'] = []
-
-    plot_title = ax.get_title()
-    x_label = ax.get_xlabel()
-    y_label = ax.get_ylabel()
+    started = time.perf_counter()
+    if plot['last_drain'] is not None:
+        lag = started - plot['last_drain'] - DRAIN_INTERVAL_MS / 1e3   # retraso del bucle de eventos de Tk
+        monitor.record('tk_lag', max(lag, 0.0))
+        if data['running'] and lag > DRAIN_INTERVAL_MS / 1e3:
+            monitor.count('dropped_frames')   # se ha perdido al menos un ciclo de refresco
+    plot['last_drain'] = started
+
+    monitor.gauge('queue_depth', sum(len(worker.samples) for worker in app.workers.values()))
+    monitor.gauge('stalls', sum(worker.stalls for worker in app.workers.values()))
+
+    new_data = False
+    for device, worker in list(app.workers.items()):
+        for callback in worker.pop_results():
+            try:
+                callback()
+            except Exception:
+                traceback.print_exc()   # un callback fallido no debe detener el refresco
+
+        series = data['series'].get(device)
+        # Un bloque en curso durante un Clear llega con tiempos negativos: se recortan esas lecturas
+        blocks = [tuple(column[block[0] >= 0] for column in block) for block in worker.pop_samples()]
+        blocks = [block for block in blocks if len(block[0])]
+        if series is None or not blocks:
+            continue
+        with monitor.time('update_data'):
+            for relative_time, readings, *clock_times in blocks:
+                update_data(series, readings, relative_time, *clock_times)
+            # Estadísticas: un único bloque por ciclo (en modo Single cada bloque es una lectura)
+            times = np.concatenate([block[0] for block in blocks])
+            currents = np.concatenate([block[1] for block in blocks])
+            for stats in series['stats'].values():
+                stats.update(times, currents)
+        series['last_data'] = float(blocks[-1][1][-1])
+        new_data = True
+
+    if new_data:
+        last_values = [(device, series['last_data']) for device, series in data['series'].items()
+                       if series['last_data'] is not None]
+        data['last_data'] = last_values[-1][1]           # store last data
+        # Hora de la última muestra (no la del refresco), a partir de su marca de tiempo
+        last_sample_time = max(series['samples'].last()[0] for series in data['series'].values()
+                               if len(series['samples']))
+        data['last_time'] = datetime.datetime.fromtimestamp(
+            data['wall_offset'] + data['first_time'] + last_sample_time).strftime('%Y-%m-%d %H:%M:%S')  # store last time
+
+        if len(data['series']) == 1:
+            last_data_string.set(f'{data["last_data"]: .4e} A ({data["last_time"]})')
+        else:
+            values = ', '.join(f'{device}: {value: .4e} A' for device, value in last_values)
+            last_data_string.set(f'{values} ({data["last_time"]})')
+        app.stats_str.set('\n'.join(format_series_statistics(data['series'])))
+
+        request_render(app, 'data')
+        monitor.record('drain', time.perf_counter() - started)
+
+    # Actualizar gráfico: un único dibujado por ciclo con todo lo pendiente, limitado a max_fps
+    if app.plot['dirty']:
+        with monitor.time('render'):
+            render_frame(app)
+
+    app.root.after(DRAIN_INTERVAL_MS, drain_samples, app)
 
-    ax.clear()
-    ax.plot([],[])
-    ax.relim()
-    ax.autoscale_view()
+def plot_clear(app: 'KeithleyApp'):
+    '''
+    Clear the plot data and request a redraw of the canvas. An open record file keeps
+    recording, with a '#' line where the relative times restart
 
-    ax.set_title(f'{plot_title}')
-    ax.set_xlabel(f'{x_label}', fontweight='bold')
-    ax.set_ylabel(f'{y_label}', fontweight='bold')
+    Args:
+        app (KeithleyApp): KeithleyApp object containing the data and plot information
+    '''
+    data: dict = app.data
+    ax: plt.Axes = app.ax
+    last_data_string: Label = app.last_data_str
 
-    update_plot_colors(app)
+    # El registro sigue a la adquisición, no al gráfico: continúa en el mismo fichero
+    if data['first_time'] is not None:
+        relative_time = time.perf_counter() - data['first_time']
+        for series in data['series'].values():
+            if series['recorder'] is not None:
+                series['recorder'].comment(f't={relative_time:.6f} s Plot cleared: relative times restart at 0')
+    # Los bloques pendientes tienen tiempos del origen anterior: se descartan
+    for worker in app.workers.values():
+        worker.pop_samples()
+    reset_samples(app)
+    # Con la adquisición en marcha el nuevo origen de tiempos es ahora
+    data['first_time'] = time.perf_counter() if data['running'] else None
+
+    # Se conservan las líneas (y título/etiquetas); solo se vacían sus datos
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    _fit_limits(ax, [overlay['samples'] for overlay in app.plot['overlays']])   # medidas abiertas de fichero
 
     last_data_string.set("N/A")
+    app.stats_str.set('N/A')
 
-    fig.canvas.draw()
+    request_render(app, 'limits')   # sin dibujado bloqueante: lo hace el siguiente ciclo
 
-def stop_plot(data: dict):
+def stop_plot(app: 'KeithleyApp'):
     '''
-    Stop the acquisition of data from the device and update the plot
+    Stop the acquisition of data from every device and update the plot
     
     Args:
-        data (dict): Dictionary containing the data to be plotted
+        app (KeithleyApp): KeithleyApp object containing the data and the device workers
     '''
-    data['running'] = False    
\ No newline at end of file
+    data: dict = app.data
+
+    if data['running'] and data['first_time'] is not None:
+        # Misma medida que el resumen de helpers.acquire, para comparar GUI y modo sin GUI
+        elapsed = time.perf_counter() - data['first_time']
+        for device, series in data['series'].items():
+            print(f'{device}: {series["samples"].total} samples in {elapsed:.2f} s: '
+                  f'{series["samples"].total / elapsed:.1f} samples/s')
+    data['running'] = False
+    for worker in app.workers.values():
+        worker.stop_acquisition()
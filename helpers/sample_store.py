@@ -0,0 +1,418 @@
+import tempfile
+from threading import Lock
+
+import numpy as np
+
+
+class SampleStore:
+    '''
+    Contiguous, typed storage for the acquired (time, current) samples
+
+    In the default growable mode the arrays double their capacity when full, so appending
+    is amortized O(1). In ring mode the capacity is fixed and the oldest samples are
+    dropped; every sample is written twice (at i and i + capacity) so the retained window
+    is always a contiguous slice and can be handed out as a view without copying.
+
+    Times are relative to the first sample of the run, which keeps them small enough for
+    a float32 `time_dtype` on short runs (float32 keeps ~1 ms resolution up to ~2 h).
+
+    With `instrument_clock` the store also keeps, for every sample, the host time of
+    its request and the raw instrument timestamp (FORM:ELEM TIME), so both sources
+    can be exported next to the drift-corrected time used for plotting.
+
+    Args:
+        capacity (int): Initial capacity (growable mode) or number of retained samples (ring mode)
+        ring (bool): Keep only the last `capacity` samples
+        current_dtype (np.dtype): Data type of the current samples (float64 or float32)
+        time_dtype (np.dtype): Data type of the relative times (float64 or float32)
+        instrument_clock (bool): Also store the host and instrument timestamps
+    '''
+
+    def __init__(self, capacity: int = 4096, ring: bool = False,
+                 current_dtype: np.dtype = np.float64, time_dtype: np.dtype = np.float64,
+                 instrument_clock: bool = False):
+        self.capacity = max(1, int(capacity))
+        self.ring = ring
+        self.instrument_clock = instrument_clock
+        size = 2 * self.capacity if ring else self.capacity
+        self._time = np.empty(size, dtype=time_dtype)
+        self._current = np.empty(size, dtype=current_dtype)
+        self._arrays = ['_time', '_current']
+        if instrument_clock:
+            self._host_time = np.empty(size, dtype=np.float64)
+            self._instrument_time = np.empty(size, dtype=np.float64)
+            self._arrays += ['_host_time', '_instrument_time']
+        self._start = 0
+        self._stop = 0
+        self.total = 0   # muestras añadidas desde el último clear()
+
+    @classmethod
+    def from_arrays(cls, time: np.ndarray, current: np.ndarray) -> 'SampleStore':
+        '''
+        Store over existing (time, current) arrays, without copying them (e.g. a run
+        loaded from file, possibly memory-mapped)
+
+        Args:
+            time (np.ndarray): Relative times (s), in increasing order
+            current (np.ndarray): Currents (A), same length
+
+        Returns:
+            SampleStore: Growable store holding every sample
+        '''
+        store = cls(1)
+        store._time, store._current = np.asarray(time), np.asarray(current)
+        store.capacity = store._stop = store.total = len(store._time)
+        store.capacity = max(store.capacity, 1)
+        return store
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    @property
+    def first_index(self) -> int:
+        '''Absolute index of the oldest retained sample'''
+        return self.total - len(self)
+
+    @property
+    def time(self) -> np.ndarray:
+        '''View of the retained relative times'''
+        return self._time[self._start:self._stop]
+
+    @property
+    def current(self) -> np.ndarray:
+        '''View of the retained current samples'''
+        return self._current[self._start:self._stop]
+
+    @property
+    def host_time(self) -> np.ndarray:
+        '''View of the retained host times of the requests (instrument_clock only)'''
+        return self._host_time[self._start:self._stop]
+
+    @property
+    def instrument_time(self) -> np.ndarray:
+        '''View of the retained raw instrument timestamps (instrument_clock only)'''
+        return self._instrument_time[self._start:self._stop]
+
+    def columns(self) -> list[np.ndarray]:
+        '''
+        Views of every stored column, in export order
+
+        Returns:
+            list: Relative time and current, plus host and instrument time with instrument_clock
+        '''
+        return [getattr(self, name)[self._start:self._stop] for name in self._arrays]
+
+    def _window(self, start: int, stop: int) -> tuple[int, int]:
+        '''Positions in the arrays of the samples between two absolute indices'''
+        offset = self._start - self.first_index
+        start = max(start, self.first_index) + offset
+        stop = min(max(stop, 0), self.total) + offset
+        return start, max(start, stop)
+
+    def read(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Return views of the samples between two absolute indices
+
+        Args:
+            start (int): Absolute index of the first sample (clipped to the retained window)
+            stop (int): Absolute index after the last sample
+
+        Returns:
+            time (np.ndarray): View of the relative times
+            current (np.ndarray): View of the current samples
+        '''
+        start, stop = self._window(start, stop)
+        return self._time[start:stop], self._current[start:stop]
+
+    def read_columns(self, start: int, stop: int) -> list[np.ndarray]:
+        '''
+        Return every column (as in columns()) of the samples between two absolute indices
+
+        Args:
+            start (int): Absolute index of the first sample (clipped to the retained window)
+            stop (int): Absolute index after the last sample
+
+        Returns:
+            list: Views of the columns
+        '''
+        start, stop = self._window(start, stop)
+        return [getattr(self, name)[start:stop] for name in self._arrays]
+
+    def search(self, time: float, side: str = 'left') -> int:
+        '''
+        Absolute index where a time would be inserted to keep the order (np.searchsorted)
+
+        Args:
+            time (float): Relative time (s)
+            side (str): 'left' or 'right', as in np.searchsorted
+
+        Returns:
+            int: Absolute index between first_index and total
+        '''
+        return self.first_index + int(np.searchsorted(self.time, time, side=side))
+
+    def first(self) -> tuple[float, float]:
+        '''Return the oldest retained (time, current) sample'''
+        return float(self._time[self._start]), float(self._current[self._start])
+
+    def last(self) -> tuple[float, float]:
+        '''Return the last (time, current) sample'''
+        return float(self._time[self._stop - 1]), float(self._current[self._stop - 1])
+
+    def current_range(self) -> tuple[float, float]:
+        '''Minimum and maximum of the retained currents, ignoring NaN gaps'''
+        return float(np.nanmin(self.current)), float(np.nanmax(self.current))
+
+    def append(self, time: float, current: float):
+        '''
+        Append one sample
+
+        Args:
+            time (float): Relative time (s)
+            current (float): Current (A)
+        '''
+        if self.instrument_clock:
+            self.extend((time,), (current,))   # sin marcas de tiempo del instrumento
+            return
+        if self.ring:
+            i = self.total % self.capacity
+            self._time[i] = self._time[i + self.capacity] = time
+            self._current[i] = self._current[i + self.capacity] = current
+            self.total += 1
+            self._update_ring_window()
+        else:
+            if self._stop == self.capacity:
+                self._grow(self._stop + 1)
+            self._time[self._stop] = time
+            self._current[self._stop] = current
+            self._stop += 1
+            self.total += 1
+
+    def extend(self, times, currents, host_times=None, instrument_times=None):
+        '''
+        Append a block of samples
+
+        Args:
+            times (array_like): Relative times (s)
+            currents (array_like): Currents (A)
+            host_times (array_like): Relative host times of the requests (s), instrument_clock only
+            instrument_times (array_like): Raw instrument timestamps (s), instrument_clock only
+        '''
+        times = np.asarray(times)
+        n = len(times)
+        if n == 0:
+            return
+        blocks = [times, np.asarray(currents)]
+        if self.instrument_clock:
+            blocks += [np.broadcast_to(np.nan if values is None else values, n)
+                       for values in (host_times, instrument_times)]
+        if self.ring:
+            if n > self.capacity:   # solo sobreviven las últimas `capacity` muestras
+                self.total += n - self.capacity
+                blocks, n = [block[-self.capacity:] for block in blocks], self.capacity
+            idx = (self.total + np.arange(n)) % self.capacity
+            for name, block in zip(self._arrays, blocks):
+                array = getattr(self, name)
+                array[idx] = array[idx + self.capacity] = block
+            self.total += n
+            self._update_ring_window()
+        else:
+            if self._stop + n > self.capacity:
+                self._grow(self._stop + n)
+            for name, block in zip(self._arrays, blocks):
+                getattr(self, name)[self._stop:self._stop + n] = block
+            self._stop += n
+            self.total += n
+
+    def clear(self):
+        '''Drop every sample keeping the allocated memory'''
+        self._start = self._stop = self.total = 0
+
+    def _update_ring_window(self):
+        retained = min(self.total, self.capacity)
+        self._start = (self.total - retained) % self.capacity
+        self._stop = self._start + retained
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for name in self._arrays:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._stop] = old[:self._stop]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+
+class TieredStore(SampleStore):
+    '''
+    Unbounded sample storage that keeps the recent samples in memory and spills the
+    older ones to memory-mapped files, for runs longer than the available RAM
+
+    The hot tier keeps the samples in the arrays of a growable SampleStore, which grow
+    up to 2 * `chunk_size` samples. When it is full, its oldest `chunk_size` samples are
+    written to a temporary file (one per chunk, deleted when the store is dropped)
+    that stays mapped, and the rest are moved to the front. read() returns views
+    when the range lies in one chunk or in the hot tier and a concatenated copy of
+    just that range otherwise, so plotting and export never load the whole run.
+    The `time`, `current` and columns() accessors do concatenate the whole run:
+    use read(), read_columns() and search() instead.
+
+    Samples already stored are never overwritten (a spill moves the rest of the hot
+    tier to new arrays), so another thread (the exporter) can read the first `total`
+    samples of a snapshot while the Tk thread keeps appending.
+
+    Args:
+        chunk_size (int): Samples per file (the hot tier holds up to twice as many)
+        directory (str): Directory of the files (system temporary directory by default)
+        current_dtype (np.dtype): Data type of the current samples (float64 or float32)
+        time_dtype (np.dtype): Data type of the relative times (float64 or float32)
+        instrument_clock (bool): Also store the host and instrument timestamps
+    '''
+
+    def __init__(self, chunk_size: int = 1 << 19, directory: str | None = None,
+                 current_dtype: np.dtype = np.float64, time_dtype: np.dtype = np.float64,
+                 instrument_clock: bool = False):
+        self.chunk_size = max(1, int(chunk_size))
+        self.directory = directory
+        super().__init__(min(4096, 2 * self.chunk_size), False, current_dtype, time_dtype, instrument_clock)
+        self._segments: list[list[np.ndarray]] = []   # columnas de cada fragmento en disco
+        self._segment_times: list[float] = []        # primer tiempo de cada fragmento
+        self._min = self._max = np.nan
+        self._lock = Lock()   # estado leído por read_columns desde otros hilos frente a _spill
+
+    @property
+    def spilled(self) -> int:
+        '''Samples stored on disk'''
+        return len(self._segments) * self.chunk_size
+
+    def __len__(self) -> int:
+        return self.total
+
+    @property
+    def time(self) -> np.ndarray:
+        '''Relative times of the whole run (a copy once samples were spilled)'''
+        return self.read_columns(0, self.total)[0]
+
+    @property
+    def current(self) -> np.ndarray:
+        '''Current samples of the whole run (a copy once samples were spilled)'''
+        return self.read_columns(0, self.total)[1]
+
+    @property
+    def host_time(self) -> np.ndarray:
+        '''Host times of the whole run (instrument_clock only)'''
+        return self.read_columns(0, self.total)[2]
+
+    @property
+    def instrument_time(self) -> np.ndarray:
+        '''Raw instrument timestamps of the whole run (instrument_clock only)'''
+        return self.read_columns(0, self.total)[3]
+
+    def columns(self) -> list[np.ndarray]:
+        return self.read_columns(0, self.total)
+
+    def read(self, start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        time, current, *_ = self.read_columns(start, stop)
+        return time, current
+
+    def read_columns(self, start: int, stop: int) -> list[np.ndarray]:
+        with self._lock:
+            start = max(start, 0)
+            stop = min(max(stop, start), self.total)
+            spilled = self.spilled
+            hot = [getattr(self, name) for name in self._arrays]
+        parts = []
+        while start < stop:
+            if start >= spilled:   # memoria
+                parts.append([array[start - spilled:stop - spilled] for array in hot])
+                break
+            segment, offset = divmod(start, self.chunk_size)
+            end = min(stop - segment * self.chunk_size, self.chunk_size)
+            parts.append([column[offset:end] for column in self._segments[segment]])
+            start = segment * self.chunk_size + end
+        if not parts:
+            return [array[:0] for array in hot]
+        if len(parts) == 1:
+            return parts[0]
+        return [np.concatenate(pieces) for pieces in zip(*parts)]
+
+    def search(self, time: float, side: str = 'left') -> int:
+        # Primero el fragmento (por su primer tiempo) y después dentro de él
+        firsts = self._segment_times + ([float(self._time[0])] if self._stop else [])
+        part = max(int(np.searchsorted(firsts, time, side=side)) - 1, 0)
+        if part < len(self._segments):
+            position = int(np.searchsorted(self._segments[part][0], time, side=side))
+            return part * self.chunk_size + position
+        return self.spilled + int(np.searchsorted(self._time[:self._stop], time, side=side))
+
+    def first(self) -> tuple[float, float]:
+        if self._segments:
+            return float(self._segments[0][0][0]), float(self._segments[0][1][0])
+        return super().first()
+
+    def last(self) -> tuple[float, float]:
+        if self._stop == 0 and self._segments:
+            return float(self._segments[-1][0][-1]), float(self._segments[-1][1][-1])
+        return super().last()
+
+    def current_range(self) -> tuple[float, float]:
+        return float(self._min), float(self._max)
+
+    def append(self, time: float, current: float):
+        self.extend((time,), (current,))
+
+    def extend(self, times, currents, host_times=None, instrument_times=None):
+        currents = np.asarray(currents)
+        super().extend(times, currents, host_times, instrument_times)
+        if len(currents):
+            # Extremos de toda la medida (fmin/fmax ignoran los huecos NaN)
+            self._min = np.fmin(self._min, np.fmin.reduce(currents))
+            self._max = np.fmax(self._max, np.fmax.reduce(currents))
+
+    def clear(self):
+        '''Drop every sample and the files of the spilled chunks'''
+        with self._lock:
+            super().clear()
+            self._segments = []
+            self._segment_times = []
+        self._min = self._max = np.nan
+
+    def _grow(self, needed: int):
+        # Por encima de 2 fragmentos, la memoria se vacía a disco por fragmentos completos
+        while needed > 2 * self.chunk_size and self._stop >= self.chunk_size:
+            self._spill()
+            needed -= self.chunk_size
+        if needed > self.capacity:
+            super()._grow(needed)
+
+    def _spill(self):
+        '''Write the oldest chunk of the hot tier to a mapped file'''
+        size = self.chunk_size
+        columns = []
+        # El fichero se borra al cerrarlo (o ya está desvinculado): la proyección mantiene los datos
+        with tempfile.TemporaryFile(dir=self.directory) as file:
+            nbytes = sum(getattr(self, name).dtype.itemsize for name in self._arrays) * size
+            file.truncate(nbytes)
+            mapped = np.memmap(file, dtype=np.uint8, mode='r+', shape=(nbytes,))   # una proyección (y un descriptor) por fichero
+        offset = 0
+        for name in self._arrays:
+            array = getattr(self, name)
+            column = mapped[offset:offset + array.dtype.itemsize * size].view(array.dtype)
+            column[:] = array[:size]
+            columns.append(column)
+            offset += array.dtype.itemsize * size
+        # El resto pasa a arrays nuevos: las vistas ya entregadas no cambian
+        remaining = []
+        for name in self._arrays:
+            array = getattr(self, name)
+            moved = np.empty_like(array)
+            moved[:self._stop - size] = array[size:self._stop]
+            remaining.append(moved)
+        with self._lock:
+            for name, moved in zip(self._arrays, remaining):
+                setattr(self, name, moved)
+            self._stop -= size
+            self._segments.append(columns)
+            self._segment_times.append(float(columns[0][0]))
@@ -0,0 +1,190 @@
+'''
+Measurement recipes: a JSON file with the steps of a protocol, compiled into blocks
+of batched SCPI commands that run without operator clicks between steps
+
+    {
+        "name": "NPLC sweep",
+        "mode": "Burst", "burst_size": 200,
+        "init": {"nplc": 1, "format": "SREAL", "commands": []},
+        "steps": [
+            {"nplc": 0.1, "dwell": 2},
+            {"acquire": 30, "label": "fast"},
+            {"nplc": 10, "acquire": 60, "mode": "Single", "label": "slow"}
+        ]
+    }
+
+Step keys:
+    label (str): Name of the step (events and status)
+    commands (list): SCPI commands without response
+    nplc (float): Integration rate, sent after the commands
+    dwell (float): Seconds to wait after the commands, not acquiring
+    acquire (float): Seconds of acquisition after the dwell
+    mode (str): 'Single' or 'Burst' for the acquisition (recipe "mode" by default)
+    burst_size (int): Readings per burst (recipe "burst_size" by default)
+'''
+import json, os
+
+from .serial_commands import initialize_instrument, send_batch, MAX_BURST_POINTS, DATA_FORMATS
+
+RECIPE_MODES = ('Single', 'Burst')
+STEP_KEYS = ('label', 'commands', 'nplc', 'dwell', 'acquire', 'mode', 'burst_size')
+
+
+def _number(value, name: str, where: str, positive: bool = False) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{where}: "{name}" must be a number') from None
+    if value < 0 or (positive and value == 0):
+        raise ValueError(f'{where}: "{name}" must be {"positive" if positive else "zero or positive"}')
+    return value
+
+def _commands(value, where: str) -> list[str]:
+    if not isinstance(value, list) or not all(isinstance(command, str) for command in value):
+        raise ValueError(f'{where}: "commands" must be a list of strings')
+    for command in value:
+        if '?' in command:   # la única respuesta de un bloque es la de *OPC?
+            raise ValueError(f'{where}: queries are not allowed ("{command}")')
+    return [command.strip() for command in value if command.strip()]
+
+def _mode(value, where: str) -> str | None:
+    if value is None:
+        return None
+    for mode in RECIPE_MODES:
+        if str(value).lower() == mode.lower():
+            return mode
+    raise ValueError(f'{where}: "mode" must be one of {", ".join(RECIPE_MODES)}')
+
+def _burst_size(value, where: str) -> int | None:
+    if value is None:
+        return None
+    if not 1 <= _number(value, 'burst_size', where) <= MAX_BURST_POINTS or int(value) != float(value):
+        raise ValueError(f'{where}: "burst_size" must be an integer between 1 and {MAX_BURST_POINTS}')
+    return int(value)
+
+def _new_block(label: str) -> dict:
+    return {'label': label, 'init': False, 'format': None, 'nplc': None, 'commands': [],
+            'dwell': 0.0, 'acquire': 0.0, 'mode': None, 'burst_size': None}
+
+def compile_recipe(recipe: dict) -> list[dict]:
+    '''
+    Compile a recipe into blocks: the commands of a block are sent in one batch
+    with a single *OPC?, then the block waits `dwell` seconds and acquires for
+    `acquire` seconds. Steps that neither wait nor acquire are merged into the next
+    block, so consecutive settings cost one round trip.
+
+    Args:
+        recipe (dict): Recipe (see the module documentation)
+
+    Returns:
+        list: Blocks with label, init, format, nplc, commands, dwell, acquire, mode and burst_size
+
+    Raises:
+        ValueError: Unknown key or invalid value (the message names the step)
+    '''
+    if not isinstance(recipe, dict) or not isinstance(recipe.get('steps', []), list):
+        raise ValueError('a recipe is an object with a list of "steps"')
+    mode = _mode(recipe.get('mode'), 'recipe')
+    burst_size = _burst_size(recipe.get('burst_size'), 'recipe')
+
+    blocks = []
+    block = _new_block('init')
+    init = recipe.get('init')
+    if init is not None:
+        if not isinstance(init, dict):
+            raise ValueError('init: must be an object with "nplc", "format" and "commands"')
+        block['init'] = True
+        block['nplc'] = _number(init.get('nplc', 1.0), 'nplc', 'init', positive=True)
+        block['format'] = str(init.get('format', 'ASCII')).upper()
+        if block['format'] not in DATA_FORMATS:
+            raise ValueError(f'init: "format" must be one of {", ".join(DATA_FORMATS)}')
+        block['commands'] = _commands(init.get('commands', []), 'init')
+
+    for i, step in enumerate(recipe.get('steps', []), start=1):
+        where = f'step {i}'
+        if not isinstance(step, dict):
+            raise ValueError(f'{where}: must be an object')
+        unknown = [key for key in step if key not in STEP_KEYS]
+        if unknown:
+            raise ValueError(f'{where}: unknown key "{unknown[0]}" (available: {", ".join(STEP_KEYS)})')
+        # Las órdenes de los pasos anteriores sin espera ni adquisición van en el mismo bloque
+        block['label'] = str(step.get('label', where))
+        block['commands'] += _commands(step.get('commands', []), where)
+        if 'nplc' in step:
+            block['nplc'] = _number(step['nplc'], 'nplc', where, positive=True)
+            if not block['init']:
+                block['commands'].append(f'NPLC {block["nplc"]:g}')
+        block['dwell'] = _number(step.get('dwell', 0), 'dwell', where)
+        block['acquire'] = _number(step.get('acquire', 0), 'acquire', where)
+        if block['acquire']:
+            block['mode'] = _mode(step.get('mode'), where) or mode
+            block['burst_size'] = _burst_size(step.get('burst_size'), where) or burst_size
+        if block['dwell'] or block['acquire']:
+            blocks.append(block)
+            block = _new_block('')
+    if block['init'] or block['commands']:
+        blocks.append(block)
+    return blocks
+
+def load_recipe(path: str) -> tuple[str, list[dict]]:
+    '''
+    Read and compile a recipe file
+
+    Args:
+        path (str): JSON file
+
+    Returns:
+        name (str): Name of the recipe (the file name if it has none)
+        blocks (list): Result of compile_recipe()
+
+    Raises:
+        ValueError: Invalid JSON or recipe
+    '''
+    with open(path, encoding='utf-8') as file:
+        recipe = json.load(file)
+    blocks = compile_recipe(recipe)
+    name = recipe.get('name') or os.path.splitext(os.path.basename(path))[0]
+    return str(name), blocks
+
+def send_block(serial_com: str, block: dict) -> dict:
+    '''
+    Send the commands of a block in one batch synchronized with a single *OPC?
+    (runs in the device worker). An init block also resets the instrument and sets
+    its transfer format (initialize_instrument)
+
+    Args:
+        serial_com (str): Serial port of the device
+        block (dict): Block of compile_recipe()
+
+    Returns:
+        dict: The block, for the callback
+    '''
+    if block['init']:
+        initialize_instrument(serial_com, block['nplc'], block['format'], block['commands'])
+    elif block['commands']:
+        send_batch(serial_com, block['commands'])
+    return block
+
+def describe_block(block: dict) -> str:
+    '''
+    One line summary of a block (status label and console)
+
+    Args:
+        block (dict): Block of compile_recipe()
+
+    Returns:
+        str: e.g. 'fast: 2 commands, dwell 2 s, acquire 30 s (Burst 200)'
+    '''
+    parts = []
+    if block['init']:
+        parts.append(f'initialize ({block["format"]}, NPLC {block["nplc"]:g})')
+    if block['commands']:
+        parts.append(f'{len(block["commands"])} command{"s" if len(block["commands"]) > 1 else ""}')
+    if block['dwell']:
+        parts.append(f'dwell {block["dwell"]:g} s')
+    if block['acquire']:
+        mode = block['mode'] or 'current mode'
+        if block['mode'] == 'Burst' and block['burst_size']:
+            mode += f' {block["burst_size"]}'
+        parts.append(f'acquire {block["acquire"]:g} s ({mode})')
+    return f'{block["label"]}: {", ".join(parts) or "no action"}'
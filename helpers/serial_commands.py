@@ -1,91 +1,394 @@
-from tkinter import *
-from tkinter import messagebox
-
+import numpy as np
+import numpy.lib.recfunctions as rfn
 import serial
 import serial.tools.list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+from threading import Lock, RLock
+import json, os, string, time
+
+from .instrumentation import monitor
+
+# Configuración del puerto serie (valores por defecto del Keithley 6485 en RS-232)
+SERIAL_SETTINGS = {
+    'baudrate': 9600,
+    'bytesize': serial.EIGHTBITS,
+    'parity': serial.PARITY_NONE,
+    'stopbits': serial.STOPBITS_ONE,
+    'timeout': 3.0,
+    'write_timeout': 3.0,
+}
+WRITE_TERMINATOR = '\r\n'
+READ_TERMINATOR = b'\n'
 
-from threading import Thread
+MAX_BURST_POINTS = 2500  # Tamaño del buffer de trazas del 6485
+MAX_BATCH_LENGTH = 200   # caracteres por mensaje de órdenes encadenadas con ';'
+# Órdenes de inicialización (reset, borrado de errores, pantalla apagada, sin zero check/correct)
+INIT_COMMANDS = ['*RST', '*CLS', 'DISPlay:ENABle 0', 'SYSTem:ZCHeck 0', 'SYSTem:ZCORrect 0']
 
+# Formatos de transferencia (FORM:DATA) y campo de cada elemento (FORM:ELEM)
+DATA_FORMATS = {
+    'ASCII': ('ASCii', np.float64),
+    'SREAL': ('SREal', np.dtype('<f4')),   # IEEE-754 simple, FORM:BORD SWAP (little endian)
+    'DREAL': ('DREal', np.dtype('<f8')),   # IEEE-754 doble
+}
+ELEMENT_FIELDS = {
+    'READ': 'reading',
+    'TIME': 'timestamp',
+    'STAT': 'status',
+}
+DEFAULT_ELEMENTS = ('READ', 'TIME', 'STAT')
 
+# Conexiones abiertas, una por puerto, compartidas por toda la aplicación
+_connections: dict[str, serial.Serial] = {}
+_port_locks: dict[str, RLock] = {}
+_registry_lock = Lock()
+# Formato de datos configurado en cada instrumento
+_formats: dict[str, tuple[str, tuple[str, ...]]] = {}
+# Puertos virtuales (p. ej. el simulador sobre un pty) que comports() no lista
+_virtual_ports: dict[str, str] = {}
+VIRTUAL_PORTS_ENV = 'KEITHLEY_VIRTUAL_PORTS'
+# Fichero de traza del tráfico serie (start_trace)
+_trace_file = None
+_trace_lock = Lock()
+
+
+def register_virtual_port(device: str, description: str = 'Virtual serial port') -> None:
+    '''
+    Make a port that the operating system does not enumerate (e.g. a pty) appear in list_ports
 
-def scan_ports(device):
+    Args:
+        device (str): Path of the port
+        description (str): Description shown in the device combobox
+    '''
+    _virtual_ports[device] = description
+
+def unregister_virtual_port(device: str) -> None:
+    '''
+    Remove a port registered with register_virtual_port
+
+    Args:
+        device (str): Path of the port
+    '''
+    _virtual_ports.pop(device, None)
+
+def list_ports() -> list[ListPortInfo]:
+    '''
+    List the serial ports of the system plus the virtual ones, registered in this process
+    or listed in the KEITHLEY_VIRTUAL_PORTS environment variable (separated by os.pathsep)
+
+    Returns:
+        list: ListPortInfo of every port
+    '''
+    ports = list(serial.tools.list_ports.comports())
+    virtual = dict(_virtual_ports)
+    for device in filter(None, os.environ.get(VIRTUAL_PORTS_ENV, '').split(os.pathsep)):
+        virtual.setdefault(device, 'Virtual serial port')
+    for device, description in virtual.items():
+        if os.path.exists(device) and all(port.device != device for port in ports):
+            port = ListPortInfo(device, skip_link_detection=True)
+            port.description = description
+            ports.append(port)
+    return ports
+
+def scan_ports(device, ports: list[ListPortInfo] | None = None):
     '''
     Scan the available ports and update the combobox with the available ports
 
     Args:
         device (dict): Dictionary containing the device information and combobox widget
+        ports (list): Ports already enumerated (e.g. by the port discovery); None to scan now
     '''
 
+    from tkinter import messagebox  # Tk solo se importa desde la GUI (helpers.acquire no lo necesita)
+
     # Define the list of available ports and combobox
-    device['com_ports'] = serial.tools.list_ports.comports()
+    device['com_ports'] = list_ports() if ports is None else ports
     ports_list = [str(port) for port in device['com_ports']]
-    device['combobox']['values'] = ports_list
+    device['combobox'].configure(values=ports_list)
 
     # selection of the port
-    if ports_list:
+    if device['combobox'].get() in ports_list:
+        pass  # el puerto mostrado sigue conectado
+    elif ports_list:
         device['combobox'].set('Select a port')  # Select the first port by default
     elif device['com_ports'] == []:
         device['combobox'].set('No ports available')
     else:
         messagebox.showerror('Error', 'Unexpected error occurred while scanning ports.')
 
+def initialize_instrument(serial_com: str, integration_rate: float, transfer_format: str = 'ASCII',
+                          commands: list[str] | None = None) -> float:
+    '''
+    Send the reset, clear and configuration commands as one batch, synchronized with
+    a single *OPC? (runs in the device worker)
+
+    Args:
+        serial_com (str): Serial port of the device
+        integration_rate (float): Integration rate (NPLC)
+        transfer_format (str): Transfer format ('ASCII', 'SREAL' or 'DREAL')
+        commands (list): Further configuration commands sent in the same batch
+
+    Returns:
+        float: Integration rate set in the device
+    '''
+    transfer_format = transfer_format.upper()
+    with port_lock(serial_com):
+        send_batch(serial_com, [*INIT_COMMANDS, f'NPLC {integration_rate}',
+                                *format_commands(transfer_format), *(commands or [])])
+        _formats[serial_com] = (transfer_format, DEFAULT_ELEMENTS)
+
+    return integration_rate
+
 def initialize_device(app: 'KeithleyApp') -> bool:
     '''
-    Initialize the device by sending the reset and clear commands
+    Initialize the selected devices by sending the reset and clear commands through
+    their device workers (every instrument is initialized in parallel)
 
     Args:
         app (KeithleyApp): KeithleyApp object containing the device information
 
     Returns:
-        bool: True if the device is initialized successfully, False otherwise
+        bool: True if the initialization was queued, False if a device is not valid
     '''
 
-    thread_available: bool = app.data['thread_available']
-    device = str(app.device['selected_device'])
-    integration_rate = app.int_rate.get()
+    from tkinter import messagebox
 
-    devices = [device.device for device in serial.tools.list_ports.comports()]
+    selected = list(app.data['series'])
+    integration_rate = app.int_rate.get()
 
-    if device not in devices and device != '':
-        messagebox.showerror('Error', f'Device {device} not found.')
-        return False
-    elif device == '':
+    if not selected:
         messagebox.showerror('Error', 'No device selected.')
         return False
-    else:
+    # Lista de puertos en caché del servicio de descubrimiento (sin volver a enumerarlos)
+    missing = [device for device in selected if device not in app.discovery]
+    if missing:
+        messagebox.showerror('Error', f'Device {", ".join(missing)} not found.')
+        return False
+
+    def initialized(nplc: float):
+        app.data['nplc'] = nplc
+
+    for device in selected:
+        def failed(error: Exception, device=device):
+            messagebox.showerror('Error', f'Error initializing device {device}: {error}')
+
+        app.workers[device].submit(initialize_instrument, device, integration_rate, app.data_format.get(),
+                                   callback=initialized, error_callback=failed)
+
+    return True
+
+def get_connection(serial_com: str) -> serial.Serial:
+    '''
+    Return the long-lived connection to the device, opening and configuring it on first use
+
+    Args:
+        serial_com (str): Serial port of the device
+
+    Returns:
+        serial.Serial: Open serial port shared by acquisition, initialization and configuration
+    '''
+    with _registry_lock:
+        ser = _connections.get(serial_com)
+        if ser is None or not ser.is_open:
+            ser = serial.Serial(serial_com, **SERIAL_SETTINGS)
+            ser.reset_input_buffer()  # Descartar datos pendientes de una sesión anterior
+            _connections[serial_com] = ser
+    return ser
+
+def port_lock(serial_com: str) -> RLock:
+    '''
+    Return the lock that serializes the transactions on a port
+
+    Args:
+        serial_com (str): Serial port of the device
+
+    Returns:
+        RLock: Lock shared by every thread talking to the port
+    '''
+    with _registry_lock:
+        return _port_locks.setdefault(serial_com, RLock())
+
+def close_connection(serial_com: str) -> None:
+    '''
+    Close the connection to the device if it is open
+
+    Args:
+        serial_com (str): Serial port of the device
+    '''
+    with _registry_lock:
+        ser = _connections.pop(serial_com, None)
+    if ser is not None and ser.is_open:
+        ser.close()
+
+def close_all_connections() -> None:
+    '''
+    Close every open connection, used when the application is closed
+    '''
+    for serial_com in list(_connections):
+        close_connection(serial_com)
+
+def start_trace(path: str) -> None:
+    '''
+    Record every command written and response read on the shared connections to a
+    JSON lines file, to be replayed later by helpers.simulator
+
+    Args:
+        path (str): Trace file (appended)
+    '''
+    global _trace_file
+    stop_trace()
+    with _trace_lock:
+        _trace_file = open(path, 'a', encoding='utf-8')
+
+def stop_trace() -> None:
+    '''
+    Close the trace file, if any
+    '''
+    global _trace_file
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+
+def _trace(ser: serial.Serial, direction: str, data: bytes) -> None:
+    if _trace_file is None:
+        return
+    event = {'time': time.perf_counter(), 'port': ser.port, 'direction': direction,
+             'data': data.decode('latin-1')}   # latin-1: bytes sin pérdida y legibles en ASCII
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.write(json.dumps(event) + '\n')
+
+def _read_block(ser: serial.Serial, size: int, command: str) -> bytes:
+    '''
+    Read an IEEE 488.2 binary block (definite "#<n><length>" or indefinite "#0" header)
+
+    Args:
+        ser (serial.Serial): Open serial port
+        size (int): Expected payload size in bytes (used for "#0" blocks)
+        command (str): Command answered by the block (error messages)
+
+    Returns:
+        bytes: Block payload without header and terminator
+
+    Raises:
+        serial.SerialTimeoutException: The header or the payload arrived incomplete
+        serial.SerialException: The response is not a binary block
+    '''
+    header = ser.read(2)
+    if len(header) < 2:
+        raise serial.SerialTimeoutException(f'Timeout waiting for the binary block of {command}')
+    if header[:1] != b'#' or not header[1:2].isdigit():
+        raise serial.SerialException(f'Unexpected binary block header {header!r} in the response to {command}')
+    digits = int(header[1:2])
+    if digits:
+        length = ser.read(digits)
+        if len(length) < digits:
+            raise serial.SerialTimeoutException(f'Timeout waiting for the binary block length of {command}')
+        if not length.isdigit():
+            raise serial.SerialException(f'Unexpected binary block length {length!r} in the response to {command}')
+        size = int(length)
+    payload = ser.read(size)
+    if len(payload) < size:
+        raise serial.SerialTimeoutException(f'Timeout waiting for the binary block of {command}')
+    ser.read_until(READ_TERMINATOR)  # terminador tras el bloque
+    return payload
+
+def _transaction(ser: serial.Serial, command: str, expect_response: bool,
+                 block_size: int | None = None) -> bytes:
+    '''
+    Write a command to an open port and optionally read one terminated response line
+    or a binary block
+
+    Args:
+        ser (serial.Serial): Open serial port
+        command (str): Command to be sent to the device
+        expect_response (bool): Whether a response must be read back
+        block_size (int): Expected size of a binary block response (None for a text line)
+
+    Returns:
+        bytes: Raw response (empty if no response was expected)
+    '''
+    message = str.encode(f'{command}{WRITE_TERMINATOR}')
+    ser.write(message)
+    ser.flush()  # Flush the output buffer to ensure the command is sent immediately
+    _trace(ser, 'write', message)
+    if not expect_response:
+        return b''
+    if block_size is not None:
+        payload = _read_block(ser, block_size, command)
+        _trace(ser, 'read', b'#0' + payload + READ_TERMINATOR)
+        return payload
+    response = ser.read_until(READ_TERMINATOR)
+    if not response.endswith(READ_TERMINATOR):
+        raise serial.SerialTimeoutException(f'Timeout waiting for the response to {command}')
+    _trace(ser, 'read', response)
+    return response
+
+def _port_transaction(serial_com: str, command: str, expect_response: bool,
+                      timeout: float | None = None, block_size: int | None = None) -> bytes:
+    '''
+    Run a transaction on the shared connection of a port, holding its lock
+
+    Args:
+        serial_com (str): Serial port of the device
+        command (str): Command to be sent to the device
+        expect_response (bool): Whether a response must be read back
+        timeout (float): Read timeout for this command in seconds (None keeps the port setting)
+        block_size (int): Expected size of a binary block response (None for a text line)
+
+    Returns:
+        bytes: Raw response (empty if no response was expected)
+    '''
+    with port_lock(serial_com):
+        ser = get_connection(serial_com)
+        default_timeout = ser.timeout
         try:
-            send(device,'*RST', thread_available)
-            send(device,'*CLS', thread_available)
-            send(device,'DISPlay:ENABle 0', thread_available)
-            send(device,'SYSTem:ZCHeck 0', thread_available)
-            send(device,'SYSTem:ZCORrect 0', thread_available)
-            send(device,'*OPC', thread_available)
-            send(device, f'NPLC {integration_rate}', thread_available)
+            if timeout is not None:
+                ser.timeout = timeout
+            with monitor.time('serial'):
+                return _transaction(ser, command, expect_response, block_size)
+        except serial.SerialException:
+            close_connection(serial_com)  # Se reabre en la siguiente orden
+            raise
+        finally:
+            if timeout is not None and ser.is_open:
+                ser.timeout = default_timeout
 
-        except serial.SerialException as e:
-            messagebox.showerror('Error', f'Error initializing device: {e}')
-            return False
+def query_raw(serial_com: str, command: str, timeout: float | None = None) -> str:
+    '''
+    Send a command to the device and return the whole response line
 
-        return True
+    Args:
+        serial_com (str): Serial port of the device
+        command (str): Command to be sent to the device
+        timeout (float): Read timeout for this command in seconds (None keeps the port setting)
 
-def query(serial_com, command, thread_available: bool) -> str:
+    Returns:
+        str: Decoded response without the line terminator
     '''
-    Send a command to the device and return the response
+    raw = _port_transaction(serial_com, command, True, timeout)
+
+    return raw.decode('utf-8').rstrip('\r\n')
+
+def query(serial_com: str, command: str) -> str:
+    '''
+    Send a command to the device and return the first element of the response
     
     Args:
         serial_com (str): Serial port of the device
         command (str): Command to be sent to the device
     Returns:
-        str: Response from the device
+        str: First comma separated element, without the unit suffix of a reading
+            (e.g. '+1.234E-09' for '+1.234E-09A,+1.2E+02,+0.0E+00')
     '''
-    with serial.Serial(serial_com) as ser:
-        ser.write(str.encode(f'{command}\r\n'))
-        ser.flush()  # Flush the output buffer to ensure the command is sent immediately
-        response = ser.readline().decode('utf-8').strip("b'rn\\").split(',')
+    first = query_raw(serial_com, command).split(',')[0].strip()
+    value = first.rstrip(string.ascii_letters)   # sufijo de unidades, como en parse_ascii_values
 
-    return response[0][:-1]
+    return value if value[-1:].isdigit() else first
 
-def send(serial_com: str, command: str, thread_available: bool) -> None:
+def send(serial_com: str, command: str) -> None:
     '''
     Send a command to the device without expecting a response
     
@@ -93,7 +396,250 @@ def send(serial_com: str, command: str, thread_available: bool) -> None:
         serial_com (str): Serial port of the device
         command (str): Command to be sent to the device
     '''
-    with serial.Serial(serial_com) as ser:
-        ser.write(str.encode(f'{command}\r\n'))
-        print(f'Command sended: {command}')
-        ser.flush()  # Flush the output buffer to ensure the command is sent immediately
+    _port_transaction(serial_com, command, False)
+
+def batch_messages(commands: list[str], max_length: int = MAX_BATCH_LENGTH) -> list[str]:
+    '''
+    Join commands into ';' separated program messages, the last one ending with a
+    single *OPC? that answers when every command has been executed
+
+    Every command except the common ones (*RST, *CLS, ...) is sent from the root of the
+    SCPI tree (leading ':'); after a ';' the instrument would otherwise look for it
+    under the node of the previous command.
+
+    Args:
+        commands (list): SCPI commands without response
+        max_length (int): Maximum characters of a message (input buffer of the instrument)
+
+    Returns:
+        list: Messages, at least one (with only *OPC? if there are no commands)
+    '''
+    messages, current = [], []
+    for command in [*commands, '*OPC?']:
+        command = command.strip()
+        if not command:
+            continue
+        if not command.startswith(('*', ':')):
+            command = ':' + command
+        if current and len(';'.join(current + [command])) > max_length:
+            messages.append(';'.join(current))
+            current = []
+        current.append(command)
+    messages.append(';'.join(current))
+    return messages
+
+def send_batch(serial_com: str, commands: list[str], timeout: float | None = None) -> None:
+    '''
+    Send a block of commands in as few writes as possible (batch_messages) and wait
+    for their completion with a single *OPC?
+
+    Args:
+        serial_com (str): Serial port of the device
+        commands (list): SCPI commands without response
+        timeout (float): Read timeout of the *OPC? response in seconds (None keeps the port setting)
+
+    Raises:
+        serial.SerialException: Unexpected response to *OPC?
+    '''
+    messages = batch_messages(commands)
+    with port_lock(serial_com):
+        for message in messages[:-1]:
+            _port_transaction(serial_com, message, False)
+        response = query_raw(serial_com, messages[-1], timeout)
+    if response.strip() != '1':
+        raise serial.SerialException(f'Unexpected response to *OPC?: {response!r}')
+
+def reading_dtype(data_format: str = 'ASCII', elements: tuple[str, ...] = DEFAULT_ELEMENTS) -> np.dtype:
+    '''
+    Structured dtype of one reading for a transfer format and element list
+
+    Args:
+        data_format (str): 'ASCII', 'SREAL' or 'DREAL'
+        elements (tuple): FORM:ELEM elements ('READ', 'TIME', 'STAT')
+
+    Returns:
+        np.dtype: One field per element ('reading', 'timestamp', 'status')
+    '''
+    field_type = DATA_FORMATS[data_format][1]
+    return np.dtype([(ELEMENT_FIELDS[element], field_type) for element in elements])
+
+def format_commands(data_format: str = 'ASCII', elements: tuple[str, ...] = DEFAULT_ELEMENTS) -> list[str]:
+    '''
+    Commands that configure the transfer format and the elements of every reading
+
+    Args:
+        data_format (str): 'ASCII', 'SREAL' or 'DREAL'
+        elements (tuple): FORM:ELEM elements ('READ', 'TIME', 'STAT')
+
+    Returns:
+        list: SCPI commands
+    '''
+    return [f'FORMat:DATA {DATA_FORMATS[data_format.upper()][0]}',
+            'FORMat:BORDer SWAPped',
+            f'FORMat:ELEMents {",".join(elements)}']
+
+def set_data_format(serial_com: str, data_format: str = 'ASCII',
+                    elements: tuple[str, ...] = DEFAULT_ELEMENTS) -> None:
+    '''
+    Configure the transfer format and the elements of every reading
+
+    Args:
+        serial_com (str): Serial port of the device
+        data_format (str): 'ASCII', 'SREAL' (4 bytes per element) or 'DREAL' (8 bytes per element)
+        elements (tuple): FORM:ELEM elements ('READ', 'TIME', 'STAT')
+    '''
+    data_format = data_format.upper()
+    with port_lock(serial_com):
+        send_batch(serial_com, format_commands(data_format, elements))
+        _formats[serial_com] = (data_format, tuple(elements))
+
+def data_format(serial_com: str) -> tuple[str, tuple[str, ...]]:
+    '''
+    Return the transfer format configured in the device
+
+    Args:
+        serial_com (str): Serial port of the device
+
+    Returns:
+        data_format (str): 'ASCII', 'SREAL' or 'DREAL'
+        elements (tuple): FORM:ELEM elements
+    '''
+    return _formats.get(serial_com, ('ASCII', DEFAULT_ELEMENTS))
+
+def parse_ascii_values(response: str, elements: tuple[str, ...] = DEFAULT_ELEMENTS) -> np.ndarray:
+    '''
+    Parse a comma separated response with one or more readings in a single vectorized conversion
+
+    Args:
+        response (str): Response (e.g. '+1.234E-09A,+1.2E+02,+0.0E+00' per reading)
+        elements (tuple): FORM:ELEM elements of every reading
+
+    Returns:
+        np.ndarray: Structured array with one field per element
+    '''
+    tokens = [token.rstrip(string.ascii_letters) for token in response.strip().split(',')]  # sin sufijo de unidades
+    values = np.array(tokens, dtype=np.float64)
+    if len(values) % len(elements):
+        raise ValueError(f'Response with {len(values)} values does not match the elements {elements}')
+    return rfn.unstructured_to_structured(values.reshape(-1, len(elements)),
+                                          reading_dtype('ASCII', elements))
+
+def query_values(serial_com: str, command: str, count: int = 1,
+                 timeout: float | None = None) -> np.ndarray:
+    '''
+    Send a query that returns readings and parse them according to the configured format
+
+    Args:
+        serial_com (str): Serial port of the device
+        command (str): Query (e.g. 'READ?' or 'TRAC:DATA?')
+        count (int): Expected number of readings (sizes "#0" binary blocks)
+        timeout (float): Read timeout for this command in seconds (None keeps the port setting)
+
+    Returns:
+        np.ndarray: Structured array with fields 'reading', 'timestamp' and/or 'status'
+    '''
+    fmt, elements = data_format(serial_com)
+    if fmt == 'ASCII':
+        response = query_raw(serial_com, command, timeout)
+        with monitor.time('parse'):
+            return parse_ascii_values(response, elements)
+
+    dtype = reading_dtype(fmt, elements)
+    payload = _port_transaction(serial_com, command, True, timeout, count * dtype.itemsize)
+    with monitor.time('parse'):
+        return np.frombuffer(payload, dtype=dtype)
+
+def configure_burst(serial_com: str, points: int) -> None:
+    '''
+    Configure the trigger count and the trace buffer to store `points` readings per burst
+
+    Args:
+        serial_com (str): Serial port of the device
+        points (int): Number of readings per burst
+    '''
+    points = max(1, min(int(points), MAX_BURST_POINTS))
+    send_batch(serial_com, ['TRACe:CLEar', f'TRACe:POINts {points}', 'TRACe:FEED SENSe', f'TRIGger:COUNt {points}'])
+
+def configure_single(serial_com: str) -> None:
+    '''
+    Restore the single reading configuration (one reading per READ?) after a burst acquisition
+
+    Args:
+        serial_com (str): Serial port of the device
+    '''
+    send_batch(serial_com, ['TRACe:FEED:CONTrol NEVer', 'TRIGger:COUNt 1'])
+
+def read_burst(serial_com: str, points: int, nplc: float = 1.0,
+               line_frequency: float = 50.0) -> tuple[float, float, np.ndarray]:
+    '''
+    Take a burst of readings into the trace buffer and transfer them in one response
+
+    Args:
+        serial_com (str): Serial port of the device (configured with configure_burst)
+        points (int): Number of readings per burst
+        nplc (float): Integration rate, used to size the wait timeout
+        line_frequency (float): Power line frequency in Hz
+
+    Returns:
+        start (float): Host time.perf_counter() when the burst was triggered
+        end (float): Host time.perf_counter() when the burst was completed
+        values (np.ndarray): Structured array of the burst (fields as in query_values)
+    '''
+    points = max(1, min(int(points), MAX_BURST_POINTS))  # el mismo límite que configure_burst
+    # Tiempo máximo de espera: integración + conversión de cada lectura, con margen
+    burst_timeout = SERIAL_SETTINGS['timeout'] + 2 * points * (nplc / line_frequency + 0.005)
+    transfer_timeout = SERIAL_SETTINGS['timeout'] + 40 * points * 10 / SERIAL_SETTINGS['baudrate']
+
+    with port_lock(serial_com):
+        # Rearme en una sola escritura y sin mensajes por consola (se repite en cada ráfaga)
+        start = time.perf_counter()
+        _port_transaction(serial_com, 'TRACe:CLEar;:TRACe:FEED:CONTrol NEXT;:INITiate', False)
+        query_raw(serial_com, '*OPC?', timeout=burst_timeout)  # Espera al final de la ráfaga
+        end = time.perf_counter()
+        response = query_values(serial_com, 'TRACe:DATA?', points, timeout=transfer_timeout)
+
+    return start, end, response
+
+def measure_query_rate(serial_com: str, samples: int = 200, persistent: bool = True,
+                       command: str = 'READ?') -> float:
+    '''
+    Measure the achieved query rate against a device
+
+    Args:
+        serial_com (str): Serial port of the device
+        samples (int): Number of queries to time
+        persistent (bool): Use the shared connection (True) or open the port for
+            every query as the previous implementation did (False)
+        command (str): Query command to repeat
+
+    Returns:
+        float: Achieved samples per second
+    '''
+    if persistent:
+        query(serial_com, command)  # La apertura del puerto no cuenta en la medida
+        start = time.perf_counter()
+        for _ in range(samples):
+            query(serial_com, command)
+    else:
+        close_connection(serial_com)
+        start = time.perf_counter()
+        for _ in range(samples):
+            with serial.Serial(serial_com, **SERIAL_SETTINGS) as ser:
+                _transaction(ser, command, True)
+    return samples / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare per-query port opening against the persistent connection')
+    parser.add_argument('port', help='Serial port of the device')
+    parser.add_argument('--samples', type=int, default=200, help='Number of READ? queries per run')
+    args = parser.parse_args()
+
+    before = measure_query_rate(args.port, args.samples, persistent=False)
+    after = measure_query_rate(args.port, args.samples, persistent=True)
+    close_all_connections()
+    print(f'Open per query:      {before:8.2f} samples/s')
+    print(f'Persistent port:     {after:8.2f} samples/s')
+    print(f'Speed-up:            {after / before:8.2f}x')
@@ -0,0 +1,375 @@
+'''
+Simulated Keithley 6485 on a pseudo-terminal, to run the application, the headless
+acquisition and the benchmarks without a physical instrument (POSIX only)
+
+    python -m helpers.simulator                 # serve until Ctrl+C
+    python -m helpers.simulator --check         # end-to-end check of the serial layer
+
+The instrument answers the SCPI subset used by the application and takes
+NPLC / line frequency (plus a conversion overhead) per reading. A trace recorded
+with `helpers.acquire --trace` can be replayed: recorded queries are answered with
+the recorded responses, in order, and anything else is simulated.
+'''
+import argparse, json, os, select, sys, time
+from collections import deque
+from threading import Thread, Event
+
+import numpy as np
+
+from .serial_commands import register_virtual_port, unregister_virtual_port, VIRTUAL_PORTS_ENV
+
+MODEL_DESCRIPTION = 'Simulated Keithley 6485'
+IDENTIFICATION = 'KEITHLEY INSTRUMENTS INC.,MODEL 6485,0000000,SIMULATED'
+
+
+def _matches(header: str, pattern: str) -> bool:
+    '''
+    Check a SCPI header against a pattern in short/long form notation ('TRACe:FEED:CONTrol'
+    accepts 'TRAC:FEED:CONT', 'TRACE:FEED:CONTROL', ...)
+
+    Args:
+        header (str): Header of the received command, in upper case
+        pattern (str): Header with the short form in upper case
+
+    Returns:
+        bool: True if every node is either the short or the long form
+    '''
+    nodes = header.lstrip(':').split(':')
+    patterns = pattern.split(':')
+    if len(nodes) != len(patterns):
+        return False
+    for node, node_pattern in zip(nodes, patterns):
+        short = ''.join(c for c in node_pattern if not c.islower())
+        if node not in (short, node_pattern.upper()):
+            return False
+    return True
+
+def load_trace(path: str) -> dict[str, deque]:
+    '''
+    Load a trace recorded with serial_commands.start_trace as the responses of every query
+
+    Responses are keyed by the whole written message (e.g. '*RST;*CLS;...;*OPC?' of
+    send_batch), as SimulatedKeithley.handle looks them up
+
+    Args:
+        path (str): Trace file (JSON lines)
+
+    Returns:
+        dict: Recorded responses (bytes) of every query, in order, by message in upper case
+    '''
+    responses: dict[str, deque] = {}
+    last_write: dict[str, str] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            event = json.loads(line)
+            data = event['data']
+            if event['direction'] == 'write':
+                last_write[event['port']] = data.strip().upper()
+            elif event['port'] in last_write:
+                command = last_write.pop(event['port'])
+                responses.setdefault(command, deque()).append(data.encode('latin-1'))
+    return responses
+
+
+class SimulatedKeithley:
+    '''
+    Keithley 6485 emulated on the slave side of a pty
+
+    Args:
+        current (float): Mean current of the readings (A)
+        noise (float): Standard deviation of the readings at 1 NPLC (A), scaled by 1/sqrt(NPLC)
+        line_frequency (float): Power line frequency (Hz)
+        overhead (float): Conversion time added to every reading (s)
+        latency (bool): Wait the integration time of the readings before answering
+        baudrate (int): Emulate the transfer time of the responses at this rate (None = no wait)
+        replay (str): Trace file whose responses are replayed
+        seed (int): Seed of the noise generator
+    '''
+
+    def __init__(self, current: float = 1e-9, noise: float = 1e-12, line_frequency: float = 50.0,
+                 overhead: float = 0.001, latency: bool = True, baudrate: int | None = None,
+                 replay: str | None = None, seed: int | None = None):
+        self.current = current
+        self.noise = noise
+        self.line_frequency = line_frequency
+        self.overhead = overhead
+        self.latency = latency
+        self.baudrate = baudrate
+        self.replay = load_trace(replay) if replay else {}
+        self.rng = np.random.default_rng(seed)
+        self.port = None
+        self.commands = 0        # órdenes recibidas
+        self.readings = 0        # lecturas generadas
+        self._master = None
+        self._slave = None
+        self._stop = Event()
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        '''State after *RST'''
+        self.nplc = 1.0
+        self.display = True
+        self.zero_check = True
+        self.zero_correct = False
+        self.data_format = 'ASC'
+        self.byte_order = 'NORM'
+        self.elements = ['READ', 'TIME', 'STAT']
+        self.trigger_count = 1
+        self.trace_points = 100
+        self.feed_control = 'NEV'
+        self.buffer: list[np.ndarray] = []
+        self.errors: deque = deque()
+        self.reset_time = time.perf_counter()
+
+    def start(self) -> str:
+        '''
+        Open the pty, start answering and register the port for list_ports
+
+        Returns:
+            str: Path of the port to open with pyserial
+        '''
+        import pty, tty  # solo existen en POSIX
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        register_virtual_port(self.port, MODEL_DESCRIPTION)
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='simulated-keithley', daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        '''Stop answering and close the pty'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        if self.port is not None:
+            unregister_virtual_port(self.port)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def __enter__(self) -> 'SimulatedKeithley':
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        pending = b''
+        while not self._stop.is_set():
+            try:
+                if not select.select([self._master], [], [], 0.1)[0]:
+                    continue
+                data = os.read(self._master, 4096)
+            except (OSError, ValueError, TypeError):   # pty cerrado por stop()
+                return
+            if not data:
+                return
+            pending += data
+            while b'\n' in pending:
+                line, pending = pending.split(b'\n', 1)
+                line = line.strip().decode('ascii', 'replace')
+                if line:
+                    self.handle(line)
+
+    def _write(self, response: bytes):
+        if self.baudrate:
+            time.sleep(len(response) * 10 / self.baudrate)
+        os.write(self._master, response)
+
+    def handle(self, line: str):
+        '''
+        Execute a message with one or more commands separated by ';'
+
+        Args:
+            line (str): Message without terminator
+        '''
+        # La traza guarda el mensaje completo (con todas sus órdenes) y su única respuesta
+        recorded = self.replay.get(line.strip().upper())
+        for command in line.split(';'):
+            command = command.strip()
+            if not command:
+                continue
+            self.commands += 1
+            if recorded and '?' in command:
+                continue   # la respuesta es la grabada; el resto de órdenes cambia el estado
+            response = self.execute(command)
+            if response is not None:
+                self._write(response)
+        if recorded:
+            recorded.rotate(-1)   # respuestas grabadas en orden y de forma cíclica
+            self._write(recorded[-1])
+
+    def execute(self, command: str) -> bytes | None:
+        '''
+        Execute one command
+
+        Args:
+            command (str): SCPI command with its parameters
+
+        Returns:
+            bytes: Response with terminator (None for commands without response)
+        '''
+        header, _, argument = command.partition(' ')
+        header, argument = header.upper(), argument.strip().upper()
+
+        if header == '*RST':
+            self.reset()
+        elif header == '*CLS':
+            self.errors.clear()
+        elif header == '*OPC':
+            pass
+        elif header == '*OPC?':
+            return b'1\r\n'
+        elif header == '*IDN?':
+            return f'{IDENTIFICATION}\r\n'.encode()
+        elif _matches(header, 'SYSTem:ERRor?'):
+            error = self.errors.popleft() if self.errors else '0,"No error"'
+            return f'{error}\r\n'.encode()
+        elif _matches(header, 'DISPlay:ENABle'):
+            self.display = argument in ('1', 'ON')
+        elif _matches(header, 'SYSTem:ZCHeck'):
+            self.zero_check = argument in ('1', 'ON')
+        elif _matches(header, 'SYSTem:ZCORrect'):
+            self.zero_correct = argument in ('1', 'ON')
+        elif header.split(':')[-1] in ('NPLC', 'NPLCYCLES'):
+            self.nplc = min(max(float(argument), 0.01), 60.0)
+        elif _matches(header, 'FORMat:DATA') or _matches(header, 'FORMat'):
+            self.data_format = argument[:3]
+        elif _matches(header, 'FORMat:BORDer'):
+            self.byte_order = argument[:4]
+        elif _matches(header, 'FORMat:ELEMents'):
+            self.elements = [element.strip()[:4] for element in argument.split(',')]
+        elif _matches(header, 'TRIGger:COUNt'):
+            self.trigger_count = max(1, int(argument))
+        elif _matches(header, 'TRACe:CLEar'):
+            self.buffer = []
+        elif _matches(header, 'TRACe:POINts'):
+            self.trace_points = max(1, int(argument))
+        elif _matches(header, 'TRACe:FEED'):
+            pass
+        elif _matches(header, 'TRACe:FEED:CONTrol'):
+            self.feed_control = 'NEXT' if argument.startswith('NEXT') else 'NEV'
+        elif _matches(header, 'INITiate'):
+            readings = self.take_readings(self.trigger_count)
+            if self.feed_control == 'NEXT':
+                free = self.trace_points - sum(len(block) for block in self.buffer)
+                self.buffer.append(readings[:max(free, 0)])
+                if free <= len(readings):
+                    self.feed_control = 'NEV'   # buffer lleno
+        elif _matches(header, 'TRACe:DATA?'):
+            return self.format_readings(np.concatenate(self.buffer) if self.buffer else self.take_readings(0))
+        elif _matches(header, 'READ?'):
+            return self.format_readings(self.take_readings(self.trigger_count))
+        else:
+            self.errors.append('-113,"Undefined header"')
+        return None
+
+    def take_readings(self, count: int) -> np.ndarray:
+        '''
+        Generate readings, waiting their integration time if latency is enabled
+
+        Args:
+            count (int): Number of readings
+
+        Returns:
+            np.ndarray: (count, 3) array of reading, timestamp and status
+        '''
+        period = self.nplc / self.line_frequency + self.overhead
+        if self.latency and count:
+            time.sleep(count * period)
+        mean = 0.0 if self.zero_check else self.current
+        values = np.empty((count, 3))
+        values[:, 0] = mean + self.noise / np.sqrt(self.nplc) * self.rng.standard_normal(count)
+        values[:, 1] = time.perf_counter() - self.reset_time - period * np.arange(count)[::-1]
+        values[:, 2] = 0.0
+        self.readings += count
+        return values
+
+    def format_readings(self, values: np.ndarray) -> bytes:
+        '''
+        Encode readings with the configured format and elements
+
+        Args:
+            values (np.ndarray): (n, 3) array of reading, timestamp and status
+
+        Returns:
+            bytes: ASCII line or "#0" binary block, with terminator
+        '''
+        columns = [{'READ': 0, 'TIME': 1, 'STAT': 2}[element] for element in self.elements]
+        values = values[:, columns]
+        if self.data_format == 'ASC':
+            suffixes = ['A' if element == 'READ' else '' for element in self.elements]
+            fields = [f'{value:+.6E}{suffixes[i % len(suffixes)]}' for i, value in enumerate(values.ravel())]
+            return (','.join(fields) + '\r\n').encode()
+        endian = '<' if self.byte_order == 'SWAP' else '>'
+        dtype = f'{endian}f4' if self.data_format == 'SRE' else f'{endian}f8'
+        return b'#0' + values.astype(dtype).tobytes() + b'\n'
+
+
+def self_check(instrument: SimulatedKeithley) -> bool:
+    '''
+    Run the serial layer of the application end-to-end against the simulator: port
+    listing, initialization, single readings and bursts in every transfer format
+
+    Args:
+        instrument (SimulatedKeithley): Started simulator
+
+    Returns:
+        bool: True if every step passed
+    '''
+    from .serial_commands import (list_ports, initialize_instrument, query_values, configure_burst,
+                                  configure_single, read_burst, close_all_connections, DATA_FORMATS)
+
+    port = instrument.port
+    checks = []
+    checks.append(('port listed', any(info.device == port for info in list_ports())))
+    for data_format in DATA_FORMATS:
+        initialize_instrument(port, 0.01, data_format)
+        readings = query_values(port, 'READ?')
+        checks.append((f'{data_format} READ?', len(readings) == 1 and np.isfinite(readings['reading'][0])))
+        configure_burst(port, 20)
+        start, end, burst = read_burst(port, 20, 0.01)
+        configure_single(port)
+        checks.append((f'{data_format} burst', len(burst) == 20 and end >= start))
+    close_all_connections()
+
+    for name, passed in checks:
+        print(f'{name:<16} {"ok" if passed else "FAILED"}')
+    return all(passed for _, passed in checks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m helpers.simulator', description=MODEL_DESCRIPTION)
+    parser.add_argument('--current', type=float, default=1e-9, help='Mean current (A)')
+    parser.add_argument('--noise', type=float, default=1e-12, help='Noise at 1 NPLC (A)')
+    parser.add_argument('--line-frequency', type=float, default=50.0, help='Power line frequency (Hz)')
+    parser.add_argument('--no-latency', action='store_true', help='Answer without the integration time')
+    parser.add_argument('--baudrate', type=int, default=None, help='Emulate the transfer time at this rate')
+    parser.add_argument('--replay', metavar='FILE', help='Replay the responses of a recorded trace')
+    parser.add_argument('--check', action='store_true', help='Run the end-to-end check and exit')
+    args = parser.parse_args()
+
+    instrument = SimulatedKeithley(args.current, args.noise, args.line_frequency, latency=not args.no_latency,
+                                   baudrate=args.baudrate, replay=args.replay)
+    with instrument:
+        if args.check:
+            passed = self_check(instrument)
+        else:
+            print(f'{MODEL_DESCRIPTION} on {instrument.port}')
+            print(f'Run the application with {VIRTUAL_PORTS_ENV}={instrument.port} to list it')
+            try:
+                while True:
+                    time.sleep(1.0)
+            except KeyboardInterrupt:
+                pass
+            passed = True
+    sys.exit(0 if passed else 1)
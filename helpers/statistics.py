@@ -0,0 +1,285 @@
+from collections import deque
+
+import numpy as np
+
+
+class Moments:
+    '''
+    Count, means, sums of squared deviations and co-moment of (time, current) samples
+
+    Blocks are combined with the parallel form of Welford's algorithm (Chan et al.),
+    which stays accurate for currents of ~1e-9 A with ~1e-12 A of noise, and can
+    also be removed again, which keeps a rolling window O(1) per sample.
+    '''
+
+    __slots__ = ('count', 'mean_t', 'mean_y', 'm2_t', 'm2_y', 'c_ty')
+
+    def __init__(self):
+        self.count = 0
+        self.mean_t = self.mean_y = 0.0
+        self.m2_t = self.m2_y = self.c_ty = 0.0
+
+    @classmethod
+    def of(cls, times: np.ndarray, values: np.ndarray) -> 'Moments':
+        '''
+        Moments of a block of samples (vectorized)
+
+        Args:
+            times (np.ndarray): Times (s)
+            values (np.ndarray): Currents (A), finite
+
+        Returns:
+            Moments: Moments of the block
+        '''
+        moments = cls()
+        moments.count = len(values)
+        if moments.count:
+            moments.mean_t = float(times.mean())
+            moments.mean_y = float(values.mean())
+            dt = times - moments.mean_t
+            dy = values - moments.mean_y
+            moments.m2_t = float(np.dot(dt, dt))
+            moments.m2_y = float(np.dot(dy, dy))
+            moments.c_ty = float(np.dot(dt, dy))
+        return moments
+
+    def merge(self, other: 'Moments'):
+        '''Add the samples of another block'''
+        count = self.count + other.count
+        if other.count == 0:
+            return
+        if self.count == 0:
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            return
+        weight = self.count * other.count / count
+        d_t = other.mean_t - self.mean_t
+        d_y = other.mean_y - self.mean_y
+        self.mean_t += d_t * other.count / count
+        self.mean_y += d_y * other.count / count
+        self.m2_t += other.m2_t + d_t * d_t * weight
+        self.m2_y += other.m2_y + d_y * d_y * weight
+        self.c_ty += other.c_ty + d_t * d_y * weight
+        self.count = count
+
+    def remove(self, other: 'Moments'):
+        '''Remove the samples of a block previously merged (inverse of merge)'''
+        count = self.count - other.count
+        if count <= 0:
+            self.__init__()
+            return
+        mean_t = (self.count * self.mean_t - other.count * other.mean_t) / count
+        mean_y = (self.count * self.mean_y - other.count * other.mean_y) / count
+        weight = count * other.count / self.count
+        d_t = other.mean_t - mean_t
+        d_y = other.mean_y - mean_y
+        self.m2_t = max(self.m2_t - other.m2_t - d_t * d_t * weight, 0.0)
+        self.m2_y = max(self.m2_y - other.m2_y - d_y * d_y * weight, 0.0)
+        self.c_ty -= other.c_ty + d_t * d_y * weight
+        self.mean_t, self.mean_y, self.count = mean_t, mean_y, count
+
+    @property
+    def std(self) -> float:
+        '''Sample standard deviation of the current (A)'''
+        return (self.m2_y / (self.count - 1)) ** 0.5 if self.count > 1 else float('nan')
+
+    @property
+    def drift(self) -> float:
+        '''Slope of the least squares line current = a + drift * time (A/s)'''
+        return self.c_ty / self.m2_t if self.m2_t > 0 else float('nan')
+
+
+def _finite(times, values) -> tuple[np.ndarray, np.ndarray]:
+    '''Samples of a block as float64 arrays without the NaN gaps'''
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    if not finite.all():
+        times, values = times[finite], values[finite]
+    return times, values
+
+
+class RunningStats:
+    '''
+    Mean, standard deviation, minimum, maximum and linear drift of the whole run
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''Forget every sample'''
+        self.moments = Moments()
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def update(self, times, values):
+        '''
+        Add a block of samples
+
+        Args:
+            times (array_like): Times (s)
+            values (array_like): Currents (A); NaN values are skipped
+        '''
+        times, values = _finite(times, values)
+        if len(values):
+            self.moments.merge(Moments.of(times, values))
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+
+    def summary(self) -> dict:
+        '''
+        Current statistics
+
+        Returns:
+            dict: count, mean, std, min, max (A) and drift (A/s)
+        '''
+        moments = self.moments
+        empty = moments.count == 0
+        return {'count': moments.count,
+                'mean': float('nan') if empty else moments.mean_y,
+                'std': moments.std,
+                'min': float('nan') if empty else self.min,
+                'max': float('nan') if empty else self.max,
+                'drift': moments.drift}
+
+
+class RollingStats(RunningStats):
+    '''
+    Same statistics over the last `samples` samples and/or `seconds` seconds
+
+    Blocks are kept in a deque with their moments: a new block is merged and the
+    samples that leave the window are removed (the oldest block is split when only
+    part of it leaves). Minimum and maximum come from monotonic deques of the block
+    extremes, so every sample is added and removed once. Once as many samples have
+    been removed as the window holds, the window moments are summed again from the
+    block moments, so rounding errors of the removals do not build up in long runs.
+
+    Args:
+        samples (int): Window length in samples (0 = no limit)
+        seconds (float): Window length in seconds (0 = no limit)
+    '''
+
+    def __init__(self, samples: int = 0, seconds: float = 0.0):
+        self.samples = samples
+        self.seconds = seconds
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self._blocks: deque = deque()    # [times, values, moments, min, max] del más antiguo al más nuevo
+        self._mins: deque = deque()      # bloques con mínimos crecientes
+        self._maxs: deque = deque()      # bloques con máximos decrecientes
+        self._removed = 0                # muestras quitadas desde la última suma completa
+
+    def update(self, times, values):
+        times, values = _finite(times, values)
+        if len(values) == 0:
+            return
+        block = [times, values, Moments.of(times, values), float(values.min()), float(values.max())]
+        self._blocks.append(block)
+        self.moments.merge(block[2])
+        while self._mins and self._mins[-1][3] >= block[3]:
+            self._mins.pop()
+        self._mins.append(block)
+        while self._maxs and self._maxs[-1][4] <= block[4]:
+            self._maxs.pop()
+        self._maxs.append(block)
+        self._evict(times[-1])
+
+    def _evict(self, last_time: float):
+        '''Remove the samples older than the window'''
+        while self._blocks:
+            oldest = self._blocks[0]
+            times, values = oldest[0], oldest[1]
+            drop = 0
+            if self.samples > 0:
+                drop = max(drop, self.moments.count - self.samples)
+            if self.seconds > 0:
+                drop = max(drop, int(np.searchsorted(times, last_time - self.seconds, side='left')))
+            if drop <= 0:
+                break
+            self._removed += min(drop, len(values))
+            self.moments.remove(oldest[2])
+            if drop >= len(values):
+                self._blocks.popleft()
+                if self._mins[0] is oldest:
+                    self._mins.popleft()
+                if self._maxs[0] is oldest:
+                    self._maxs.popleft()
+                continue
+            # Solo sale parte del bloque más antiguo: se conserva el resto
+            oldest[0], oldest[1] = times[drop:], values[drop:]
+            oldest[2] = Moments.of(oldest[0], oldest[1])
+            oldest[3], oldest[4] = float(oldest[1].min()), float(oldest[1].max())
+            self.moments.merge(oldest[2])
+            self._trim_front(self._mins, 3, lambda a, b: a <= b)
+            self._trim_front(self._maxs, 4, lambda a, b: a >= b)
+            break
+
+        if self._removed > self.moments.count:
+            self.moments = Moments()
+            for block in self._blocks:
+                self.moments.merge(block[2])
+            self._removed = 0
+
+    @staticmethod
+    def _trim_front(extremes: deque, index: int, keeps):
+        '''Drop the oldest block of a monotonic deque if its new extreme is beaten by a newer block'''
+        if len(extremes) > 1 and not keeps(extremes[0][index], extremes[1][index]):
+            extremes.popleft()
+
+    @property
+    def label(self) -> str:
+        '''Name of the window (e.g. last 60 s or last 1000 samples)'''
+        if self.samples:
+            return f'last {self.samples} samples'
+        if self.seconds:
+            return f'last {self.seconds:g} s'
+        return 'whole run'
+
+    def summary(self) -> dict:
+        self.min = self._mins[0][3] if self._mins else float('inf')
+        self.max = self._maxs[0][4] if self._maxs else float('-inf')
+        return super().summary()
+
+
+def format_stats(summary: dict, unit: str = 'A') -> str:
+    '''
+    One line with the statistics of a summary
+
+    Args:
+        summary (dict): Result of RunningStats.summary()
+        unit (str): Unit of the values
+
+    Returns:
+        str: Formatted statistics
+    '''
+    if summary['count'] == 0:
+        return 'no samples'
+    return (f'n={summary["count"]} mean={summary["mean"]:.4e} {unit} std={summary["std"]:.3e} {unit} '
+            f'min={summary["min"]:.4e} {unit} max={summary["max"]:.4e} {unit} '
+            f'drift={summary["drift"]:.3e} {unit}/s')
+
+def format_series_statistics(series_dict: dict, ports: list[str] | None = None) -> list[str]:
+    '''
+    Lines with the run and rolling window statistics of every series (label and export header)
+
+    Args:
+        series_dict (dict): Series by port, each with a 'stats' dict ('run' and 'window')
+        ports (list): Ports to include (all the series by default)
+
+    Returns:
+        list: Two lines per series with samples
+    '''
+    if ports is None:
+        ports = list(series_dict)
+    lines = []
+    for port in ports:
+        stats = series_dict[port].get('stats') if port in series_dict else None
+        if stats is None or stats['run'].moments.count == 0:
+            continue
+        prefix = f'[{port}] ' if len(series_dict) > 1 else ''
+        lines.append(f'{prefix}run: {format_stats(stats["run"].summary())}')
+        lines.append(f'{prefix}{stats["window"].label}: {format_stats(stats["window"].summary())}')
+    return lines
@@ -0,0 +1,348 @@
+from threading import Thread, Event
+import gzip, json, os, re, traceback
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from .export_commands import DATA_COLUMNS
+
+LOAD_CHUNK = 1 << 24   # bytes de texto leídos y convertidos de una vez
+CACHE_VERSION = 1      # cambia si cambia el formato de la caché
+# Ficheros que se pueden abrir: los de exporter.FORMATS y los registros sin finalizar (.part)
+OPEN_FILETYPES = [('Exported data', '*.dat *.csv.gz *.npy *.npz *.part'), ('All files', '*.*')]
+
+
+def cache_paths(path: str) -> tuple[str, str]:
+    '''
+    Paths of the binary cache of a text file: float64 matrix and metadata
+
+    Args:
+        path (str): Path of the .dat or .csv.gz file
+
+    Returns:
+        tuple: `<path>.cache.npy` and `<path>.cache.json`
+    '''
+    return path + '.cache.npy', path + '.cache.json'
+
+def _add_comment(metadata: dict, line: str):
+    '''Store a line of the comment block, recognizing the fields written by format_metadata'''
+    metadata['comments'].append(line)
+    if line.startswith('Sample name:'):
+        metadata['sample_name'] = line[len('Sample name:'):].strip()
+    elif line.startswith('Sample information:'):
+        metadata['sample_info'] = line[len('Sample information:'):].strip()
+    elif line.startswith('Device information:'):
+        devices = line[len('Device information:'):].strip()
+        metadata['devices'] = devices.split('; ') if devices else []
+    elif line.startswith('Event '):
+        metadata['events'].append(line[len('Event '):])
+    elif line.startswith('t='):   # cambios escritos por StreamRecorder.comment durante la medida
+        metadata['events'].append(line)
+
+def _numeric(line: str) -> bool:
+    fields = line.replace(',', ' ').split()
+    try:
+        return bool([float(field) for field in fields])
+    except ValueError:
+        return False
+
+def parse_header(file, delimiter: str = '\t') -> tuple[dict, list[str], bytes]:
+    '''
+    Read the comment block and the column header of an exported text file
+
+    The comment block (sample name, sample information, device information,
+    filters, statistics and events) ends with a blank line and is followed by the
+    header; '#' lines (.csv.gz comment block, events of a record file) are also
+    comments. A file whose first line is already numeric has no header.
+
+    Args:
+        file: Binary file positioned at the start
+        delimiter (str): Column separator of the header ('\t' or ',')
+
+    Returns:
+        metadata (dict): sample_name, sample_info, devices, events and every comment line
+        columns (list): Column names (empty if the file has no header)
+        pending (bytes): First data line, if it was read looking for the header
+    '''
+    metadata = {'sample_name': '', 'sample_info': '', 'devices': [], 'events': [], 'comments': []}
+    after_blank = False
+    while True:
+        raw = file.readline()
+        if not raw:
+            return metadata, [], b''
+        line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+        if line.startswith('#'):
+            _add_comment(metadata, line.lstrip('#').strip())
+        elif not line.strip():
+            after_blank = True
+        elif _numeric(line):
+            return metadata, [], raw
+        elif after_blank or (delimiter in line and ': ' not in line):
+            return metadata, [name.strip() for name in line.split(delimiter)], b''
+        else:
+            _add_comment(metadata, line)
+
+def default_columns(count: int) -> list[str]:
+    '''Column names of a file without header: time and current, then numbered columns'''
+    names = DATA_COLUMNS[:count]
+    return names + [f'Column {i + 1}' for i in range(len(names), count)]
+
+def parse_rows(text: bytes, columns: int, metadata: dict | None = None) -> np.ndarray:
+    '''
+    Convert complete lines of numbers to a matrix
+
+    Args:
+        text (bytes): Lines separated by '\n', columns separated by tabs, spaces or commas
+        columns (int): Values per line
+        metadata (dict): Receives the '#' lines found between the rows (e.g. events)
+
+    Returns:
+        np.ndarray: Matrix of shape (rows, columns), float64
+
+    Raises:
+        ValueError: Text that is not a number, or lines with another number of values
+    '''
+    if b'#' in text:
+        lines = text.split(b'\n')
+        if metadata is not None:
+            for line in lines:
+                if line.startswith(b'#'):
+                    _add_comment(metadata, line.decode('utf-8', errors='replace').lstrip('#').strip())
+        text = b'\n'.join(line for line in lines if not line.startswith(b'#'))
+    if b',' in text:
+        text = text.replace(b',', b' ')
+    # Un solo recorrido en C de todo el bloque (sep=' ' acepta cualquier espacio en blanco)
+    values = np.fromstring(text, sep=' ')
+    if len(values) % columns:
+        raise ValueError(f'the rows do not have {columns} values')
+    return values.reshape(-1, columns)
+
+def run_series(columns: list[str]) -> list[tuple[str, int, int]]:
+    '''
+    (time, current) column pairs of a loaded run, one per instrument
+
+    Columns are matched by name ('Relative time (s) [port]' with 'Current (A) [port]');
+    a file with other names uses its first two columns.
+
+    Args:
+        columns (list): Column names
+
+    Returns:
+        list: (port or '', time column index, current column index)
+    '''
+    pairs = []
+    for i, name in enumerate(columns):
+        match = re.fullmatch(re.escape(DATA_COLUMNS[0]) + r'(?: \[(.*)\])?', name)
+        if match is None:
+            continue
+        port = match.group(1) or ''
+        current = DATA_COLUMNS[1] + (f' [{port}]' if port else '')
+        if current in columns:
+            pairs.append((port, i, columns.index(current)))
+    if not pairs and len(columns) >= 2:
+        pairs.append(('', 0, 1))
+    return pairs
+
+
+class RunLoader:
+    '''
+    Background loading of a previously exported file for the offline viewer
+
+    Text files (.dat, .csv.gz and unfinished .part records) are read in blocks of
+    `chunk_size` bytes, cut at the last complete line and converted with a single
+    np.fromstring per block. The matrix is written while it is parsed to a binary
+    cache next to the file (`<path>.cache.npy` and `.cache.json`, which records the
+    size and modification time of the source), so reopening an unchanged file only
+    maps the cache. Binary exports (.npy with its .json, .npz) are read directly.
+    If the cache cannot be written (e.g. a read-only directory) the data stays in
+    memory. The Tk thread polls `progress`, `done` and `error`; `result` holds the run.
+
+    Args:
+        path (str): Path of the file
+        cache (bool): Use and write the binary cache of text files
+        chunk_size (int): Bytes of text converted at once
+        name (str): Thread name
+    '''
+
+    def __init__(self, path: str, cache: bool = True, chunk_size: int = LOAD_CHUNK, name: str = 'loader'):
+        self.path = path
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.size = 0                 # bytes del fichero
+        self.read = 0                 # bytes leídos (progreso)
+        self.result: dict | None = None  # path, name, columns, metadata, data y source
+        self.warnings: list[str] = []
+        self.error: Exception | None = None
+        self.done = Event()           # terminada (completa, cancelada o con error)
+        self._cancel = Event()
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+
+    @property
+    def progress(self) -> float:
+        '''Fraction of the file read (0 to 1)'''
+        return min(self.read / self.size, 1.0) if self.size else 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def start(self):
+        '''Start the loading thread'''
+        self._thread.start()
+
+    def cancel(self):
+        '''Stop the loading after the current block (the partial cache is removed)'''
+        self._cancel.set()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        try:
+            self.size = os.path.getsize(self.path)
+            lower = self.path.lower()
+            if lower.endswith('.npz'):
+                data, columns, metadata, source = self._load_npz()
+            elif lower.endswith('.npy'):
+                data, columns, metadata, source = self._load_npy()
+            else:
+                data, columns, metadata, source = self._load_text()
+            if not self._cancel.is_set():
+                self.read = self.size
+                self.result = {'path': self.path, 'name': os.path.basename(self.path), 'columns': columns,
+                               'metadata': metadata, 'data': data, 'source': source}
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+        finally:
+            self.done.set()
+
+    def _load_npy(self):
+        data = np.load(self.path, mmap_mode='r')
+        metadata_path = os.path.splitext(self.path)[0] + '.json'
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as file:
+                metadata = json.load(file)
+        columns = metadata.get('columns') or default_columns(data.shape[1])
+        return data, columns, metadata, 'npy'
+
+    def _load_npz(self):
+        with np.load(self.path) as archive:
+            data = archive['data']
+            columns = [str(name) for name in archive['columns']]
+            metadata = json.loads(str(archive['metadata'])) if 'metadata' in archive.files else {}
+        return data, columns, metadata, 'npz'
+
+    def _load_text(self):
+        stat = os.stat(self.path)
+        if self.cache:
+            cached = self._read_cache(stat)
+            if cached is not None:
+                return cached
+        delimiter = ',' if '.csv' in self.path.lower() else '\t'
+        with open(self.path, 'rb') as raw:
+            file = gzip.GzipFile(fileobj=raw) if self.path.lower().endswith('.gz') else raw
+            metadata, columns, pending = parse_header(file, delimiter)
+            sink = self._open_cache() if self.cache else None
+            try:
+                blocks, rows = self._parse(raw, file, pending, columns, metadata, sink)
+            except BaseException:
+                if sink is not None:
+                    sink.close()
+                    os.remove(sink.name)
+                raise
+        if not columns:
+            columns = default_columns(blocks[0].shape[1] if blocks else 2)
+        if self._cancel.is_set():
+            if sink is not None:
+                sink.close()
+                os.remove(sink.name)
+            return None, columns, metadata, 'text'
+        if sink is None:
+            data = np.concatenate(blocks) if blocks else np.empty((0, len(columns)))
+            return data, columns, metadata, 'text'
+        return self._finish_cache(sink, stat, rows, columns, metadata), columns, metadata, 'text'
+
+    def _parse(self, raw, file, pending: bytes, columns: list[str], metadata: dict, sink):
+        '''Convert the rows block by block, into the cache file if there is one'''
+        blocks = []
+        rows = 0
+        while not self._cancel.is_set():
+            chunk = file.read(self.chunk_size)
+            self.read = raw.tell()
+            text = pending + chunk
+            if chunk:
+                cut = text.rfind(b'\n') + 1
+                text, pending = text[:cut], text[cut:]
+            if text.strip():
+                if not columns:
+                    columns.extend(default_columns(len(text.split(b'\n', 1)[0].replace(b',', b' ').split())))
+                block = self._parse_block(text, len(columns), metadata, last=not chunk)
+                if sink is not None:
+                    if rows == 0:
+                        self._write_cache_header(sink, 0, len(columns))
+                    sink.write(block.tobytes())
+                else:
+                    blocks.append(block)
+                rows += len(block)
+            if not chunk:
+                break
+        if sink is not None and rows == 0:
+            self._write_cache_header(sink, 0, len(columns))
+        return blocks, rows
+
+    def _parse_block(self, text: bytes, columns: int, metadata: dict, last: bool) -> np.ndarray:
+        try:
+            return parse_rows(text, columns, metadata)
+        except ValueError:
+            if not last:
+                raise
+        # Última línea cortada (registro interrumpido): se descarta
+        complete = text.rstrip().rfind(b'\n') + 1
+        self.warnings.append(f'{os.path.basename(self.path)}: incomplete last line skipped')
+        return parse_rows(text[:complete], columns, metadata)
+
+    def _read_cache(self, stat: os.stat_result):
+        '''Map the cache if it was written from this version of the file'''
+        data_path, info_path = cache_paths(self.path)
+        try:
+            with open(info_path) as file:
+                info = json.load(file)
+            if (info.get('version') != CACHE_VERSION or info.get('source_size') != stat.st_size
+                    or info.get('source_mtime_ns') != stat.st_mtime_ns):
+                return None
+            data = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return data, info['columns'], info['metadata'], 'cache'
+
+    def _open_cache(self):
+        try:
+            return open(cache_paths(self.path)[0] + '.part', 'wb')
+        except OSError as e:
+            self.warnings.append(f'{os.path.basename(self.path)}: cache not written ({e})')
+            return None
+
+    @staticmethod
+    def _write_cache_header(sink, rows: int, columns: int):
+        # La cabecera .npy deja sitio para que crezca el número de filas: se reescribe al final
+        npy_format.write_array_header_1_0(sink, {'descr': npy_format.dtype_to_descr(np.dtype(np.float64)),
+                                                 'fortran_order': False, 'shape': (rows, columns)})
+
+    def _finish_cache(self, sink, stat: os.stat_result, rows: int, columns: list[str], metadata: dict) -> np.ndarray:
+        '''Write the final shape and the metadata of the cache and map it'''
+        data_path, info_path = cache_paths(self.path)
+        with sink:
+            data_start = sink.tell() - rows * len(columns) * 8
+            sink.seek(0)
+            self._write_cache_header(sink, rows, len(columns))
+            if sink.tell() != data_start:
+                raise RuntimeError('the cache header changed size')
+        os.replace(sink.name, data_path)
+        info = {'version': CACHE_VERSION, 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns,
+                'columns': columns, 'metadata': metadata}
+        with open(info_path + '.part', 'w') as file:
+            json.dump(info, file, indent=2)
+        os.replace(info_path + '.part', info_path)
+        return np.load(data_path, mmap_mode='r')
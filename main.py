@@ -1,12 +1,18 @@
+import time
+STARTUP_TIME = time.perf_counter()  # referencia del tiempo hasta la primera ventana
+
 from tkinter import *
+from tkinter import messagebox
 from customtkinter import *
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import os, serial, datetime, time
+import os, serial, datetime
 
 # importado de commandos personalizados
 from helpers.serial_commands import *
 from helpers.plot_commands import *
 from helpers.gui_commands import *
+from helpers.pipeline import DeviceWorker
+from helpers.discovery import PortDiscovery
+from helpers.exporter import FORMATS
 
 
 class KeithleyApp:
@@ -24,23 +30,22 @@ class KeithleyApp:
             'com_device': '',
             'selected_device': '',
             'available_device': None,
+            'ports_listed': False,    # primera enumeración aplicada al combobox
         }
 
-        self.device['com_ports'] = serial.tools.list_ports.comports()
-        self.ports_list = [f'{port}' for port in self.device['com_ports']]
-
         self.data = {
             'export_directory': None,
             'export_name': None,
             'sample_name': list(),
             'sample_info': list(),
-            'first_time': datetime.datetime.today().timestamp,  # primer tiempo en segundos
-            'time_data': list(),
-            'current_data': list(),
+            'first_time': None,        # origen (time.perf_counter) común a todos los instrumentos
+            'wall_offset': None,       # time.time() - time.perf_counter(), para mostrar la hora
+            'series': dict(),          # por puerto: muestras, envolvente min/max, línea y registro
             'running': False,
             'last_data': None,
             'last_time': None,
-            'thread_available': True,
+            'nplc': 1.0,
+            'filter_spec': '',         # etapas de filtrado de la última adquisición
         }
 
         self.text = {
@@ -58,10 +63,46 @@ class KeithleyApp:
         self.int_rate = DoubleVar()
         self.int_rate.set(1.0)
 
-        self.fig, self.line, self.ax = initialize_plot(self)
+        self.acq_mode = StringVar(value='Single')   # 'Single' (READ? por muestra) o 'Burst' (buffer de trazas)
+        self.burst_size = IntVar(value=100)
+        self.auto_nplc = StringVar(value='Off')     # 'Off', 'Rate' (lecturas/s) o 'Noise' (A): NPLC ajustado al objetivo
+        self.auto_target = DoubleVar(value=100.0)   # objetivo del NPLC automático
+        self.timestamp_mode = StringVar(value='Host')  # 'Host' (punto medio de la petición) o 'Instrument' (FORM:ELEM TIME)
+        self.filter_spec = StringVar(value='')      # p. ej. 'outlier:5, median:5, boxcar:10' (vacío = sin filtrar)
+        self.max_fps = IntVar(value=MAX_FPS)        # dibujados por segundo como máximo (0 = sin límite)
+        self.stats_window = DoubleVar(value=60.0)   # longitud de la ventana móvil de estadísticas
+        self.stats_window_unit = StringVar(value='Seconds')  # 'Seconds' o 'Samples'
+        self.history_limit = IntVar(value=0)        # 0 = historial ilimitado, N = solo las últimas N muestras
+        self.data_format = StringVar(value='ASCII') # formato de transferencia (FORM:DATA), se aplica al inicializar
+        self.record_to_file = BooleanVar(value=False)
+        self.fsync_interval = DoubleVar(value=5.0)  # segundos entre fsync del fichero de registro
+        self.export_format = StringVar(value='.dat')   # formato de "Export data" (FORMATS de helpers.exporter)
+        self.export_status = StringVar(value='')
+        self.exporter = None                           # exportación en segundo plano en curso
+        self.open_status = StringVar(value='')
+        self.loaders = list()                          # ficheros abriéndose en segundo plano (RunLoader)
+        self.recipe = None                             # estado de la receta en curso (run_recipe)
+        self.recipe_status = StringVar(value='')
+        self.multi_device = BooleanVar(value=False) # añadir instrumentos a la selección en lugar de reemplazarla
+        self.export_performance = BooleanVar(value=False)  # escribir <export>.perf.json al exportar
+
+        self.plot = {
+            'background': None,     # fondo cacheado para el blitting de la línea
+            'toolbar': None,        # barra de navegación de matplotlib
+            'last_drain': None,     # instante del último vaciado de muestras (retraso de Tk)
+            'dirty': set(),         # partes pendientes de dibujar (RENDER_FLAGS)
+            'last_frame': 0.0,      # instante del último dibujado (límite de FPS)
+            'theme': None,          # modo de apariencia aplicado al gráfico
+            'overlays': list(),     # medidas abiertas de fichero: muestras, envolvente min/max y línea
+        }
 
+        # La figura (y la importación de matplotlib) se crea cuando la ventana ya es visible
+        self.fig, self.line, self.ax = None, None, None
 
-        update_plot_colors(self)
+        # Un hilo por instrumento, propietario de su puerto serie: órdenes y adquisición sin bloquear la GUI
+        self.workers: dict[str, DeviceWorker] = dict()
+        # Enumeración de puertos en segundo plano (caché y conexión/desconexión en caliente)
+        self.discovery = PortDiscovery()
 
         self.setup_ui()
 
@@ -70,11 +111,25 @@ class KeithleyApp:
         self.root.protocol('WM_DELETE_WINDOW', lambda: closing_app(self))
         
         def closing_app(self):
-            """Cierra la aplicación."""
-            while not self.data['thread_available']:
-                print('Waiting for thread to be available...')
-                time.sleep(0.1)
-            close_app(self)
+            """Cierra la aplicación cuando los hilos de los dispositivos han terminado."""
+            stop_recipe(self)
+            stop_plot(self)
+            self.discovery.stop()
+            cancel_export(self)
+            cancel_open(self)
+            for worker in self.workers.values():
+                worker.shutdown()
+            deadline = time.monotonic() + 5.0
+
+            def wait_for_worker():
+                busy = any(worker.is_alive() for worker in self.workers.values())
+                busy = busy or (self.exporter is not None and self.exporter.is_alive())
+                if busy and time.monotonic() < deadline:
+                    self.root.after(50, wait_for_worker)
+                else:
+                    close_app(self)
+
+            wait_for_worker()
 
         self.root.grid_columnconfigure(3, weight=1)
         self.root.grid_rowconfigure(0, weight=1)
@@ -116,63 +171,28 @@ class KeithleyApp:
             command=lambda option: select_device(self, option),
             width=400*0.63,
         )
-        self.device['combobox'].configure(values=self.ports_list)
+        self.device['combobox'].set('Scanning ports...')   # se rellena en segundo plano
         self.device['combobox'].grid(column=0, row=1, columnspan=1, pady=5, padx=5, sticky='e')
         self.device_selection_lbl.grid(column=0, row=3, columnspan=2, pady=5, padx=5)
 
         dev_scan_btn = CTkButton(devices_selection_frame,
                                  text='Update',
-                                 command=lambda: scan_ports(self.device),
+                                 command=lambda: self.discovery.rescan(),
                                  width=10)
         dev_scan_btn.grid(column=1, row=1, pady=5, padx=5, sticky='w')
 
+        CTkCheckBox(devices_selection_frame,
+                    text='Multiple instruments (add to selection)',
+                    variable=self.multi_device,
+        ).grid(column=0, row=2, columnspan=2, pady=5, padx=5)
+
 
         ######################################################
         #             Configuración de la gráfica            #
         ######################################################
-        canvas = FigureCanvasTkAgg(self.fig, master=self.root)
-        canvas_widget = canvas.get_tk_widget()
-        canvas_widget.grid(column=3, row=0, padx=5, pady=5, sticky='nsew')
-
-        self.ax.set_xlabel('Time (s)', fontweight='bold')
-        self.ax.set_ylabel('Current (A)', fontweight='bold')
-
-        def update_colorplot(event=None):
-            """Update the plot colors based on the selected theme."""
-            theme = self.root._get_appearance_mode()
-            fig: plt.Figure = self.fig
-            ax: plt.Axes = self.ax
-            line: plt.Line2D = self.line
-
-            if theme.lower() == 'dark':
-                bg_color = "#2E2E2E"  # Fondo oscuro
-                text_color = "#FFFFFF"  # Texto blanco
-                line_color = "#FF5733"  # Línea naranja
-            else:
-                bg_color = "#FFFFFF"  # Fondo claro
-                text_color = "#000000"  # Texto negro
-                line_color = "#007BFF"  # Línea azul
-
-            # Configurar colores del gráfico
-            ax.set_facecolor(bg_color)
-            fig.patch.set_facecolor(bg_color)
-            ax.tick_params(colors=text_color)
-            ax.spines['top'].set_color(text_color)
-            ax.spines['bottom'].set_color(text_color)
-            ax.spines['left'].set_color(text_color)
-            ax.spines['right'].set_color(text_color)
-            ax.xaxis.label.set_color(text_color)
-            ax.yaxis.label.set_color(text_color)
-            ax.xaxis.offsetText.set_color(text_color)
-            ax.yaxis.offsetText.set_color(text_color)
-            ax.title.set_color(text_color)
-
-            # Actualizar la línea del gráfico (si existe)
-            if line:
-                line.set_color(line_color)
-
-            # Redibujar el gráfico
-            fig.canvas.draw_idle()
+        # Hueco del gráfico hasta que setup_plot crea la figura
+        self.plot_placeholder = CTkLabel(self.root, text='Loading plot...', width=640)
+        self.plot_placeholder.grid(column=3, row=0, padx=5, pady=5, sticky='nsew')
 
         ######################################################
         #                 Controles del gráfico              #
@@ -202,9 +222,6 @@ class KeithleyApp:
                 print(f'Error getting integration rate: {e}')
                 self.int_rate.set(1.0)
 
-            while not self.data['thread_available']:
-                print('Waiting for thread to be available...')
-                time.sleep(0.1)
             initialize_device(self)
 
         CTkButton(plot_frame,
@@ -219,10 +236,66 @@ class KeithleyApp:
 
         CTkButton(plot_frame,
                   text='STOP',
-                  command= lambda: stop_plot(self.data),
+                  command= lambda: (stop_recipe(self), stop_plot(self)),
                   fg_color='red',
         ).grid(column=1, row=3, ipady=10, padx=5, pady=10, sticky='w')
 
+        CTkLabel(plot_frame,
+                 text='Acquisition mode:',
+        ).grid(column=0, row=4, padx=5, pady=5, sticky='e')
+        CTkSegmentedButton(plot_frame,
+                           values=['Single', 'Burst'],
+                           variable=self.acq_mode,
+        ).grid(column=1, row=4, padx=5, pady=5, sticky='w')
+
+        CTkLabel(plot_frame,
+                 text='Burst size (readings):',
+        ).grid(column=0, row=5, padx=5, pady=5, sticky='e')
+        CTkEntry(plot_frame,
+                 textvariable=self.burst_size,
+                 width=100,
+        ).grid(column=1, row=5, padx=5, pady=5, sticky='w')
+
+        CTkLabel(plot_frame,
+                 text='Timestamps:',
+        ).grid(column=0, row=6, padx=5, pady=5, sticky='e')
+        CTkSegmentedButton(plot_frame,
+                           values=['Host', 'Instrument'],
+                           variable=self.timestamp_mode,
+        ).grid(column=1, row=6, padx=5, pady=5, sticky='w')
+
+        CTkLabel(plot_frame,
+                 text='Max FPS:',
+        ).grid(column=0, row=7, padx=5, pady=5, sticky='e')
+        CTkEntry(plot_frame,
+                 textvariable=self.max_fps,
+                 width=100,
+        ).grid(column=1, row=7, padx=5, pady=5, sticky='w')
+
+        CTkLabel(plot_frame,
+                 text='Filters:',
+        ).grid(column=0, row=8, padx=5, pady=5, sticky='e')
+        CTkEntry(plot_frame,
+                 textvariable=self.filter_spec,
+                 width=200,
+        ).grid(column=1, row=8, padx=5, pady=5, sticky='w')
+        CTkLabel(plot_frame,
+                 text='e.g. outlier:5, median:5, boxcar:10 (records stay raw)',
+        ).grid(column=0, row=9, columnspan=2, padx=5, pady=5)
+
+        CTkButton(plot_frame,
+                  text='Run recipe',
+                  command=lambda: run_recipe(self),
+        ).grid(column=0, row=10, padx=5, pady=5, sticky='e')
+        CTkButton(plot_frame,
+                  text='Stop recipe',
+                  command=lambda: stop_recipe(self),
+        ).grid(column=1, row=10, padx=5, pady=5, sticky='w')
+        CTkLabel(plot_frame,
+                 textvariable=self.recipe_status,
+                 wraplength=380,
+        ).grid(column=0, row=11, columnspan=2, padx=5, pady=5)
+
         ######################################################
         #               Configuración del device             #
         ######################################################
@@ -264,10 +337,19 @@ class KeithleyApp:
                 new_rate = 0.01
             self.command_integration = f'NPLC {new_rate}'
             print(f'command = {self.command_integration}')
-            while not self.data['thread_available']:
-                print('Waiting for thread to be available...')
-                time.sleep(0.1)
-            send(self.device['selected_device'], self.command_integration, self.data['thread_available'])
+
+            def rate_sent(result):
+                self.data['nplc'] = new_rate
+                for series in self.data['series'].values():
+                    if series['auto'] is not None:
+                        series['auto'].nplc = new_rate   # el ajuste automático continúa desde el valor enviado
+
+            def rate_failed(error):
+                messagebox.showerror('Error', f'Error sending the integration rate: {error}')
+
+            for device, worker in self.workers.items():
+                worker.submit(send, device, self.command_integration,
+                              callback=rate_sent, error_callback=rate_failed)
 
         self.last_data_str = StringVar(value="N/A")  # Variable to store the last data point
 
@@ -279,6 +361,72 @@ class KeithleyApp:
                  font=CTkFont(family='consolas', size=12, weight="bold"),
                  ).grid(column=1, columnspan=2, row=2, pady=5, padx=5, sticky='w')
 
+        self.stats_str = StringVar(value='N/A')  # estadísticas de la medida y de la ventana móvil
+
+        CTkLabel(config_frame,
+                 text='Statistics:',
+                 ).grid(column=0, row=3, pady=5, padx=5, sticky='ne')
+        CTkLabel(config_frame,
+                 textvariable=self.stats_str,
+                 font=CTkFont(family='consolas', size=11),
+                 justify='left',
+                 wraplength=300,
+                 ).grid(column=1, columnspan=2, row=3, pady=5, padx=5, sticky='w')
+
+        CTkLabel(config_frame,
+                 text='Statistics window:',
+                 ).grid(column=0, row=4, pady=5, padx=5, sticky='e')
+        CTkEntry(config_frame,
+                 textvariable=self.stats_window,
+                 width=150,
+                 ).grid(column=1, row=4, pady=5, padx=5, sticky='w')
+        CTkSegmentedButton(config_frame,
+                           values=['Seconds', 'Samples'],
+                           variable=self.stats_window_unit,
+                           ).grid(column=2, row=4, pady=5, padx=5, sticky='w')
+
+        CTkLabel(config_frame,
+                 text='History limit (samples):',
+                 ).grid(column=0, row=5, pady=5, padx=5, sticky='e')
+        CTkEntry(config_frame,
+                 textvariable=self.history_limit,
+                 width=150,
+                 ).grid(column=1, row=5, pady=5, padx=5, sticky='w')
+        CTkLabel(config_frame,
+                 text='0 = unlimited',
+                 ).grid(column=2, row=5, pady=5, padx=5, sticky='w')
+
+        CTkLabel(config_frame,
+                 text='Transfer format:',
+                 ).grid(column=0, row=6, pady=5, padx=5, sticky='e')
+        CTkOptionMenu(config_frame,
+                      values=['ASCII', 'SREAL', 'DREAL'],
+                      variable=self.data_format,
+                      width=150,
+                      ).grid(column=1, row=6, pady=5, padx=5, sticky='w')
+        CTkLabel(config_frame,
+                 text='applied on Initialize',
+                 ).grid(column=2, row=6, pady=5, padx=5, sticky='w')
+
+        CTkLabel(config_frame,
+                 text='Auto NPLC:',
+                 ).grid(column=0, row=7, pady=5, padx=5, sticky='e')
+        CTkSegmentedButton(config_frame,
+                           values=['Off', 'Rate', 'Noise'],
+                           variable=self.auto_nplc,
+                           ).grid(column=1, columnspan=2, row=7, pady=5, padx=5, sticky='w')
+
+        CTkLabel(config_frame,
+                 text='Auto target:',
+                 ).grid(column=0, row=8, pady=5, padx=5, sticky='e')
+        CTkEntry(config_frame,
+                 textvariable=self.auto_target,
+                 width=150,
+                 ).grid(column=1, row=8, pady=5, padx=5, sticky='w')
+        CTkLabel(config_frame,
+                 text='readings/s (Rate) or A (Noise)',
+                 ).grid(column=2, row=8, pady=5, padx=5, sticky='w')
+
 
         ######################################################
         #                   Exportado de datos               #
@@ -319,11 +467,99 @@ class KeithleyApp:
         self.export_name_entry = CTkEntry(export_frame, width=400*0.6, textvariable=self.text['export_name'])
         self.export_name_entry.grid(column=1, row=4, padx=5, pady=5, sticky='w')
 
+        CTkCheckBox(export_frame,
+                    text='Record to file during acquisition',
+                    variable=self.record_to_file,
+        ).grid(column=0, row=5, columnspan=2, padx=5, pady=5)
+
+        CTkLabel(export_frame, text='Sync interval (s)').grid(column=0, row=6, padx=5, pady=5, sticky='e')
+        CTkEntry(export_frame,
+                 textvariable=self.fsync_interval,
+                 width=100,
+        ).grid(column=1, row=6, padx=5, pady=5, sticky='w')
+        icol_rows = 7
+
+        CTkLabel(export_frame, text='Export format').grid(column=0, row=icol_rows, padx=5, pady=5, sticky='e')
+        CTkOptionMenu(export_frame,
+                      values=list(FORMATS),
+                      variable=self.export_format,
+                      width=150,
+        ).grid(column=1, row=icol_rows, padx=5, pady=5, sticky='w')
+        icol_rows += 1
+
         CTkButton(export_frame, text='Export data', 
                   command=lambda: export_data(self), width=400*0.3
-                  ).grid(column=0, row=icol_rows, columnspan=2, padx=5, pady=10)
+                  ).grid(column=0, row=icol_rows, padx=5, pady=10, sticky='e')
+        self.export_cancel_btn = CTkButton(export_frame, text='Cancel',
+                                           command=lambda: cancel_export(self), width=400*0.3,
+                                           state='disabled')
+        self.export_cancel_btn.grid(column=1, row=icol_rows, padx=5, pady=10, sticky='w')
+        icol_rows += 1
+
+        self.export_progress = CTkProgressBar(export_frame, width=400*0.9)
+        self.export_progress.set(0)
+        self.export_progress.grid(column=0, row=icol_rows, columnspan=2, padx=5, pady=5)
+        icol_rows += 1
+        CTkLabel(export_frame, textvariable=self.export_status).grid(column=0, row=icol_rows, columnspan=2, padx=5, pady=5)
+        icol_rows += 1
+
+
+        ######################################################
+        #               Visor de medidas guardadas           #
+        ######################################################
+        viewer_frame = CTkFrame(frm, fg_color='transparent')
+        viewer_frame.grid(column=0, row=icol_rows, columnspan=2, pady=10, padx=10)
+        icol_rows += 1
+
+        CTkLabel(viewer_frame,
+                 text='Saved data',
+                 font=bf_font,
+                 width=400,
+                 ).grid(column=0, row=0, columnspan=2, pady=5, padx=5)
+
+        CTkButton(viewer_frame, text='Open data',
+                  command=lambda: open_data(self), width=400*0.3,
+                  ).grid(column=0, row=1, padx=5, pady=5, sticky='e')
+        CTkButton(viewer_frame, text='Clear overlays',
+                  command=lambda: clear_overlays(self), width=400*0.3,
+                  ).grid(column=1, row=1, padx=5, pady=5, sticky='w')
+        CTkLabel(viewer_frame,
+                 textvariable=self.open_status,
+                 wraplength=380,
+                 ).grid(column=0, row=2, columnspan=2, padx=5, pady=5)
+
+
+        ######################################################
+        #                    Rendimiento                     #
+        ######################################################
+        performance_frame = CTkFrame(frm, fg_color='transparent')
+        performance_frame.grid(column=0, row=icol_rows, columnspan=2, pady=10, padx=10)
         icol_rows += 1
 
+        self.performance_btn = CTkButton(performance_frame,
+                                         text='Performance ▸',
+                                         font=bf_font,
+                                         fg_color='transparent',
+                                         text_color=('black', 'white'),
+                                         hover=False,
+                                         width=400,
+                                         command=lambda: toggle_performance(self))
+        self.performance_btn.grid(column=0, row=0, pady=5, padx=5)
+
+        self.performance_content = CTkFrame(performance_frame, fg_color='transparent')
+        self.performance_content.grid(column=0, row=1, pady=5, padx=5)
+        self.performance_str = StringVar(value='No statistics yet')
+        CTkLabel(self.performance_content,
+                 textvariable=self.performance_str,
+                 font=CTkFont(family='consolas', size=12),
+                 justify='left',
+        ).grid(column=0, row=0, padx=5, pady=5, sticky='w')
+        CTkCheckBox(self.performance_content,
+                    text='Export statistics with data',
+                    variable=self.export_performance,
+        ).grid(column=0, row=1, padx=5, pady=5, sticky='w')
+        self.performance_content.grid_remove()   # plegado al inicio
+
 
         #######################################################
         #               Configuración de los bordes           #
@@ -332,7 +568,9 @@ class KeithleyApp:
         self.list_frames = [devices_selection_frame, 
                             plot_frame,
                             config_frame, 
-                            export_frame]
+                            export_frame,
+                            viewer_frame,
+                            performance_frame]
 
         def update_borders_color(event=None):
             '''Update the border color of the frames based on the current theme.'''
@@ -341,18 +579,64 @@ class KeithleyApp:
                 frame.configure(border_width=2, border_color=border_color)
 
         def check_theme_change():
-            '''Periodically check for theme changes and update the border color.'''
-            update_borders_color()
-            update_colorplot()
+            '''Periodically check for theme changes; borders and plot colors change only with the mode.'''
+            if check_theme(self):
+                update_borders_color()
             self.root.after(500, check_theme_change)  # Check every 500ms
 
         check_theme_change()  # Start the periodic check
+        drain_samples(self)   # Start draining the acquired samples
+        update_performance(self)  # Start refreshing the performance statistics
+
+
+    def setup_plot(self):
+        '''
+        Create the figure and embed its canvas and navigation toolbar in the window
+        '''
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 
+        self.fig, self.line, self.ax = initialize_plot(self)
+        update_plot_colors(self)
+
+        self.plot_placeholder.destroy()
+        canvas = FigureCanvasTkAgg(self.fig, master=self.root)
+        canvas_widget = canvas.get_tk_widget()
+        canvas_widget.grid(column=3, row=0, padx=5, pady=5, sticky='nsew')
+        enable_blitting(self)
+        enable_zoom_decimation(self)
+
+        # Barra de navegación (zoom/pan); mientras está activa no se reajustan los ejes
+        toolbar_frame = Frame(self.root)
+        toolbar_frame.grid(column=3, row=1, padx=5, sticky='ew')
+        self.plot['toolbar'] = NavigationToolbar2Tk(canvas, toolbar_frame)
+
+    def finish_startup(self):
+        '''
+        Start the port discovery and create the plot once the window is shown,
+        printing the startup times (s since the first line of main.py)
+        '''
+        times = {'window': time.perf_counter() - STARTUP_TIME}
+
+        def ports_ready():
+            if not self.discovery.scanned.is_set():
+                self.root.after(50, ports_ready)
+                return
+            times['ports'] = time.perf_counter() - STARTUP_TIME
+            print(f'Startup: ports listed after {times["ports"]:.2f} s')
+
+        self.discovery.start()
+        update_ports(self)   # aplica los eventos de la enumeración al combobox
+        ports_ready()
+        self.setup_plot()
+        times['plot'] = time.perf_counter() - STARTUP_TIME
+        print(f'Startup: window shown after {times["window"]:.2f} s, plot ready after {times["plot"]:.2f} s')
 
     def run(self):
         '''
         Inicia el bucle principal de la aplicación.
         '''
+        self.root.update()   # mostrar la ventana antes de cargar matplotlib y escanear los puertos
+        self.root.after_idle(self.finish_startup)
         self.root.mainloop()
 
 
@@ -0,0 +1,15 @@
+import pytest
+
+from helpers.simulator import SimulatedKeithley
+from helpers.serial_commands import close_all_connections
+
+
+@pytest.fixture
+def simulator():
+    '''Simulated Keithley 6485 without integration latency, closed after the test'''
+    pytest.importorskip('pty')   # el simulador necesita un pseudo-terminal (POSIX)
+    instrument = SimulatedKeithley(current=1e-9, noise=1e-12, latency=False, seed=0)
+    instrument.start()
+    yield instrument
+    close_all_connections()
+    instrument.stop()
@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from helpers.async_serial import AsyncSCPIClient
+from helpers.serial_commands import parse_ascii_values, DEFAULT_ELEMENTS
+from helpers.simulator import IDENTIFICATION
+
+
+async def open_client(port: str, data_format: str = 'ASCII') -> AsyncSCPIClient:
+    client = await AsyncSCPIClient.open(port)
+    await client.send('SYSTem:ZCHeck 0')   # con zero check el simulador devuelve 0 A
+    await client.send('NPLC 0.01')
+    await client.set_data_format(data_format)
+    return client
+
+
+def test_pipelined_responses_keep_order(simulator):
+    async def run():
+        client = await open_client(simulator.port)
+        try:
+            futures = [client.submit(command) for command in ('READ?', '*IDN?', 'READ?', '*OPC?')]
+            await client.writer.drain()
+            return [raw for _, raw in await asyncio.gather(*futures)]
+        finally:
+            await client.close()
+
+    responses = asyncio.run(run())
+    assert responses[1].decode().strip() == IDENTIFICATION
+    assert responses[3].decode().strip() == '1'
+    first, second = (parse_ascii_values(raw.decode(), DEFAULT_ELEMENTS) for raw in (responses[0], responses[2]))
+    assert second['timestamp'][0] > first['timestamp'][0]
+
+
+def test_stream_keeps_depth_in_flight(simulator):
+    async def run():
+        client = await open_client(simulator.port)
+        try:
+            arrivals, timestamps = [], []
+            async for arrived, values in client.stream('READ?', depth=4):
+                arrivals.append(arrived)
+                timestamps.append(values['timestamp'][0])
+                if len(arrivals) == 20:
+                    break
+            # Las respuestas de las consultas canceladas no desordenan las siguientes
+            return arrivals, timestamps, await client.query('*IDN?')
+        finally:
+            await client.close()
+
+    arrivals, timestamps, identification = asyncio.run(run())
+    assert np.all(np.diff(arrivals) >= 0) and np.all(np.diff(timestamps) > 0)
+    assert identification == IDENTIFICATION
+
+
+@pytest.mark.parametrize('data_format', ['SREAL', 'DREAL'])
+def test_binary_block_values(simulator, data_format):
+    async def run():
+        client = await open_client(simulator.port, data_format)
+        try:
+            await client.send('TRIGger:COUNt 200')   # bloques grandes: casi seguro contienen bytes '\n'
+            _, burst = await client.query_values('READ?', 200)
+            await client.send('TRIGger:COUNt 1')
+            _, single = await client.query_values('READ?')
+            return burst, single, await client.query('*OPC?')
+        finally:
+            await client.close()
+
+    burst, single, synchronized = asyncio.run(run())
+    assert burst.dtype.names == ('reading', 'timestamp', 'status') and len(burst) == 200
+    assert np.allclose(burst['reading'], 1e-9, atol=1e-10)
+    assert np.all(np.diff(burst['timestamp']) > 0)
+    assert len(single) == 1 and single['reading'][0] == pytest.approx(1e-9, abs=1e-10)
+    assert synchronized == '1'
+
+
+def test_close_cancels_pending_queries(simulator):
+    async def run():
+        client = await open_client(simulator.port)
+        unanswered = client.submit('NPLC 0.01')   # orden sin respuesta: la consulta nunca se resuelve
+        await client.writer.drain()
+        await asyncio.sleep(0.05)
+        await client.close()
+        await asyncio.sleep(0)
+        return unanswered, client
+
+    unanswered, client = asyncio.run(run())
+    assert unanswered.cancelled()
+    assert client._reader_task.done() and not client._pending
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from helpers.autorate import AutoRate, NPLC_LIMITS
+from helpers.serial_commands import MAX_BURST_POINTS
+
+
+def simulate(auto: AutoRate, seconds: float, overhead: float = 0.002, noise: float = 1e-12,
+             burst: int | None = None, seed: int = 0) -> list[tuple[float, float, int]]:
+    '''
+    Feed AutoRate with the readings of a model instrument: each reading takes
+    NPLC / 50 Hz + `overhead` seconds and its white noise falls as 1 / sqrt(NPLC)
+
+    Returns:
+        list: (time, NPLC, block size) of every block after the changes it caused
+    '''
+    rng = np.random.default_rng(seed)
+    history, now = [], 0.0
+    size = burst or 10
+    while now < seconds:
+        period = auto.nplc / 50 + overhead
+        times = now + period * np.arange(1, size + 1)
+        readings = 1e-9 + noise / np.sqrt(auto.nplc) * rng.standard_normal(size)
+        now = times[-1]
+        auto.update(times, readings)
+        if burst:
+            size = auto.burst_size(size)
+        history.append((now, auto.nplc, size))
+    return history
+
+
+def test_rate_mode_converges_to_the_target_rate():
+    auto = AutoRate('Rate', 100.0, nplc=1.0)
+    history = simulate(auto, 60.0)
+    assert 1 / (auto.nplc / 50 + 0.002) == pytest.approx(100.0, rel=0.2)
+    assert auto.overhead == pytest.approx(0.002, rel=0.1)
+    # Sin oscilaciones una vez alcanzado el objetivo
+    assert len({nplc for now, nplc, _ in history if now > 30.0}) == 1
+
+
+def test_noise_mode_converges_to_the_target_noise():
+    auto = AutoRate('Noise', 5e-13, nplc=0.1)
+    history = simulate(auto, 120.0)
+    assert 1e-12 / np.sqrt(auto.nplc) == pytest.approx(5e-13, rel=0.25)
+    # Cada paso cambia NPLC como mucho un factor 10
+    steps = [b / a for (_, a, _), (_, b, _) in zip(history, history[1:]) if a != b]
+    assert steps and all(0.1 <= step <= 10.0 for step in steps)
+
+
+@pytest.mark.parametrize('mode, target, limit', [('Rate', 10_000.0, NPLC_LIMITS[0]), ('Rate', 0.5, NPLC_LIMITS[1]),
+                                                 ('Noise', 1e-15, NPLC_LIMITS[1]), ('Noise', 1e-9, NPLC_LIMITS[0])])
+def test_unreachable_targets_stop_at_the_nplc_limits(mode, target, limit):
+    auto = AutoRate(mode, target, nplc=1.0)
+    history = simulate(auto, 300.0)
+    assert auto.nplc == limit
+    assert all(NPLC_LIMITS[0] <= nplc <= NPLC_LIMITS[1] for _, nplc, _ in history)
+
+
+def test_burst_size_follows_the_rate_within_the_buffer():
+    auto = AutoRate('Rate', 100.0, nplc=1.0)
+    history = simulate(auto, 60.0, burst=50)
+    assert history[-1][2] == round(auto.expected_rate * auto.burst_time)
+    # Con ráfagas largas y lecturas rápidas el tamaño se limita al buffer del instrumento
+    auto = AutoRate('Rate', 5000.0, nplc=1.0, burst_time=10.0)
+    history = simulate(auto, 60.0, overhead=1e-5, burst=50)
+    assert all(1 <= size <= MAX_BURST_POINTS for _, _, size in history)
+    assert history[-1][2] == MAX_BURST_POINTS
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        AutoRate('Fast', 1.0)
+    with pytest.raises(ValueError):
+        AutoRate('Rate', 0.0)
@@ -0,0 +1,70 @@
+import numpy as np
+
+from helpers.decimation import MinMaxPyramid, minmax_decimate
+from helpers.sample_store import SampleStore
+
+
+def noisy_run(count: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    '''Sorted times and a noisy current with a few isolated spikes'''
+    rng = np.random.default_rng(seed)
+    time = np.cumsum(0.001 + 0.001 * rng.random(count))
+    current = 1e-9 + 1e-12 * rng.standard_normal(count)
+    spikes = rng.choice(count, 10, replace=False)
+    current[spikes] += 1e-10 * rng.choice([-1, 1], 10)
+    return time, current
+
+
+def test_minmax_decimate_keeps_the_extremes_of_each_bucket():
+    time, current = noisy_run(10_000)
+    x, y = minmax_decimate(time, current, 100)
+    assert len(x) == 200 and np.all(np.diff(x) >= 0)
+    buckets = current.reshape(100, -1)
+    assert np.array_equal(np.minimum(y[0::2], y[1::2]), buckets.min(axis=1))
+    assert np.array_equal(np.maximum(y[0::2], y[1::2]), buckets.max(axis=1))
+
+
+def test_pyramid_levels_hold_the_true_min_max_of_each_block():
+    time, current = noisy_run(5_000)
+    samples = SampleStore.from_arrays(time, current)
+    pyramid = MinMaxPyramid(samples, factor=4)
+    pyramid.update()
+    assert len(pyramid.levels) >= 3
+    for level, (mins, maxs) in enumerate(pyramid.levels):
+        block = pyramid.block_size(level)
+        complete = len(current) // block * block
+        buckets = current[:complete].reshape(-1, block)
+        assert np.array_equal(mins.current, buckets.min(axis=1))
+        assert np.array_equal(maxs.current, buckets.max(axis=1))
+        # Cada extremo conserva el instante de la muestra original
+        assert np.array_equal(mins.time, time[block * np.arange(len(buckets)) + buckets.argmin(axis=1)])
+
+
+def test_incremental_updates_equal_a_rebuild():
+    time, current = noisy_run(20_000, seed=1)
+    samples = SampleStore(64)
+    incremental = MinMaxPyramid(samples)
+    rng = np.random.default_rng(2)
+    start = 0
+    while start < len(time):
+        stop = min(start + int(rng.integers(1, 500)), len(time))
+        samples.extend(time[start:stop], current[start:stop])
+        incremental.update()
+        start = stop
+
+    rebuilt = MinMaxPyramid(SampleStore.from_arrays(time, current))
+    rebuilt.update()
+    assert len(incremental.levels) == len(rebuilt.levels)
+    for (mins, maxs), (mins_ref, maxs_ref) in zip(incremental.levels, rebuilt.levels):
+        for store, reference in ((mins, mins_ref), (maxs, maxs_ref)):
+            assert np.array_equal(store.time, reference.time)
+            assert np.array_equal(store.current, reference.current)
+
+
+def test_query_never_hides_a_spike():
+    time, current = noisy_run(100_000, seed=3)
+    samples = SampleStore.from_arrays(time, current)
+    pyramid = MinMaxPyramid(samples)
+    pyramid.update()
+    x, y = pyramid.query(time[0], time[-1], 500)
+    assert len(x) <= 4 * 500
+    assert y.min() == current.min() and y.max() == current.max()
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from helpers.export_commands import CLOCK_COLUMNS, DATA_COLUMNS, format_metadata
+from helpers.exporter import FORMATS, Exporter, snapshot
+from helpers.sample_store import SampleStore
+from helpers.viewer import RunLoader, cache_paths
+
+PORTS = ['/dev/ttyUSB0', '/dev/ttyUSB1']
+
+
+def two_instruments(rows: int = 1000) -> list[SampleStore]:
+    '''One instrument with the clock columns and a shorter one without them'''
+    rng = np.random.default_rng(0)
+    time = np.cumsum(rng.random(rows))
+    clocked = SampleStore(16, instrument_clock=True)
+    clocked.extend(time, 1e-9 + 1e-12 * rng.standard_normal(rows), time + 1e-3, 100.0 + time)
+    plain = SampleStore(16)
+    plain.extend(time[:rows // 2], -1e-9 * rng.random(rows // 2))
+    plain.append(time[rows // 2], np.nan)   # hueco de la adquisición
+    return [clocked, plain]
+
+
+def export(path: str, export_format: str, stores: list[SampleStore], chunk_size: int = 128) -> np.ndarray:
+    '''Export the stores with Exporter and return the matrix that was written'''
+    comments, header = format_metadata('Sample A', 'Round trip', ['Keithley 6485', 'Keithley 6487'], PORTS,
+                                       [DATA_COLUMNS + CLOCK_COLUMNS, DATA_COLUMNS], events=['t=1.000000 s: NPLC 1 -> 0.1'])
+    metadata = {'sample_name': 'Sample A', 'sample_info': 'Round trip', 'ports': PORTS,
+                'columns': header.split('\t'), 'comments': [line for line in comments.splitlines() if line]}
+    exporter = Exporter(path, export_format, [snapshot(store) for store in stores], comments, header, metadata,
+                        chunk_size=chunk_size)
+    exporter.start()
+    assert exporter.done.wait(10) and exporter.error is None
+    expected = np.full((max(len(store) for store in stores), 6), np.nan)
+    expected[:len(stores[0]), :4] = np.column_stack(stores[0].columns())
+    expected[:len(stores[1]), 4:] = np.column_stack(stores[1].columns())
+    return expected
+
+
+def load(path: str, **kwargs) -> dict:
+    loader = RunLoader(path, **kwargs)
+    loader.start()
+    assert loader.done.wait(10) and loader.error is None
+    return loader.result
+
+
+@pytest.mark.parametrize('export_format', list(FORMATS))
+def test_exported_runs_load_back_unchanged(tmp_path, export_format):
+    path = str(tmp_path / f'run{export_format}')
+    expected = export(path, export_format, two_instruments())
+    assert not os.path.exists(path + '.part')
+    # Bloques de texto pequeños: muchas filas cortadas entre dos bloques
+    result = load(path, chunk_size=1000)
+    assert np.array_equal(result['data'], expected, equal_nan=True)
+    assert result['columns'][0] == f'{DATA_COLUMNS[0]} [{PORTS[0]}]' and len(result['columns']) == 6
+    assert result['columns'][-1] == f'{DATA_COLUMNS[1]} [{PORTS[1]}]'
+    assert result['metadata']['sample_name'] == 'Sample A'
+    assert result['metadata']['sample_info'] == 'Round trip'
+
+
+def test_text_cache_is_reused_and_invalidated(tmp_path):
+    path = str(tmp_path / 'run.dat')
+    stores = two_instruments()
+    expected = export(path, '.dat', stores)
+    first = load(path)
+    assert first['source'] == 'text' and all(os.path.exists(cache) for cache in cache_paths(path))
+    assert first['metadata']['events'] == ['t=1.000000 s: NPLC 1 -> 0.1']
+    cached = load(path)
+    assert cached['source'] == 'cache'
+    assert np.array_equal(cached['data'], expected, equal_nan=True)
+
+    # Nueva exportación al mismo nombre: la caché ya no corresponde al fichero
+    stores[1].extend([1e6], [5e-9])
+    expected = export(path, '.dat', stores)
+    reloaded = load(path)
+    assert reloaded['source'] == 'text'
+    assert np.array_equal(reloaded['data'], expected, equal_nan=True)
+    assert load(path)['source'] == 'cache'
+
+    # Mismo tamaño, otra fecha de modificación: también se vuelve a leer el texto
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert load(path)['source'] == 'text'
+
+
+def test_cache_can_be_disabled(tmp_path):
+    path = str(tmp_path / 'run.csv.gz')
+    expected = export(path, '.csv.gz', two_instruments(100))
+    result = load(path, cache=False)
+    assert result['source'] == 'text' and np.array_equal(result['data'], expected, equal_nan=True)
+    assert not any(os.path.exists(cache) for cache in cache_paths(path))
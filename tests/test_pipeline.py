@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from helpers.pipeline import DeviceWorker
+
+
+def wait_results(worker: DeviceWorker, count: int = 1, timeout: float = 2.0) -> list:
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < count and time.monotonic() < deadline:
+        results += worker.pop_results()
+        time.sleep(0.001)
+    return results
+
+
+def wait_until(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+@pytest.fixture
+def worker():
+    worker = DeviceWorker(name='test-worker')
+    yield worker
+    worker.shutdown()
+
+
+def test_error_callback_receives_exception(worker):
+    def boom():
+        raise RuntimeError('no response')
+
+    errors = []
+    worker.submit(boom, error_callback=errors.append)
+    for callback in wait_results(worker):
+        callback()
+    assert len(errors) == 1 and str(errors[0]) == 'no response'
+
+
+def test_callbacks_keep_their_own_result(worker):
+    values = []
+    for i in range(3):
+        worker.submit(lambda i=i: i, callback=values.append)
+    for callback in wait_results(worker, 3):
+        callback()
+    assert values == [0, 1, 2]
+
+
+def test_quick_restart_runs_previous_teardown(worker):
+    calls = []
+    worker.start_acquisition(lambda: time.sleep(0.001), setup=lambda: calls.append('setup 1'),
+                             teardown=lambda: calls.append('teardown 1'))
+    assert wait_until(lambda: worker.acquiring)
+    worker.stop_acquisition()
+    worker.start_acquisition(lambda: time.sleep(0.001), setup=lambda: calls.append('setup 2'),
+                             teardown=lambda: calls.append('teardown 2'))
+    assert wait_until(lambda: 'setup 2' in calls)
+    assert calls == ['setup 1', 'teardown 1', 'setup 2']
+    assert worker.acquiring
+
+
+def test_stop_after_queued_start_wins(worker):
+    calls = []
+    worker.submit(time.sleep, 0.05)   # el arranque queda en cola detrás de esta orden
+    worker.start_acquisition(lambda: None, setup=lambda: calls.append('setup'))
+    worker.stop_acquisition()
+    done = []
+    worker.submit(lambda: None, callback=done.append)
+    assert wait_results(worker)
+    assert calls == [] and not worker.acquiring
+
+
+def test_producer_waits_for_consumer(worker):
+    worker.max_pending = 4
+    worker.start_acquisition(lambda: ([0.0], [1.0]))
+    assert wait_until(lambda: len(worker.samples) >= 4)
+    time.sleep(0.05)
+    assert len(worker.samples) == 4 and worker.stalls == 1
+    assert len(worker.pop_samples()) == 4
+    assert wait_until(lambda: len(worker.samples) >= 4)
+    worker.stop_acquisition()
+    assert wait_until(lambda: not worker.acquiring)
@@ -0,0 +1,125 @@
+import gc, os
+
+import numpy as np
+import pytest
+
+from helpers.decimation import MinMaxPyramid
+from helpers.sample_store import SampleStore, TieredStore
+
+
+def fill(store: SampleStore, count: int, block_sizes: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    '''Append `count` samples (time = index, current = -index) in blocks of the given sizes, cycling'''
+    time = np.arange(count, dtype=np.float64)
+    current = -time
+    start, i = 0, 0
+    while start < count:
+        stop = min(start + block_sizes[i % len(block_sizes)], count)
+        if stop - start == 1:
+            store.append(time[start], current[start])
+        else:
+            store.extend(time[start:stop], current[start:stop])
+        start, i = stop, i + 1
+    return time, current
+
+
+@pytest.mark.parametrize('block_sizes', [[1], [7], [3, 1, 40], [250]])
+def test_ring_keeps_the_last_samples_contiguous(block_sizes):
+    store = SampleStore(100, ring=True)
+    time, current = fill(store, 1037, block_sizes)
+    assert store.total == 1037 and len(store) == 100 and store.first_index == 937
+    # La ventana retenida es una vista contigua aunque haya dado la vuelta al anillo
+    assert np.shares_memory(store.time, store._time) and store.time.flags['C_CONTIGUOUS']
+    assert np.array_equal(store.time, time[-100:]) and np.array_equal(store.current, current[-100:])
+    assert store.first() == (time[937], current[937]) and store.last() == (time[-1], current[-1])
+
+
+def test_ring_bookkeeping_before_the_first_wrap():
+    store = SampleStore(100, ring=True)
+    fill(store, 60, [25])
+    assert (store.total, len(store), store.first_index) == (60, 60, 0)
+    store.extend([], [])
+    assert store.total == 60
+
+
+def test_ring_read_columns_across_the_wrap():
+    store = SampleStore(100, ring=True, instrument_clock=True)
+    time = np.arange(1037, dtype=np.float64)
+    for start in range(0, 1037, 30):
+        block = time[start:start + 30]
+        store.extend(block, -block, block + 0.5, 10 * block)
+    # El anillo da la vuelta en el índice 1000 (posición 0), dentro de este intervalo
+    relative, current, host, instrument = store.read_columns(990, 1060)
+    assert np.array_equal(relative, time[990:1037])
+    assert np.array_equal(current, -time[990:1037])
+    assert np.array_equal(host, time[990:1037] + 0.5) and np.array_equal(instrument, 10 * time[990:1037])
+    # Los índices se recortan a la ventana retenida
+    assert np.array_equal(store.read(0, 950)[0], time[937:950])
+    assert len(store.read(0, 900)[0]) == 0
+    assert store.search(1000.0) == 1000 and store.search(0.0) == 937
+
+
+def test_ring_clear_restarts_the_indices():
+    store = SampleStore(10, ring=True)
+    fill(store, 25, [4])
+    store.clear()
+    assert (store.total, len(store), store.first_index) == (0, 0, 0)
+    time, _ = fill(store, 3, [3])
+    assert np.array_equal(store.time, time)
+
+
+def mapped_files(directory) -> list[str]:
+    '''Lines of /proc/self/maps of the files mapped from a directory (Linux only)'''
+    with open('/proc/self/maps') as maps:
+        return [line for line in maps if str(directory) in line]
+
+
+def test_tiered_store_spills_to_memmap(tmp_path):
+    store = TieredStore(chunk_size=1000, directory=str(tmp_path), instrument_clock=True)
+    time = np.arange(5500, dtype=np.float64)
+    for start in range(0, len(time), 170):
+        block = time[start:start + 170]
+        store.extend(block, -block, block + 0.5, 10 * block)
+    assert store.total == 5500 and store.spilled >= 3000
+    assert all(isinstance(column.base, np.memmap) or isinstance(column, np.memmap)
+               for segment in store._segments for column in segment)
+    assert store.first() == (0.0, 0.0) and store.last() == (5499.0, -5499.0)
+    assert store.current_range() == (-5499.0, 0.0)
+
+
+def test_tiered_store_reads_across_spilled_chunks_and_memory(tmp_path):
+    store = TieredStore(chunk_size=1000, directory=str(tmp_path))
+    time, current = fill(store, 5500, [1, 333])
+    spilled = store.spilled
+    # Dentro de un fragmento: vista del fichero proyectado
+    relative, values = store.read(1100, 1900)
+    assert np.array_equal(relative, time[1100:1900]) and np.array_equal(values, current[1100:1900])
+    # Varios fragmentos y la parte en memoria
+    relative, values = store.read(spilled - 1500, spilled + 200)
+    assert np.array_equal(relative, time[spilled - 1500:spilled + 200])
+    assert np.array_equal(values, current[spilled - 1500:spilled + 200])
+    assert np.array_equal(store.time, time) and np.array_equal(store.current, current)
+    for value in (0.0, 999.5, 1000.0, spilled - 0.5, spilled + 10.0, 5499.0):
+        assert store.search(value) == np.searchsorted(time, value)
+        assert store.search(value, side='right') == np.searchsorted(time, value, side='right')
+    # El envolvente de un almacén por niveles cruza también los fragmentos
+    pyramid = MinMaxPyramid(store)
+    pyramid.update()
+    x, y = pyramid.query(0.0, 5499.0, 100)
+    assert y.min() == current.min() and y.max() == current.max()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/maps'), reason='needs /proc/self/maps')
+def test_tiered_store_cleans_up_its_spill_files(tmp_path):
+    store = TieredStore(chunk_size=1000, directory=str(tmp_path))
+    fill(store, 5500, [500])
+    # Los ficheros se desvinculan al crearlos: solo quedan las proyecciones en memoria
+    assert os.listdir(tmp_path) == []
+    assert len(mapped_files(tmp_path)) == len(store._segments) > 0
+    store.clear()
+    gc.collect()
+    assert store.spilled == 0 and mapped_files(tmp_path) == []
+    fill(store, 2500, [500])
+    assert store.spilled > 0
+    del store
+    gc.collect()
+    assert mapped_files(tmp_path) == []
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from helpers.sequencer import compile_recipe, load_recipe, send_block, describe_block
+from helpers.serial_commands import batch_messages, query_raw, MAX_BURST_POINTS
+
+RECIPE = {
+    'name': 'NPLC sweep',
+    'mode': 'Burst', 'burst_size': 200,
+    'init': {'nplc': 1, 'format': 'sreal', 'commands': ['SYSTem:ZCHeck 0']},
+    'steps': [
+        {'nplc': 0.1, 'dwell': 2},
+        {'acquire': 30, 'label': 'fast'},
+        {'commands': ['DISPlay:ENABle 1']},
+        {'nplc': 10, 'acquire': 60, 'mode': 'single', 'label': 'slow'},
+        {'commands': ['DISPlay:ENABle 0'], 'label': 'end'},
+    ],
+}
+
+
+def test_init_is_merged_with_the_first_step():
+    init, *_ = compile_recipe(RECIPE)
+    assert init['init'] and init['format'] == 'SREAL'
+    # El NPLC del paso 1 sustituye al de init: se envía con la inicialización, sin orden aparte
+    assert init['nplc'] == 0.1 and init['commands'] == ['SYSTem:ZCHeck 0']
+    assert (init['dwell'], init['acquire']) == (2.0, 0.0)
+
+
+def test_steps_are_split_at_dwell_and_acquire():
+    blocks = compile_recipe(RECIPE)
+    assert [block['label'] for block in blocks] == ['step 1', 'fast', 'slow', 'end']
+    _, fast, slow, end = blocks
+    assert fast['commands'] == [] and fast['acquire'] == 30.0
+    assert (fast['mode'], fast['burst_size']) == ('Burst', 200)
+    # Los pasos sin espera ni adquisición van en el bloque siguiente, NPLC después de sus órdenes
+    assert slow['commands'] == ['DISPlay:ENABle 1', 'NPLC 10'] and slow['nplc'] == 10.0
+    assert (slow['mode'], slow['acquire']) == ('Single', 60.0)
+    assert end['commands'] == ['DISPlay:ENABle 0'] and not end['acquire'] and not end['init']
+    assert describe_block(fast) == 'fast: acquire 30 s (Burst 200)'
+
+
+def test_recipe_without_init():
+    blocks = compile_recipe({'steps': [{'nplc': 0.5}, {'acquire': 5}]})
+    assert len(blocks) == 1 and not blocks[0]['init']
+    assert blocks[0]['commands'] == ['NPLC 0.5'] and blocks[0]['mode'] is None
+
+
+@pytest.mark.parametrize('recipe, message', [
+    ([], 'list of "steps"'),
+    ({'steps': [{'nplc': 0}]}, 'step 1: "nplc" must be positive'),
+    ({'steps': [{'acquire': 1}, {'dwel': 2}]}, 'step 2: unknown key "dwel"'),
+    ({'steps': [{'commands': ['READ?']}]}, 'queries are not allowed'),
+    ({'steps': [{'commands': 'NPLC 1'}]}, '"commands" must be a list'),
+    ({'mode': 'Fast', 'steps': []}, '"mode" must be one of'),
+    ({'steps': [{'acquire': 1, 'burst_size': MAX_BURST_POINTS + 1}]}, 'step 1: "burst_size"'),
+    ({'init': {'format': 'HEX'}, 'steps': []}, 'init: "format"'),
+])
+def test_invalid_recipes_raise_value_error(recipe, message):
+    with pytest.raises(ValueError, match=message):
+        compile_recipe(recipe)
+
+
+def test_load_recipe(tmp_path):
+    path = tmp_path / 'sweep.json'
+    path.write_text(json.dumps(RECIPE))
+    name, blocks = load_recipe(str(path))
+    assert name == 'NPLC sweep' and blocks == compile_recipe(RECIPE)
+    path.write_text(json.dumps({'steps': [{'acquire': 1}]}))
+    assert load_recipe(str(path))[0] == 'sweep'
+    path.write_text('{"steps": [')
+    with pytest.raises(ValueError):
+        load_recipe(str(path))
+
+
+def test_send_blocks_to_the_simulator(simulator):
+    nplc = None
+    for block in compile_recipe(RECIPE):
+        assert send_block(simulator.port, block) is block
+        assert query_raw(simulator.port, '*OPC?') == '1'
+        nplc = block['nplc'] or nplc   # los bloques sin NPLC mantienen el anterior
+        assert simulator.nplc == nplc
+    assert not simulator.zero_check and not simulator.display
+    assert simulator.data_format == 'SRE' and not simulator.errors
+
+
+def test_batch_messages_single_message():
+    assert batch_messages(['*RST', 'NPLC 1', ':TRIG:COUN 1']) == ['*RST;:NPLC 1;:TRIG:COUN 1;*OPC?']
+    assert batch_messages([]) == ['*OPC?']
+
+
+def test_batch_messages_split():
+    commands = [f'TRACe:POINts {i}' for i in range(30)]
+    messages = batch_messages(commands, max_length=60)
+    assert len(messages) > 1
+    assert all(len(message) <= 60 for message in messages)
+    assert messages[-1].endswith(';*OPC?') and sum(message.count('*OPC?') for message in messages) == 1
+    sent = ';'.join(messages).split(';')[:-1]
+    assert sent == [':' + command for command in commands]
@@ -0,0 +1,111 @@
+import io, json
+
+import numpy as np
+import pytest
+import serial
+
+from helpers import serial_commands
+from helpers.serial_commands import (list_ports, initialize_instrument, query_values, query_raw, configure_burst,
+                                     configure_single, read_burst, start_trace, stop_trace, close_all_connections,
+                                     DATA_FORMATS, MAX_BURST_POINTS, VIRTUAL_PORTS_ENV)
+from helpers.simulator import SimulatedKeithley, load_trace
+
+
+def test_registered_port_is_listed(simulator):
+    ports = {info.device: info.description for info in list_ports()}
+    assert ports[simulator.port] == 'Simulated Keithley 6485'
+
+
+def test_environment_port_is_listed(simulator, monkeypatch, tmp_path):
+    serial_commands.unregister_virtual_port(simulator.port)
+    missing = str(tmp_path / 'missing')
+    monkeypatch.setenv(VIRTUAL_PORTS_ENV, f'{simulator.port}:{missing}')
+    devices = [info.device for info in list_ports()]
+    assert simulator.port in devices and missing not in devices
+
+
+@pytest.mark.parametrize('data_format', list(DATA_FORMATS))
+def test_initialize_instrument(simulator, data_format):
+    initialize_instrument(simulator.port, 0.01, data_format)
+    assert query_raw(simulator.port, '*OPC?') == '1'   # órdenes anteriores ejecutadas
+    assert simulator.nplc == 0.01
+    assert not simulator.display and not simulator.zero_check
+    assert simulator.data_format == DATA_FORMATS[data_format][0][:3].upper()
+    assert not simulator.errors
+
+
+@pytest.mark.parametrize('data_format', list(DATA_FORMATS))
+def test_query_values(simulator, data_format):
+    initialize_instrument(simulator.port, 0.01, data_format)
+    values = query_values(simulator.port, 'READ?')
+    assert values.dtype.names == ('reading', 'timestamp', 'status')
+    assert len(values) == 1
+    assert values['reading'][0] == pytest.approx(1e-9, abs=1e-10)
+
+
+@pytest.mark.parametrize('data_format', list(DATA_FORMATS))
+def test_read_burst(simulator, data_format):
+    initialize_instrument(simulator.port, 0.01, data_format)
+    configure_burst(simulator.port, 50)
+    start, end, values = read_burst(simulator.port, 50, 0.01)
+    assert len(values) == 50 and end >= start
+    assert np.all(np.diff(values['timestamp']) > 0)
+    assert np.allclose(values['reading'], 1e-9, atol=1e-10)
+    configure_single(simulator.port)
+    assert len(query_values(simulator.port, 'READ?')) == 1 and simulator.trigger_count == 1
+
+
+def test_read_burst_is_capped_at_buffer_size(simulator):
+    initialize_instrument(simulator.port, 0.01, 'SREAL')
+    configure_burst(simulator.port, MAX_BURST_POINTS + 100)
+    assert simulator.trigger_count == MAX_BURST_POINTS
+    _, _, values = read_burst(simulator.port, MAX_BURST_POINTS + 100, 0.01)
+    assert len(values) == MAX_BURST_POINTS
+
+
+def test_replay_batched_trace(tmp_path):
+    pytest.importorskip('pty')
+    trace = str(tmp_path / 'trace.jsonl')
+    with SimulatedKeithley(current=5e-9, latency=False, seed=1) as instrument:
+        start_trace(trace)
+        initialize_instrument(instrument.port, 0.01, 'SREAL')
+        recorded = query_values(instrument.port, 'TRIGger:COUNt 1;:READ?')['reading'][0]
+        stop_trace()
+        close_all_connections()
+    with open(trace, encoding='utf-8') as f:
+        assert any(';*OPC?' in json.loads(line)['data'] for line in f)
+
+    responses = load_trace(trace)
+    with SimulatedKeithley(current=1e-3, latency=False, replay=trace) as instrument:
+        initialize_instrument(instrument.port, 0.01, 'SREAL')
+        assert instrument.data_format == 'SRE'   # las órdenes del mensaje grabado se ejecutan
+        # Mensaje agrupado con consulta: se responde con la lectura grabada, no con 1 mA
+        assert query_values(instrument.port, 'TRIGger:COUNt 1;:READ?')['reading'][0] == recorded
+        close_all_connections()
+    assert len(responses) == 2
+
+
+def test_query_returns_the_first_element(simulator):
+    initialize_instrument(simulator.port, 0.01, 'ASCII')
+    assert float(serial_commands.query(simulator.port, 'SYSTem:ZCHeck 0;:READ?')) == pytest.approx(1e-9, abs=1e-10)
+    assert serial_commands.query(simulator.port, '*IDN?') == 'KEITHLEY INSTRUMENTS INC.'
+
+
+@pytest.mark.parametrize('response, value', [('+1.234E-09A,+1.2E+02,+0.0E+00', '+1.234E-09'),
+                                             ('-2.5E-12', '-2.5E-12'), ('SRE', 'SRE'), ('1', '1')])
+def test_query_strips_only_unit_suffixes(monkeypatch, response, value):
+    monkeypatch.setattr(serial_commands, 'query_raw', lambda serial_com, command: response)
+    assert serial_commands.query('COM1', 'READ?') == value
+
+
+@pytest.mark.parametrize('response', [b'', b'#', b'#4', b'#41'])
+def test_short_block_header_times_out(response):
+    with pytest.raises(serial.SerialTimeoutException, match=r'READ\?'):
+        serial_commands._read_block(io.BytesIO(response), 12, 'READ?')
+
+
+@pytest.mark.parametrize('response', [b'+1.0E-09\r', b'#2a4'])
+def test_malformed_block_header(response):
+    with pytest.raises(serial.SerialException, match=r'READ\?') as error:
+        serial_commands._read_block(io.BytesIO(response), 12, 'READ?')
+    assert not isinstance(error.value, serial.SerialTimeoutException)
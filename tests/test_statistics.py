@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from helpers.statistics import Moments, RunningStats, RollingStats
+
+
+def random_blocks(rng: np.random.Generator, count: int, max_size: int = 40) -> list[tuple[np.ndarray, np.ndarray]]:
+    '''Consecutive blocks of random size of a ~1 nA current with pA noise and a small drift'''
+    blocks, start = [], 0.0
+    for size in rng.integers(1, max_size, count):
+        times = start + 0.01 * np.arange(1, size + 1) + 1e-4 * rng.random(size)
+        values = 1e-9 + 2e-13 * times + 1e-12 * rng.standard_normal(size)
+        blocks.append((times, values))
+        start = times[-1]
+    return blocks
+
+
+def assert_matches(summary: dict, times: np.ndarray, values: np.ndarray):
+    assert summary['count'] == len(values)
+    assert summary['mean'] == pytest.approx(np.mean(values), rel=1e-12)
+    assert summary['std'] == pytest.approx(np.sqrt(np.var(values, ddof=1)), rel=1e-8)
+    assert summary['min'] == values.min() and summary['max'] == values.max()
+    assert summary['drift'] == pytest.approx(np.polyfit(times, values, 1)[0], rel=1e-6)
+
+
+def test_chan_merge_equals_whole_block():
+    rng = np.random.default_rng(1)
+    (times, values), = random_blocks(rng, 1, max_size=1000)
+    split = len(values) // 3
+    merged = Moments.of(times[:split], values[:split])
+    merged.merge(Moments.of(times[split:], values[split:]))
+    whole = Moments.of(times, values)
+    for name in Moments.__slots__:
+        assert getattr(merged, name) == pytest.approx(getattr(whole, name), rel=1e-9, abs=1e-30)
+    # remove() deshace merge()
+    merged.remove(Moments.of(times[split:], values[split:]))
+    first = Moments.of(times[:split], values[:split])
+    for name in Moments.__slots__:
+        assert getattr(merged, name) == pytest.approx(getattr(first, name), rel=1e-6, abs=1e-30)
+
+
+def test_running_stats_match_numpy():
+    rng = np.random.default_rng(2)
+    blocks = random_blocks(rng, 50)
+    stats = RunningStats()
+    for i, (times, values) in enumerate(blocks):
+        stats.update(times, values)
+        assert_matches(stats.summary(), np.concatenate([b[0] for b in blocks[:i + 1]]),
+                       np.concatenate([b[1] for b in blocks[:i + 1]]))
+
+
+def test_running_stats_skip_nan():
+    stats = RunningStats()
+    stats.update([0.0, 1.0, 2.0], [1e-9, np.nan, 3e-9])
+    summary = stats.summary()
+    assert summary['count'] == 2 and summary['mean'] == pytest.approx(2e-9)
+    assert summary['drift'] == pytest.approx(1e-9)
+
+
+def test_rolling_samples_window_across_blocks():
+    rng = np.random.default_rng(3)
+    blocks = random_blocks(rng, 400)
+    stats = RollingStats(samples=100)
+    times, values = np.empty(0), np.empty(0)
+    for block_times, block_values in blocks:
+        stats.update(block_times, block_values)
+        times, values = np.append(times, block_times), np.append(values, block_values)
+        # La ventana corta casi siempre un bloque por la mitad
+        if len(values) > 1:
+            assert_matches(stats.summary(), times[-100:], values[-100:])
+
+
+def test_rolling_seconds_window_across_blocks():
+    rng = np.random.default_rng(4)
+    blocks = random_blocks(rng, 400)
+    stats = RollingStats(seconds=1.5)
+    times, values = np.empty(0), np.empty(0)
+    for block_times, block_values in blocks:
+        stats.update(block_times, block_values)
+        times, values = np.append(times, block_times), np.append(values, block_values)
+        window = times >= times[-1] - 1.5
+        if window.sum() > 1:
+            assert_matches(stats.summary(), times[window], values[window])
+
+
+def test_rolling_window_shorter_than_a_block():
+    values = np.arange(10.0) * 1e-9
+    stats = RollingStats(samples=3)
+    stats.update(np.arange(10.0), values)
+    summary = stats.summary()
+    assert summary['count'] == 3
+    assert (summary['min'], summary['max']) == (values[7], values[9])
+    assert summary['mean'] == pytest.approx(values[8])